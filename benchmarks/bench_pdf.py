@@ -0,0 +1,127 @@
+"""Benchmark extracting the retailer list from the register PDF.
+
+Times 'get_providers.extract_pdf_data' against the line-pairing extractor it replaced,
+on the saved copy of the register and on a longer document made by repeating its table
+pages before the change log (and adding a page after it, which must not be read):
+
+    python benchmarks/bench_pdf.py [--pdf archive/retailer_uri_register.pdf] [--copies 40] [--repeat 5]
+
+Both extractors must find the same providers in the register, and the parallel one must
+find every repeated row of the longer document and none after the change log.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fitz  # noqa: E402
+from get_providers import extract_pdf_data  # noqa: E402
+
+
+def extract_lines(data):
+    """
+    The previous extractor: pair each line of text with the following URI line, page by
+    page.
+
+    Args:
+        data (bytes): The PDF.
+
+    Returns:
+        list of dict: A list of dictionaries containing retailer 'brand' and 'uri'.
+    """
+    retailer_data = []
+    with fitz.open(stream=data, filetype="pdf") as pdf:
+        for page_num in range(pdf.page_count):
+            lines = pdf.load_page(page_num).get_text("text").split('\n')
+            i = 0
+            while i < len(lines) - 1:
+                if "Change log" in lines[i]:
+                    break
+                brand, uri = lines[i].strip(), lines[i + 1].strip()
+                if uri.lower().startswith('http') and 'placeholder' not in uri.lower():
+                    retailer_data.append({'brand': brand, 'uri': uri})
+                    i += 2
+                else:
+                    i += 1
+    return retailer_data
+
+
+def repeated_register(data, copies):
+    """
+    Args:
+        data (bytes): The register PDF, whose last page holds the change log.
+        copies (int): The number of times its other pages are repeated.
+
+    Returns:
+        bytes: The longer PDF.
+    """
+    with fitz.open(stream=data, filetype="pdf") as register, fitz.open() as pdf:
+        last = register.page_count - 1
+        for _ in range(copies):
+            pdf.insert_pdf(register, from_page=0, to_page=last - 1)
+        pdf.insert_pdf(register, from_page=last, to_page=last)
+        pdf.insert_pdf(register, from_page=0, to_page=0)  # After the change log
+        return pdf.tobytes()
+
+
+def best_time(function, repeat):
+    """
+    Args:
+        function (callable): The function to time.
+        repeat (int): The number of runs.
+
+    Returns:
+        tuple: The result of the last run, and the median run time in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark extracting the retailer list from the register PDF.")
+    parser.add_argument("--pdf", default=os.path.join(ROOT, "archive", "retailer_uri_register.pdf"),
+                        help="The register PDF (default: archive/retailer_uri_register.pdf).")
+    parser.add_argument("--copies", type=int, default=40, help="Repeats of the table pages (default: 40).")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each extractor (default: 5).")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per CPU).")
+    args = parser.parse_args()
+
+    with open(args.pdf, "rb") as file:
+        register = file.read()
+    failed = False
+
+    lines, lines_time = best_time(lambda: extract_lines(register), args.repeat)
+    words, words_time = best_time(lambda: extract_pdf_data(register, workers=args.workers), args.repeat)
+    print(f"register ({len(words)} providers): lines {lines_time * 1000:.1f} ms, words {words_time * 1000:.1f} ms")
+    if words != lines:
+        failed = True
+        print("  MISMATCH between the extractors")
+
+    longer = repeated_register(register, args.copies)
+    with fitz.open(stream=longer, filetype="pdf") as pdf:
+        page_count = pdf.page_count
+    with fitz.open(stream=register, filetype="pdf") as pdf, fitz.open() as last_page:
+        last_page.insert_pdf(pdf, from_page=pdf.page_count - 1)
+        last_rows = len(extract_lines(last_page.tobytes()))
+    expected = args.copies * (len(lines) - last_rows) + last_rows
+    _, serial_time = best_time(lambda: extract_pdf_data(longer, pages_per_worker=page_count), args.repeat)
+    rows, parallel_time = best_time(lambda: extract_pdf_data(longer, workers=args.workers), args.repeat)
+    print(f"{page_count} pages ({len(rows)} providers): serial {serial_time * 1000:.1f} ms, "
+          f"parallel {parallel_time * 1000:.1f} ms ({serial_time / parallel_time:.2f}x)")
+    if len(rows) != expected:
+        failed = True
+        print(f"  expected {expected} providers")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
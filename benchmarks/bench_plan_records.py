@@ -0,0 +1,200 @@
+"""Benchmark loading the plan lists of all brands as plan records.
+
+Compares reading every 'plans.json' in turn into one list of plan dicts, as consumers
+such as 'archive/electricity_plan_search.py' do, with 'plan_records.py':
+
+- legacy: a serial 'load_json' of every brand's plan list.
+- serial: 'PlanRecords.load' with one process, parsing every plan list.
+- parallel: 'PlanRecords.load' with up to '--workers' processes, parsing every plan list.
+- saved: 'PlanRecords.load' from the 'plans.records.json' saved by the loads above, as
+  in a new process.
+- cached: a repeated 'load_plan_records' of the unchanged store.
+
+For each the time taken and the memory the loaded plans hold (measured with
+'tracemalloc' in a separate pass) are reported, and the plans found at a few postcodes
+are checked to match, and the time taken to find them. By default a synthetic store of plan lists shaped like CDR
+responses is written, in which the plans of a distributor share its postcodes as they
+do in real lists. Pass '--source' to load an existing store instead:
+
+    python benchmarks/bench_plan_records.py [--brands 40] [--plans 500] [--workers 4] [--source brands]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import plan_records  # noqa: E402
+import storage  # noqa: E402
+from bench_storage import synthetic_plan_details  # noqa: E402
+from mock_cdr import LIST_FIELDS  # noqa: E402
+
+DISTRIBUTORS = ("Ausgrid", "Endeavour Energy", "Essential Energy")
+
+
+def write_synthetic_store(directory, brands, plans):
+    """
+    Write a store of synthetic plan lists.
+
+    Args:
+        directory (str): The root of the store.
+        brands (int): The number of brands.
+        plans (int): The number of plans of each brand.
+    """
+    rng = random.Random(0)
+    areas = {distributor: sorted(str(postcode) for postcode in rng.sample(range(2000, 3000), 400))
+             for distributor in DISTRIBUTORS}
+    for number in range(brands):
+        brand = f"brand_{number:03d}"
+        plan_list = []
+        for index in range(plans):
+            data = synthetic_plan_details(number * plans + index)["data"]
+            distributor = data["geography"]["distributors"][0]
+            data["planId"] = f"BRAND{number:03d}{index:06d}@EME"
+            data["geography"]["includedPostcodes"] = areas[distributor]
+            plan_list.append({field: data[field] for field in LIST_FIELDS if field in data})
+        os.makedirs(os.path.join(directory, brand))
+        storage.save_json(os.path.join(directory, brand, "plans.json"), plan_list)
+
+
+def remove_records_files(directory):
+    """
+    Args:
+        directory (str): The root of the store, whose saved plan records are removed.
+    """
+    for brand in os.listdir(directory):
+        records_file = os.path.join(directory, brand, plan_records.RECORDS_NAME)
+        if os.path.isfile(records_file):
+            os.remove(records_file)
+
+
+def parse(directory, workers):
+    """
+    Args:
+        directory (str): The root of the store.
+        workers (int): The maximum number of worker processes.
+
+    Returns:
+        PlanRecords: The records, loaded by parsing every plan list.
+    """
+    remove_records_files(directory)
+    return plan_records.PlanRecords.load(directory, workers=workers)
+
+
+def load_plans_from_all_brands(directory):
+    """
+    Args:
+        directory (str): The root of the store.
+
+    Returns:
+        list: Every listed plan of every brand, as parsed from 'plans.json'.
+    """
+    plans = []
+    for brand in sorted(os.listdir(directory)):
+        plans_file = os.path.join(directory, brand, "plans.json")
+        if os.path.isfile(plans_file):
+            plans.extend(storage.load_json(plans_file))
+    return plans
+
+
+def legacy_plans_at_postcode(plans, postcode):
+    """
+    Args:
+        plans (list): Plans as returned by 'load_plans_from_all_brands'.
+        postcode (str): An Australian postcode.
+
+    Returns:
+        set: The IDs of the plans offered at the postcode.
+    """
+    plan_ids = set()
+    for plan in plans:
+        geography = plan.get("geography") or {}
+        included = geography.get("includedPostcodes")
+        if postcode not in (geography.get("excludedPostcodes") or ()) and (not included or postcode in included):
+            plan_ids.add(plan["planId"])
+    return plan_ids
+
+
+def measure(load):
+    """
+    Args:
+        load (callable): Loads and returns the plans.
+
+    Returns:
+        tuple: The loaded plans, the seconds taken and the bytes they hold.
+    """
+    gc.collect()
+    started = time.perf_counter()
+    loaded = load()
+    seconds = time.perf_counter() - started
+    del loaded
+    gc.collect()
+    tracemalloc.start()
+    loaded = load()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return loaded, seconds, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading the plan lists of all brands.")
+    parser.add_argument("--brands", type=int, default=40, help="Number of synthetic brands (default: 40).")
+    parser.add_argument("--plans", type=int, default=500, help="Plans per synthetic brand (default: 500).")
+    parser.add_argument("--workers", type=int, help="Maximum worker processes (default: one per CPU).")
+    parser.add_argument("--source", help="Load the plan lists of this store instead of synthetic ones.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-records-") as temporary:
+        directory = args.source
+        if directory is None:
+            directory = temporary
+            write_synthetic_store(directory, args.brands, args.plans)
+        size = sum(os.path.getsize(os.path.join(directory, brand, "plans.json"))
+                   for brand in os.listdir(directory) if os.path.isfile(os.path.join(directory, brand, "plans.json")))
+
+        plans, legacy_seconds, legacy_held = measure(lambda: load_plans_from_all_brands(directory))
+        print(f"{len(plans)} plans, {size / 2 ** 20:.1f} MB of plans.json, {os.cpu_count()} CPUs")
+        print(f"{'loader':<10} {'seconds':>9} {'speedup':>8} {'held MB':>8} {'vs legacy':>10}")
+        print(f"{'legacy':<10} {legacy_seconds:>9.3f} {1:>7.2f}x {legacy_held / 2 ** 20:>8.1f} {1:>9.0%}")
+
+        records = None
+        for name, load in (
+            ("serial", lambda: parse(directory, 1)),
+            ("parallel", lambda: parse(directory, args.workers)),
+            ("saved", lambda: plan_records.PlanRecords.load(directory, workers=args.workers)),
+            ("cached", lambda: plan_records.load_plan_records(directory, workers=args.workers)),
+        ):
+            records = None
+            if name == "cached":
+                plan_records.load_plan_records(directory, workers=args.workers)  # Load it once first
+            records, seconds, held = measure(load)
+            print(f"{name:<10} {seconds:>9.3f} {legacy_seconds / seconds:>7.2f}x {held / 2 ** 20:>8.1f} "
+                  f"{held / legacy_held:>9.0%}")
+
+        mismatched = len(records) != len(plans)
+        legacy_seconds = seconds = 0
+        for postcode in ("2000", "2500", "2999", "0872"):
+            started = time.perf_counter()
+            expected = legacy_plans_at_postcode(plans, postcode)
+            legacy_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            found = records.at_postcode(postcode)
+            seconds += time.perf_counter() - started
+            found = {record.plan_id for record in found}
+            if found != expected:
+                print(f"Mismatch at {postcode}: {len(found)} plans instead of {len(expected)}")
+                mismatched = True
+        print(f"at_postcode: {seconds / 4 * 1000:.2f} ms per postcode, legacy {legacy_seconds / 4 * 1000:.2f} ms")
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Benchmark the storage formats of the brands/ store.
+
+Writes the same plan detail documents in every available storage format and reports the
+bytes written, the disk space allocated (which includes the block each small file
+rounds up to) and the time taken to write and read them all back.
+
+By default synthetic plan details shaped like CDR responses are used. Pass '--source' to
+benchmark the plan details of an existing store instead:
+
+    python benchmarks/bench_storage.py [--plans 5000] [--source brands]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+
+def synthetic_plan_details(index):
+    """
+    Build plan details shaped like a CDR 'EnergyPlanDetail' response.
+
+    Args:
+        index (int): The number of the plan, which seeds its contents.
+
+    Returns:
+        dict: The plan details.
+    """
+    rng = random.Random(index)
+    plan_id = f"BRAND{index:06d}MRE{rng.randint(1, 9)}@EME"
+    rates = [
+        {"unitPrice": f"{rng.uniform(0.15, 0.45):.4f}", "volume": rng.choice([None, 3900, 11000])}
+        for _ in range(rng.randint(1, 3))
+    ]
+    time_of_use = [
+        {
+            "displayName": name,
+            "rates": rates,
+            "timeOfUse": [{"days": ["MON", "TUE", "WED", "THU", "FRI"], "startTime": start, "endTime": end}],
+            "type": name.upper(),
+        }
+        for name, start, end in (("Peak", "15:00", "21:00"), ("Off peak", "21:00", "15:00"))
+    ]
+    return {
+        "data": {
+            "planId": plan_id,
+            "effectiveFrom": "2024-07-01T00:00:00Z",
+            "lastUpdated": "2024-06-20T02:13:45Z",
+            "displayName": f"Flexible Saver {index}",
+            "description": "A market offer with no lock-in contract and a pay on time discount.",
+            "type": "MARKET",
+            "fuelType": "ELECTRICITY",
+            "brand": "brand",
+            "brandName": "Brand Energy",
+            "applicationUri": "https://www.example.com.au/energy/plans",
+            "additionalInformation": {"overviewUri": "https://www.example.com.au/overview"},
+            "customerType": rng.choice(["RESIDENTIAL", "BUSINESS"]),
+            "geography": {
+                "distributors": [rng.choice(["Ausgrid", "Endeavour Energy", "Essential Energy"])],
+                "includedPostcodes": sorted(str(rng.randint(2000, 2999)) for _ in range(rng.randint(50, 400))),
+            },
+            "electricityContract": {
+                "pricingModel": "TIME_OF_USE",
+                "isFixed": False,
+                "paymentOption": ["DIRECT_DEBIT", "CREDIT_CARD", "BPAY"],
+                "onExpiryDescription": "Your plan will continue on the same terms.",
+                "fees": [{"type": "LATE_PAYMENT", "term": "FIXED", "amount": "12.00"}],
+                "tariffPeriod": [
+                    {
+                        "displayName": "All year",
+                        "startDate": "01-01",
+                        "endDate": "12-31",
+                        "dailySupplyCharges": f"{rng.uniform(0.8, 1.4):.4f}",
+                        "rateBlockUType": "timeOfUseRates",
+                        "timeOfUseRates": time_of_use,
+                    }
+                ],
+                "solarFeedInTariff": [
+                    {"displayName": "Solar", "scheme": "OTHER", "payerType": "RETAILER",
+                     "tariffUType": "singleTariff", "singleTariff": {"rates": [{"unitPrice": "0.05"}]}}
+                ],
+            },
+        },
+        "links": {"self": f"https://cdr.energymadeeasy.gov.au/brand/cds-au/v1/energy/plans/{plan_id}"},
+        "meta": {"lastDownloaded": "2024-06-21T00:00:00.000Z", "etag": f'"{rng.getrandbits(64):x}"'},
+    }
+
+
+def load_source_plan_details(source, limit):
+    """
+    Load plan details from an existing store.
+
+    Args:
+        source (str): The root of the store.
+        limit (int): The maximum number of plan details to load.
+
+    Returns:
+        list: The plan details.
+    """
+    documents = []
+    for brand in sorted(os.listdir(source)):
+        brand_directory = os.path.join(source, brand)
+        if not os.path.isdir(brand_directory):
+            continue
+        for name in sorted(os.listdir(brand_directory)):
+            if name != "plans.json" and storage.is_store_document(name):
+                documents.append(storage.load_json(os.path.join(brand_directory, name)))
+                if len(documents) >= limit:
+                    return documents
+    return documents
+
+
+def bench_format(directory, storage_format, documents):
+    """
+    Write and read back documents in one storage format.
+
+    Args:
+        directory (str): An empty directory to write the documents to.
+        storage_format (str): The storage format to benchmark.
+        documents (list): The plan details to write.
+
+    Returns:
+        tuple: The bytes written, the bytes allocated on disk, the write time and the
+        read time in seconds.
+    """
+    filenames = [os.path.join(directory, f"{index}.json") for index in range(len(documents))]
+    started = time.perf_counter()
+    for filename, document in zip(filenames, documents):
+        storage.save_json(filename, document, storage_format)
+    write_time = time.perf_counter() - started
+
+    size = allocated = 0
+    for filename in filenames:
+        stat = os.stat(filename)
+        size += stat.st_size
+        allocated += stat.st_blocks * 512
+
+    started = time.perf_counter()
+    for filename in filenames:
+        storage.load_json(filename)
+    read_time = time.perf_counter() - started
+    return size, allocated, write_time, read_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the storage formats of the brands/ store.")
+    parser.add_argument("--plans", type=int, default=5000, help="Number of plan details (default: 5000).")
+    parser.add_argument("--source", help="Benchmark the plan details of this store instead of synthetic ones.")
+    args = parser.parse_args()
+
+    if args.source:
+        documents = load_source_plan_details(args.source, args.plans)
+    else:
+        documents = [synthetic_plan_details(index) for index in range(args.plans)]
+    print(f"{len(documents)} plan details")
+
+    formats = [fmt for fmt in storage.STORAGE_FORMATS if fmt != "zstd" or storage.zstandard is not None]
+    print(f"{'format':<8} {'bytes':>12} {'on disk':>12} {'vs pretty':>10} {'write s':>9} {'read s':>9}")
+    baseline = None
+    for storage_format in formats:
+        with tempfile.TemporaryDirectory() as directory:
+            size, allocated, write_time, read_time = bench_format(directory, storage_format, documents)
+        baseline = baseline or allocated
+        print(f"{storage_format:<8} {size:>12} {allocated:>12} {allocated / baseline:>9.0%} "
+              f"{write_time:>9.2f} {read_time:>9.2f}")
+    if "zstd" not in formats:
+        print("zstd skipped: the 'zstandard' package is not installed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Benchmark whole syncs against the local mock CDR server, without network access.
+
+Starts 'mock_cdr.py' on a free port and runs 'get_plans.main' in a fresh process for
+each scenario, with 'RETAILER_PDF_URL' pointed at the mock register, so the provider
+list, plan lists and plan details all come from the mock. The scenarios run in order:
+
+- cold: an empty tree, so every plan list and plan detail is downloaded.
+- current: the same tree again, which is up-to-date, so nothing is requested.
+- unchanged: every plan list refreshed ('REFRESH_DAYS = -1'); all 304 Not Modified.
+- changed: as 'unchanged', after a new generation changed '--change' of the plans.
+- faulty: an empty tree again, with '--error-rate' 500s and '--throttle-rate' 429s.
+
+For each scenario the wall-clock time, the throughput (plans in the tree per second),
+the peak RSS of the sync process, the requests the mock served and the failures the
+sync saw are reported:
+
+    python benchmarks/bench_sync.py [--retailers 20] [--plans 500] [--page-size 100] [--latency 0.02]
+        [--backend json] [--scenarios cold,current,...] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MOCK_SERVER = os.path.join(ROOT, "benchmarks", "mock_cdr.py")
+
+SCENARIOS = ("cold", "current", "unchanged", "changed", "faulty")
+
+# Run in a fresh interpreter: point the config at the mock server, sync like 'get_plans.py'
+# does and report the peak RSS
+SYNC = """
+import json, resource, sys
+sys.path.insert(0, {root!r})
+import config
+for name, value in {config!r}.items():
+    setattr(config, name, value)
+import get_plans
+sys.argv = ["get_plans.py", "--report", {report!r}]
+get_plans.main()
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"peakRss": peak if sys.platform == "darwin" else peak * 1024}}))
+"""
+
+
+def free_port():
+    """
+    Returns:
+        int: A TCP port that is free on the loopback interface.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def mock_request(port, path):
+    """
+    Args:
+        port (int): The port of the mock server.
+        path (str): The path and query to request.
+
+    Returns:
+        dict: The JSON response.
+    """
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=10) as response:
+        return json.load(response)
+
+
+def start_mock(args, port):
+    """
+    Start the mock server and wait until it answers.
+
+    Args:
+        args (argparse.Namespace): The benchmark's arguments.
+        port (int): The port to serve on.
+
+    Returns:
+        subprocess.Popen: The server process.
+    """
+    server = subprocess.Popen([
+        sys.executable, MOCK_SERVER, "--port", str(port), "--retailers", str(args.retailers),
+        "--plans", str(args.plans), "--page-size", str(args.page_size), "--latency", str(args.latency),
+        "--change", str(args.change),
+    ], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            mock_request(port, "/_stats")
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("The mock CDR server did not start")
+            time.sleep(0.1)
+
+
+def run_sync(directory, port, config):
+    """
+    Sync a tree from the mock server in a fresh process.
+
+    Args:
+        directory (str): The working directory, holding the 'brands/' tree.
+        port (int): The port of the mock server.
+        config (dict): Values of 'config.py' to override.
+
+    Returns:
+        dict: The wall-clock seconds, the peak RSS in bytes, the run report of the
+        sync and the requests the mock served meanwhile, per kind and status.
+    """
+    before = mock_request(port, "/_stats")
+    report_path = os.path.join(directory, "sync_report.json")
+    config = {"RETAILER_PDF_URL": f"http://127.0.0.1:{port}/aer/register", **config}
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", SYNC.format(root=ROOT, config=config, report=report_path)],
+        cwd=directory, capture_output=True, text=True,
+    )
+    seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"The sync failed:\n{result.stderr[-2000:]}")
+    after = mock_request(port, "/_stats")
+    with open(report_path) as file:
+        report = json.load(file)
+    requests = {key: count - before["requests"].get(key, 0) for key, count in after["requests"].items()
+                if count > before["requests"].get(key, 0)}
+    return {"seconds": seconds, "peakRss": json.loads(result.stdout.splitlines()[-1])["peakRss"],
+            "report": report, "requests": requests, "bytesSent": after["bytes"] - before["bytes"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark syncs against the local mock CDR server.")
+    parser.add_argument("--retailers", type=int, default=20, help="Number of retailers (default: 20).")
+    parser.add_argument("--plans", type=int, default=500, help="Plans per retailer (default: 500).")
+    parser.add_argument("--page-size", type=int, default=100, help="Largest plan list page (default: 100).")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mean seconds per request (default: 0.02).")
+    parser.add_argument("--change", type=float, default=0.1, help="Fraction of plans changed (default: 0.1).")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="500s in the faulty scenario (default: 0.02).")
+    parser.add_argument("--throttle-rate", type=float, default=0.02, help="429s in the faulty scenario (default: 0.02).")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json", help="STORE_BACKEND (default: json).")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma separated scenarios to run, in order (default: {','.join(SCENARIOS)}).")
+    parser.add_argument("--json", help="Also write the results, with the sync run reports, to this file.")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_mock(args, port)
+    results = {}
+    total_plans = args.retailers * args.plans
+    print(f"{args.retailers} retailers x {args.plans} plans, {args.backend} backend, {args.latency * 1000:.0f} ms latency")
+    print(f"{'scenario':<10} {'wall s':>8} {'plans/s':>9} {'peak MB':>8} {'requests':>9} {'200':>7} {'304':>7} "
+          f"{'429/5xx':>8} {'failed':>7}")
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-sync-") as directory:
+            tree = os.path.join(directory, "cold")
+            for scenario in args.scenarios.split(","):
+                config = {"STORE_BACKEND": args.backend, "BACKOFF_BASE": 0.1}
+                mock_request(port, "/_control?error_rate=0&throttle_rate=0")
+                if scenario == "cold":
+                    tree = os.path.join(directory, "cold")
+                elif scenario in ("unchanged", "changed"):
+                    config["REFRESH_DAYS"] = -1  # Outdated even if synced within the same second
+                    if scenario == "changed":
+                        generation = mock_request(port, "/_control")["generation"]
+                        mock_request(port, f"/_control?generation={generation + 1}")
+                elif scenario == "faulty":
+                    tree = os.path.join(directory, "faulty")
+                    mock_request(port, f"/_control?error_rate={args.error_rate}&throttle_rate={args.throttle_rate}")
+                elif scenario != "current":
+                    parser.error(f"unknown scenario '{scenario}'")
+                os.makedirs(tree, exist_ok=True)
+                result = results[scenario] = run_sync(tree, port, config)
+
+                requests = result["requests"]
+                by_status = {}
+                for key, count in requests.items():
+                    status = key.split()[-1]
+                    by_status[status] = by_status.get(status, 0) + count
+                throttled = sum(count for status, count in by_status.items() if status in ("429", "500"))
+                totals = result["report"]["totals"]
+                print(f"{scenario:<10} {result['seconds']:>8.2f} {total_plans / result['seconds']:>9.0f} "
+                      f"{result['peakRss'] / 2 ** 20:>8.1f} {sum(requests.values()):>9} {by_status.get('200', 0):>7} "
+                      f"{by_status.get('304', 0):>7} {throttled:>8} {totals['failed']:>7}")
+    finally:
+        server.terminate()
+        server.wait()
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"settings": vars(args), "results": results}, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
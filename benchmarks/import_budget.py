@@ -0,0 +1,103 @@
+"""Check that importing the project's modules is fast and performs no I/O.
+
+Each module is imported in a fresh interpreter, started in an empty directory, with an
+audit hook that fails the import on any network access, subprocess or file opened for
+writing. The import time is compared with a budget, and the slowest imports it pulled
+in are listed for any module over it:
+
+    python benchmarks/import_budget.py [--budget-ms 250] [module ...]
+
+Exits with status 1 if any module does I/O or is over budget, so it can run in CI.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules of the project checked by default, in dependency order
+MODULES = (
+    "config", "storage", "manifest", "sync_metrics", "work_queue", "cdr_client", "get_providers", "utilities",
+    "plan_store", "plan_index", "plan_records", "tariffs", "tariff_cache", "get_plans", "serve_plans",
+    "bill_estimator", "rank_customers",
+)
+
+# Run in the fresh interpreter: fail on I/O, import the module and report the time taken
+PROBE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+
+def forbid_io(event, args):
+    if event in ("socket.connect", "socket.getaddrinfo", "subprocess.Popen", "os.system"):
+        raise RuntimeError(f"{{event}} during import: {{args!r}}")
+    if event == "open" and args[1] not in (None, "r", "rb") and isinstance(args[0], str):
+        raise RuntimeError(f"opened {{args[0]!r}} with mode {{args[1]!r}} during import")
+
+sys.addaudithook(forbid_io)
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+"""
+
+
+def check_module(module, directory):
+    """
+    Import a module in a fresh interpreter.
+
+    Args:
+        module (str): The module name.
+        directory (str): The working directory of the interpreter.
+
+    Returns:
+        tuple: The import time in seconds, or None if the import failed, the last line
+        of its error output, and the cumulative time in microseconds of each import it
+        triggered.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(root=ROOT, module=module)],
+        cwd=directory, capture_output=True, text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    imports = {}
+    errors = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                imports[name.strip()] = int(cumulative)
+        else:
+            errors.append(line)
+    if result.returncode != 0:
+        return None, errors[-1] if errors else f"exit status {result.returncode}", imports
+    return json.loads(result.stdout.splitlines()[-1])["seconds"], "", imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time and I/O of the project's modules.")
+    parser.add_argument("modules", nargs="*", default=MODULES, help="Modules to check (default: all).")
+    parser.add_argument("--budget-ms", type=float, default=250, help="Import time budget per module (default: 250).")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        for module in args.modules:
+            seconds, errors, imports = check_module(module, directory)
+            if seconds is None:
+                failed = True
+                print(f"{module:<16} FAILED: {errors}")
+                continue
+            over = seconds * 1000 > args.budget_ms
+            failed |= over
+            print(f"{module:<16} {seconds * 1000:>8.1f} ms{'  OVER BUDGET' if over else ''}")
+            if over:
+                for name, cumulative in sorted(imports.items(), key=lambda item: -item[1])[:5]:
+                    print(f"{'':<16} {cumulative / 1000:>8.1f} ms  {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
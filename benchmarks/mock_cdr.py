@@ -0,0 +1,343 @@
+"""A local mock of the CDR energy plan APIs and of the AER retailer register.
+
+Serves synthetic retailers, each under its own base URI '/{retailer}/', with the two
+endpoints the sync uses:
+
+- 'cds-au/v1/energy/plans', paged by 'page' and 'page-size' (capped at '--page-size', so
+  'meta.totalPages' is the number of plans divided by it, rounded up).
+- 'cds-au/v1/energy/plans/{planId}', with plan details shaped like real responses (see
+  'bench_storage.synthetic_plan_details').
+
+Every response carries an ETag, and conditional requests for unchanged documents get
+'304 Not Modified'. Each request waits '--latency' seconds (with jitter), and fails with
+'500' or is throttled with '429' and a 'Retry-After' at the given rates. '/aer/register'
+is a page linking to '/aer/register.pdf', a PDF in the layout of the AER's register that
+lists the mock retailers, so 'get_providers.py' can be pointed at the server as well.
+
+Two endpoints are for the benchmark harness: '/_stats' returns the requests served per
+kind and status and the bytes sent, and '/_control' changes the settings below while
+the server runs, e.g. '/_control?generation=2&error_rate=0.05'. A new 'generation'
+changes the 'lastUpdated' (and contents) of a '--change' fraction of the plans.
+
+    python benchmarks/mock_cdr.py [--port 8765] [--retailers 20] [--plans 500] [--page-size 100]
+        [--latency 0.02] [--error-rate 0] [--throttle-rate 0]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_storage import synthetic_plan_details  # noqa: E402
+
+PLANS_PATH = "cds-au/v1/energy/plans"
+
+# Fields of the plan details that are also listed in the plan list
+LIST_FIELDS = ("planId", "effectiveFrom", "lastUpdated", "displayName", "description", "type", "fuelType",
+               "brand", "brandName", "applicationUri", "additionalInformation", "customerType", "geography")
+
+
+class MockCDR:
+    """
+    The state of the mock server.
+
+    Args:
+        host (str): The address the server is reachable at, used in the register PDF.
+        port (int): The port the server listens on.
+        retailers (int): The number of retailers.
+        plans (int): The number of plans of each retailer.
+        page_size (int): The largest page of the plan list.
+        latency (float): The mean seconds each request waits before it is answered.
+        error_rate (float): The fraction of requests answered with '500'.
+        throttle_rate (float): The fraction of requests answered with '429'.
+        retry_after (float): The 'Retry-After' seconds sent with '429'.
+        change (float): The fraction of plans changed by each new generation.
+        seed (int): Seeds the faults and the jitter of the latency.
+
+    Attributes:
+        generation (int): The current generation of the plans, starting at 1.
+        stats (dict): The requests served per kind and status, and the bytes sent.
+        register (bytes): The register PDF, once it has been requested.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, retailers=20, plans=500, page_size=100, latency=0.02,
+                 error_rate=0.0, throttle_rate=0.0, retry_after=1.0, change=0.1, seed=0):
+        self.host = host
+        self.port = port
+        self.retailers = [f"retailer-{number:03d}" for number in range(1, retailers + 1)]
+        self.plans = plans
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.change = change
+        self.generation = 1
+        self.random = random.Random(seed)
+        self.stats = {"requests": {}, "bytes": 0}
+        self.register = None
+
+    def settings(self):
+        """
+        Returns:
+            dict: The settings that '/_control' can change.
+        """
+        return {"generation": self.generation, "latency": self.latency, "error_rate": self.error_rate,
+                "throttle_rate": self.throttle_rate, "retry_after": self.retry_after, "change": self.change}
+
+    def plan_version(self, retailer, index):
+        """
+        Args:
+            retailer (str): The retailer.
+            index (int): The number of the plan.
+
+        Returns:
+            int: The generation in which the plan last changed.
+        """
+        version = 1
+        for generation in range(2, self.generation + 1):
+            digest = hashlib.blake2b(f"{retailer}/{index}/{generation}".encode(), digest_size=8).digest()
+            if int.from_bytes(digest, "big") / 2 ** 64 < self.change:
+                version = generation
+        return version
+
+    def plan_details(self, retailer, index, version):
+        """
+        Args:
+            retailer (str): The retailer.
+            index (int): The number of the plan.
+            version (int): The generation in which the plan last changed.
+
+        Returns:
+            dict: The plan details response.
+        """
+        seed = int.from_bytes(hashlib.blake2b(f"{retailer}/{index}".encode(), digest_size=4).digest(), "big")
+        details = synthetic_plan_details(seed + version)
+        details.pop("meta", None)
+        data = details["data"]
+        plan_id = f"{retailer.upper().replace('-', '')}{index:06d}@EME"
+        data.update(planId=plan_id, brand=retailer, brandName=retailer.replace("-", " ").title(),
+                    lastUpdated=f"2024-{1 + version % 12:02d}-01T00:00:00Z")
+        details["links"] = {"self": f"http://{self.host}:{self.port}/{retailer}/{PLANS_PATH}/{plan_id}"}
+        return details
+
+    def plan_index(self, retailer, plan_id):
+        """
+        Args:
+            retailer (str): The retailer.
+            plan_id (str): A plan ID of the retailer.
+
+        Returns:
+            int: The number of the plan, or None if the retailer has no such plan.
+        """
+        prefix = retailer.upper().replace("-", "")
+        number = plan_id[len(prefix):-len("@EME")]
+        if not plan_id.startswith(prefix) or not plan_id.endswith("@EME") or not number.isdigit():
+            return None
+        index = int(number)
+        return index if index < self.plans else None
+
+    def record(self, kind, status, size=0):
+        """
+        Args:
+            kind (str): The kind of request.
+            status (int): The status it was answered with.
+            size (int): The bytes of the body sent.
+        """
+        key = f"{kind} {status}"
+        self.stats["requests"][key] = self.stats["requests"].get(key, 0) + 1
+        self.stats["bytes"] += size
+
+    async def simulate(self, kind):
+        """
+        Wait for the configured latency, and decide whether the request fails.
+
+        Args:
+            kind (str): The kind of request.
+
+        Returns:
+            web.Response: The error response, or None if the request is answered.
+        """
+        if self.latency:
+            await asyncio.sleep(self.random.uniform(0.5, 1.5) * self.latency)
+        draw = self.random.random()
+        if draw < self.throttle_rate:
+            self.record(kind, 429)
+            return web.json_response({"errors": [{"code": "urn:au-cds:error:cds-all:GeneralError.Expected"}]},
+                                     status=429, headers={"Retry-After": str(self.retry_after)})
+        if draw < self.throttle_rate + self.error_rate:
+            self.record(kind, 500)
+            return web.json_response({"errors": [{"code": "urn:au-cds:error:cds-all:GeneralError.Unexpected"}]},
+                                     status=500)
+        return None
+
+    def respond(self, request, kind, etag, build):
+        """
+        Answer a request with a JSON document, or '304' if the client has it.
+
+        Args:
+            request (web.Request): The request.
+            kind (str): The kind of request.
+            etag (str): The ETag of the document.
+            build (callable): Builds the document, only called if it is sent.
+
+        Returns:
+            web.Response: The response.
+        """
+        if request.headers.get("If-None-Match") == etag:
+            self.record(kind, 304)
+            return web.Response(status=304, headers={"ETag": etag})
+        body = json.dumps(build()).encode()
+        self.record(kind, 200, len(body))
+        return web.Response(body=body, content_type="application/json", headers={"ETag": etag})
+
+    async def plan_list(self, request):
+        """Serve a page of a retailer's plan list."""
+        retailer = request.match_info["retailer"]
+        if retailer not in self.retailers:
+            raise web.HTTPNotFound()
+        failure = await self.simulate("plans")
+        if failure is not None:
+            return failure
+        page_size = min(int(request.query.get("page-size", 25)), self.page_size)
+        page = int(request.query.get("page", 1))
+        total_pages = max(1, -(-self.plans // page_size))
+        indexes = range((page - 1) * page_size, min(page * page_size, self.plans))
+        versions = [self.plan_version(retailer, index) for index in indexes]
+        etag = '"' + hashlib.blake2b(f"{retailer}/{page}/{page_size}/{versions}".encode(), digest_size=8).hexdigest() + '"'
+
+        def build():
+            plans = []
+            for index, version in zip(indexes, versions):
+                data = self.plan_details(retailer, index, version)["data"]
+                plans.append({field: data[field] for field in LIST_FIELDS if field in data})
+            base = f"http://{self.host}:{self.port}/{retailer}/{PLANS_PATH}"
+            return {"data": {"plans": plans}, "links": {"self": f"{base}?page={page}"},
+                    "meta": {"totalRecords": self.plans, "totalPages": total_pages}}
+
+        return self.respond(request, "plans", etag, build)
+
+    async def plan_detail(self, request):
+        """Serve the details of a plan."""
+        retailer = request.match_info["retailer"]
+        index = self.plan_index(retailer, request.match_info["plan_id"]) if retailer in self.retailers else None
+        if index is None:
+            raise web.HTTPNotFound()
+        failure = await self.simulate("details")
+        if failure is not None:
+            return failure
+        version = self.plan_version(retailer, index)
+        etag = f'"{retailer}-{index}-v{version}"'
+        return self.respond(request, "details", etag, lambda: self.plan_details(retailer, index, version))
+
+    async def register_page(self, request):
+        """Serve the page linking to the register PDF."""
+        self.record("register", 200)
+        return web.Response(content_type="text/html", text=(
+            '<html><body><h3 class="card__title file__title">'
+            '<a href="/aer/register.pdf" type="application/pdf" class="stretched-link">'
+            'Energy Retailer Base URIs</a></h3></body></html>'
+        ))
+
+    async def register_pdf(self, request):
+        """Serve the register PDF, laid out on first use."""
+        if self.register is None:
+            self.register = register_pdf([
+                (retailer.replace("-", " ").title(), f"http://{self.host}:{self.port}/{retailer}/")
+                for retailer in self.retailers
+            ])
+        self.record("register", 200, len(self.register))
+        return web.Response(body=self.register, content_type="application/pdf")
+
+    async def get_stats(self, request):
+        """Serve the requests served so far."""
+        return web.json_response(self.stats)
+
+    async def control(self, request):
+        """Change settings given as query parameters, and serve them all."""
+        for name, value in request.query.items():
+            if name not in self.settings():
+                raise web.HTTPBadRequest(text=f"Unknown setting '{name}'")
+            setattr(self, name, type(getattr(self, name))(value))
+        return web.json_response(self.settings())
+
+    def application(self):
+        """
+        Returns:
+            web.Application: The application serving the mock.
+        """
+        app = web.Application()
+        app.add_routes([
+            web.get(f"/{{retailer}}/{PLANS_PATH}", self.plan_list),
+            web.get(f"/{{retailer}}/{PLANS_PATH}/{{plan_id}}", self.plan_detail),
+            web.get("/aer/register", self.register_page),
+            web.get("/aer/register.pdf", self.register_pdf),
+            web.get("/_stats", self.get_stats),
+            web.get("/_control", self.control),
+        ])
+        return app
+
+
+def register_pdf(retailers, rows_per_page=35):
+    """
+    Lay out a retailer register like the AER's: a table of brand names and base URIs,
+    followed by a change log.
+
+    Args:
+        retailers (list): Pairs of brand names and base URIs.
+        rows_per_page (int): The table rows on each page.
+
+    Returns:
+        bytes: The PDF.
+    """
+    import fitz  # PyMuPDF, only needed once the register is requested
+
+    with fitz.open() as pdf:
+        for start in range(0, len(retailers), rows_per_page):
+            page = pdf.new_page()
+            y = 90
+            if not start:
+                page.insert_text((71, 110), "Energy Retailer Base URIs", fontsize=18)
+                page.insert_text((76, 170), "Brand Name", fontsize=10)
+                page.insert_text((303, 170), "Retailer Base URI", fontsize=10)
+                y = 190
+            for brand, uri in retailers[start:start + rows_per_page]:
+                page.insert_text((76, y), brand, fontsize=10)
+                page.insert_text((303, y), uri, fontsize=10)
+                y += 17
+        page = pdf.new_page()
+        page.insert_text((71, 90), "Change log", fontsize=14)
+        page.insert_text((76, 120), "Version 1", fontsize=10)
+        page.insert_text((303, 120), "http://example.invalid/not-a-retailer/", fontsize=10)
+        return pdf.tobytes()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve mock CDR energy plan APIs and a mock AER register.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765).")
+    parser.add_argument("--retailers", type=int, default=20, help="Number of retailers (default: 20).")
+    parser.add_argument("--plans", type=int, default=500, help="Plans per retailer (default: 500).")
+    parser.add_argument("--page-size", type=int, default=100, help="Largest plan list page (default: 100).")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mean seconds per request (default: 0.02).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests throttled with 429.")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429.")
+    parser.add_argument("--change", type=float, default=0.1, help="Fraction of plans changed per generation.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the faults and latency jitter.")
+    args = parser.parse_args()
+
+    mock = MockCDR(args.host, args.port, args.retailers, args.plans, args.page_size, args.latency,
+                   args.error_rate, args.throttle_rate, args.retry_after, args.change, args.seed)
+    web.run_app(mock.application(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Estimate annual electricity bills for many plans from one usage profile.
+
+The interval usage of a customer is binned into half-hours of days. The compiled
+tariffs of all plans, as cached by the sync (see tariff_cache.py), are stacked into a
+'TariffSet' and evaluated against it at once: the usage of each band of each plan
+comes out of one weighted 'bincount' over the distinct tariff calendars, and stepped
+rates, supply charges, controlled load, feed-in credits and discounts are then array
+arithmetic over the plan axis. No Python code runs per plan or per interval.
+
+A bill covers the days of the profile and is scaled to a year. Charges include GST
+('GST_RATE'), feed-in credits do not.
+
+Usage:
+    python bill_estimator.py --usage usage.csv --postcode 2000 [--customer-type RESIDENTIAL] [--top 10]
+
+The usage CSV has a 'timestamp' column with the local start of each interval and a
+'usage' column in kWh, and optionally 'controlled_load' and 'export' columns in kWh.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import numpy as np
+from config import GST_RATE
+from plan_index import PlanIndex
+from tariff_cache import load_brand_tariffs
+from tariffs import LEAP_MONTH_STARTS, SLOT_MINUTES, SLOTS_PER_DAY, CONDITIONAL, TariffSet
+
+
+class UsageProfile:
+    """
+    Interval usage binned into half-hours of days.
+
+    Args:
+        timestamps (array-like): The local start time of each interval, as anything
+            'numpy.datetime64' accepts.
+        usage (array-like): The general usage of each interval in kWh.
+        controlled_load (array-like, optional): The controlled load usage in kWh.
+        export (array-like, optional): The solar export in kWh.
+
+    Attributes:
+        days (int): The number of days covered, from the first to the last interval.
+        day_of_year (numpy.ndarray): int[days], the day of a leap year of each day.
+        weekday (numpy.ndarray): int[days], the weekday of each day, Monday being 0.
+        usage (numpy.ndarray): float64[days, 48], the general usage.
+        controlled_load (numpy.ndarray): float64[days, 48].
+        export (numpy.ndarray): float64[days, 48].
+    """
+
+    def __init__(self, timestamps, usage, controlled_load=None, export=None):
+        timestamps = np.asarray(timestamps, dtype="datetime64[m]")
+        if timestamps.size == 0:
+            raise ValueError("The usage profile is empty")
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        interval = int(np.median(np.diff(timestamps)).astype(int)) if timestamps.size > 1 else SLOT_MINUTES
+        # Longer intervals are spread evenly over the half-hours they cover
+        parts = max(1, interval // SLOT_MINUTES)
+        offsets = np.arange(parts) * SLOT_MINUTES
+        slot_times = (timestamps[:, None] + offsets.astype("timedelta64[m]")).ravel()
+
+        first_day = timestamps[0].astype("datetime64[D]")
+        days = slot_times.astype("datetime64[D]")
+        day_index = (days - first_day).astype(int)
+        slot = (slot_times - days).astype(int) // SLOT_MINUTES
+        self.days = int(day_index[-1]) + 1
+        cells = day_index * SLOTS_PER_DAY + slot
+
+        def binned(values):
+            if values is None:
+                return np.zeros((self.days, SLOTS_PER_DAY))
+            values = np.repeat(np.asarray(values, dtype=float)[order] / parts, parts)
+            return np.bincount(cells, weights=values, minlength=self.days * SLOTS_PER_DAY).reshape(
+                self.days, SLOTS_PER_DAY
+            )
+
+        self.usage = binned(usage)
+        self.controlled_load = binned(controlled_load)
+        self.export = binned(export)
+
+        dates = first_day + np.arange(self.days)
+        months = dates.astype("datetime64[M]")
+        self.day_of_year = LEAP_MONTH_STARTS[months.astype(int) % 12] + (dates - months.astype("datetime64[D]")).astype(int)
+        self.weekday = (dates.astype(int) + 3) % 7  # 1970-01-01 was a Thursday
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Load a usage profile from a CSV file.
+
+        Args:
+            path (str): A CSV file with 'timestamp' and 'usage' columns and optionally
+                'controlled_load' and 'export' columns.
+
+        Returns:
+            UsageProfile: The profile.
+        """
+        with open(path, newline="") as file:
+            rows = list(csv.DictReader(file))
+        if not rows:
+            raise ValueError(f"No usage in '{path}'")
+
+        def column(name):
+            if name not in rows[0]:
+                return None
+            return [float(row[name] or 0) for row in rows]
+
+        return cls(
+            [row["timestamp"] for row in rows], column("usage"),
+            controlled_load=column("controlled_load"), export=column("export"),
+        )
+
+    def by_weekday(self, values):
+        """
+        Args:
+            values (numpy.ndarray): float64[days, 48], e.g. 'self.export'.
+
+        Returns:
+            numpy.ndarray: float64[7, 48], the values summed per weekday and half-hour.
+        """
+        totals = np.zeros((7, SLOTS_PER_DAY))
+        np.add.at(totals, self.weekday, values)
+        return totals
+
+
+def band_usage(tariff_set, profile):
+    """
+    Compute the usage of every band of every plan.
+
+    Args:
+        tariff_set (TariffSet): The compiled tariffs.
+        profile (UsageProfile): The usage profile.
+
+    Returns:
+        tuple: float64[P, B], the kWh of each band, and float64[P, T], the number of
+        days in each tariff period.
+    """
+    plans, periods, bands, _ = tariff_set.shape
+    cells = 7 * SLOTS_PER_DAY
+    seasons = len(tariff_set.season_maps)
+
+    # Usage per tariff period, weekday and half-hour for each distinct season map
+    season_of_day = tariff_set.season_maps[:, profile.day_of_year].astype(np.intp)  # [S, days]
+    day_cell = (season_of_day * cells + profile.weekday * SLOTS_PER_DAY)[:, :, None] + np.arange(SLOTS_PER_DAY)
+    day_cell += (np.arange(seasons) * periods * cells)[:, None, None]
+    season_usage = np.bincount(
+        day_cell.ravel(), weights=np.broadcast_to(profile.usage, day_cell.shape).ravel(),
+        minlength=seasons * periods * cells,
+    ).reshape(seasons, periods * cells)
+    season_days = np.bincount(
+        (season_of_day + (np.arange(seasons) * periods)[:, None]).ravel(), minlength=seasons * periods
+    ).reshape(seasons, periods)
+
+    # Usage per band for each distinct calendar, then per plan
+    calendars = len(tariff_set.calendar_bands)
+    band_of_cell = tariff_set.calendar_bands.reshape(calendars, -1).astype(np.intp)
+    band_of_cell += (np.arange(calendars) * bands)[:, None]
+    calendar_usage = np.bincount(
+        band_of_cell.ravel(), weights=season_usage[tariff_set.calendar_season].ravel(),
+        minlength=calendars * bands,
+    ).reshape(calendars, bands)
+    calendar_of_plan = tariff_set.calendar_of_plan
+    return calendar_usage[calendar_of_plan], season_days[tariff_set.calendar_season[calendar_of_plan]]
+
+
+def estimate_bills(tariff_set, profile, conditional_discounts=True, gst_rate=GST_RATE):
+    """
+    Estimate the annual bill of every plan for a usage profile.
+
+    Stepped rates are applied to the usage of the profile with the step volumes scaled
+    from a year to the days of the profile.
+
+    Args:
+        tariff_set (TariffSet): The compiled tariffs.
+        profile (UsageProfile): The usage profile.
+        conditional_discounts (bool): Whether to apply conditional discounts such as
+            pay on time discounts.
+        gst_rate (float): The GST added to charges.
+
+    Returns:
+        dict: float64[P] arrays of the annual 'total' and its 'usage', 'supply',
+        'controlled_load', 'discounts' and 'feed_in' parts, in dollars.
+    """
+    kwh, period_days = band_usage(tariff_set, profile)
+    return bills_from_usage(
+        tariff_set, kwh, period_days, profile.days, profile.by_weekday(profile.controlled_load),
+        profile.by_weekday(profile.export), conditional_discounts=conditional_discounts, gst_rate=gst_rate,
+    )
+
+
+def bills_from_usage(tariff_set, kwh, period_days, days, controlled_kwh, export_kwh,
+                     conditional_discounts=True, gst_rate=GST_RATE):
+    """
+    Estimate annual bills from usage already split into bands.
+
+    The usage arguments may have leading axes, e.g. one per customer, to estimate the
+    bills of several customers with the same days of usage at once.
+
+    Args:
+        tariff_set (TariffSet): The compiled tariffs.
+        kwh (numpy.ndarray): float64[..., P, B], the usage of each band of each plan.
+        period_days (numpy.ndarray): float64[P, T], the days in each tariff period.
+        days (int): The number of days of usage.
+        controlled_kwh (numpy.ndarray): float64[..., 7, 48], the controlled load usage
+            per weekday and half-hour.
+        export_kwh (numpy.ndarray): float64[..., 7, 48], the export per weekday and
+            half-hour.
+        conditional_discounts (bool): Whether to apply conditional discounts.
+        gst_rate (float): The GST added to charges.
+
+    Returns:
+        dict: float64[..., P] arrays as returned by 'estimate_bills'.
+    """
+    year_fraction = days / 365.0
+
+    # Stepped rates: each step bills the usage between the previous step's limit and its own
+    limits = tariff_set.step_limits * year_fraction
+    lower = np.concatenate([np.zeros(limits.shape[:2] + (1,)), limits[:, :, :-1]], axis=2)
+    step_kwh = np.clip(np.minimum(kwh[..., None], limits) - lower, 0.0, None)
+    usage = (step_kwh * tariff_set.step_rates).sum(axis=(-2, -1))
+    supply = (tariff_set.supply * period_days).sum(axis=1)
+
+    controlled_kwh = controlled_kwh.reshape(controlled_kwh.shape[:-2] + (-1,))
+    controlled_load = controlled_kwh @ tariff_set.controlled_rates.reshape(len(tariff_set), -1).T
+    controlled_load += controlled_kwh.any(axis=-1)[..., None] * tariff_set.controlled_supply * days
+    export_kwh = export_kwh.reshape(export_kwh.shape[:-2] + (-1,))
+    feed_in = export_kwh @ tariff_set.feed_in_rates.reshape(len(tariff_set), -1).T
+
+    kinds = slice(None) if conditional_discounts else slice(0, CONDITIONAL)
+    discounts = (
+        tariff_set.discount_use[:, kinds].sum(axis=1) * usage
+        + tariff_set.discount_bill[:, kinds].sum(axis=1) * (usage + supply + controlled_load)
+        + tariff_set.discount_fixed[:, kinds].sum(axis=1) * year_fraction
+    )
+    total = (usage + supply + controlled_load - discounts) * (1 + gst_rate) - feed_in
+    parts = {"total": total, "usage": usage, "supply": np.broadcast_to(supply, total.shape),
+             "controlled_load": controlled_load, "discounts": discounts, "feed_in": feed_in}
+    return {name: values / year_fraction for name, values in parts.items()}
+
+
+def rank_plans(tariff_set, profile, top=None, **options):
+    """
+    Rank plans from the cheapest annual bill for a usage profile.
+
+    Args:
+        tariff_set (TariffSet): The compiled tariffs.
+        profile (UsageProfile): The usage profile.
+        top (int, optional): The number of plans to return, all by default.
+        **options: Passed to 'estimate_bills'.
+
+    Returns:
+        list: Pairs of plan IDs and annual bills in dollars, cheapest first.
+    """
+    totals = estimate_bills(tariff_set, profile, **options)["total"]
+    order = np.argsort(totals, kind="stable")[:top]
+    return [(tariff_set.plan_ids[plan], float(totals[plan])) for plan in order]
+
+
+def load_eligible_tariffs(summaries, directory="brands"):
+    """
+    Load the compiled tariffs of the electricity plans among the given plans.
+
+    Args:
+        summaries (list): Plan summaries from the plan index.
+        directory (str): The root of the store.
+
+    Returns:
+        list: The 'CompiledTariff' of each plan with a usable electricity tariff.
+    """
+    plan_ids_by_brand = {}
+    for summary in summaries:
+        if summary.get("fuelType") in ("ELECTRICITY", "DUAL"):
+            plan_ids_by_brand.setdefault(summary["brand"], []).append(summary["planId"])
+    tariffs = []
+    for brand, plan_ids in plan_ids_by_brand.items():
+        brand_tariffs = load_brand_tariffs(brand, plan_ids, directory)
+        tariffs.extend(brand_tariffs[plan_id] for plan_id in plan_ids if plan_id in brand_tariffs)
+    return tariffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank plans by the estimated annual bill for a usage profile.")
+    parser.add_argument("--usage", required=True, help="CSV file with the interval usage.")
+    parser.add_argument("--postcode", required=True, help="Postcode of the customer.")
+    parser.add_argument("--distributor", help="Distributor of the customer.")
+    parser.add_argument("--customer-type", default="RESIDENTIAL", help="RESIDENTIAL or BUSINESS.")
+    parser.add_argument("--top", type=int, default=10, help="Number of plans to list (default: 10).")
+    parser.add_argument("--no-conditional-discounts", action="store_true",
+                        help="Ignore conditional discounts such as pay on time discounts.")
+    parser.add_argument("--json", action="store_true", help="Output the ranking as JSON.")
+    parser.add_argument("--directory", default="brands", help="The root of the store (default: brands).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    profile = UsageProfile.from_csv(args.usage)
+    index = PlanIndex.load(args.directory)
+    summaries = index.lookup(postcode=args.postcode, distributor=args.distributor,
+                             customer_type=args.customer_type)
+    tariffs = load_eligible_tariffs(summaries, args.directory)
+    if not tariffs:
+        logging.error(f"No plans with a usable electricity tariff at postcode {args.postcode}")
+        return
+    ranking = rank_plans(TariffSet(tariffs), profile, top=args.top,
+                         conditional_discounts=not args.no_conditional_discounts)
+    if args.json:
+        print(json.dumps([
+            {"planId": plan_id, "annualBill": round(bill, 2), **(index.plan(plan_id) or {})}
+            for plan_id, bill in ranking
+        ], indent=4))
+        return
+    for position, (plan_id, bill) in enumerate(ranking, 1):
+        summary = index.plan(plan_id) or {}
+        print(f"{position:>3}. ${bill:>9,.2f}  {plan_id}  {summary.get('brandName', '')} - {summary.get('displayName', '')}")
+
+
+if __name__ == "__main__":
+    main()
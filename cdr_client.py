@@ -0,0 +1,466 @@
+"""Asynchronous HTTP engine for the CDR energy APIs.
+
+This module provides a single asyncio based client that is shared by every fetch in the
+project. All requests run on one event loop, so thousands of plan detail requests can be
+scheduled at once without a thread per request. Concurrency is bounded at three levels:
+
+- 'MAX_IN_FLIGHT' caps the number of requests in flight across all providers.
+- 'PER_RETAILER_REQUESTS' caps the requests in flight against a single retailer base URI.
+- 'PER_HOST_REQUESTS' caps the pooled connections to a single API host.
+
+A request first waits for its retailer's limit and only then takes a global slot, which
+it holds for the request alone, so a retailer with many queued requests cannot starve
+the others.
+
+Connections are pooled per origin (scheme, host and port) of the retailer base URIs, and
+kept alive for 'KEEPALIVE_TIMEOUT' seconds, so retailers that share an API host also share
+warm connections. Responses are requested with gzip compression, and with brotli when a
+brotli decoder is installed. The client counts how many connections were opened and how
+many were reused for each origin, and logs the counts when it is closed. Every request
+attempt, its latency, body size and outcome, and every retry are recorded in the client's
+'SyncMetrics' (see sync_metrics.py).
+
+Requests that fail with a connection error, a timeout or a retryable status (429 and 5xx
+gateway errors) are requeued with exponential backoff and jitter, up to 'MAX_RETRIES'
+times. A 'Retry-After' header overrides the backoff. When a retailer throttles us with 429
+or 503, its concurrency limit is halved and all its requests pause until the retry delay
+has passed; the limit then grows back by one for every run of successful requests. Both
+the pause and the backoff between retries are waited out without a global slot, so a
+throttling retailer never slows down the others.
+
+Blocking callers can use 'run_with_client' to run a coroutine function with a fresh client.
+
+Example:
+    async with CDRClient() as client:
+        response = await client.get(url, base_url=base_url, headers={"x-v": "1"})
+        data = response.json()
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp.compression_utils import HAS_BROTLI
+
+from config import (
+    MAX_IN_FLIGHT, PER_RETAILER_REQUESTS, PER_HOST_REQUESTS, REQUEST_TIMEOUT, KEEPALIVE_TIMEOUT,
+    MAX_RETRIES, BACKOFF_BASE, BACKOFF_MAX, MAX_RETRY_AFTER,
+)
+from sync_metrics import SyncMetrics
+
+logger = logging.getLogger(__name__)
+
+# Only advertise brotli when aiohttp is able to decode it
+ACCEPT_ENCODING = "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate"
+
+# Statuses worth retrying, and the subset that means the retailer is throttling us
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}
+
+
+def origin_of(url):
+    """
+    Return the origin (scheme, host and port) of a URL.
+
+    Args:
+        url (str): The URL.
+
+    Returns:
+        str: The origin, for example 'https://cdr.energymadeeasy.gov.au'.
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class CDRResponse:
+    """
+    A fully read HTTP response.
+
+    Attributes:
+        url (str): The final URL of the response, after any redirects.
+        status (int): The HTTP status code.
+        headers (Mapping): The response headers.
+        body (bytes): The raw response body.
+        encoding (str): The character encoding used to decode the body as text.
+    """
+
+    __slots__ = ("url", "status", "headers", "body", "encoding")
+
+    def __init__(self, url, status, headers, body, encoding="utf-8"):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.encoding = encoding
+
+    @property
+    def ok(self):
+        """bool: True if the status code is less than 400."""
+        return self.status < 400
+
+    @property
+    def text(self):
+        """str: The body decoded as text."""
+        return self.body.decode(self.encoding, errors="replace")
+
+    def json(self):
+        """
+        Parse the body as JSON.
+
+        Returns:
+            The parsed JSON document.
+        """
+        return json.loads(self.body)
+
+    def raise_for_status(self):
+        """
+        Raise an 'aiohttp.ClientResponseError' if the status code indicates an error.
+        """
+        if not self.ok:
+            raise aiohttp.ClientResponseError(
+                None, (), status=self.status, message=f"HTTP {self.status} for {self.url}"
+            )
+
+
+def retry_after(response):
+    """
+    Read the delay requested by a response's 'Retry-After' header.
+
+    Args:
+        response (CDRResponse): The response, or None if the request failed.
+
+    Returns:
+        float: The delay in seconds, capped at 'MAX_RETRY_AFTER', or None if the
+        response has no valid 'Retry-After' header.
+    """
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:  # Retry-After may also be an HTTP date
+            delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(delay, 0.0), MAX_RETRY_AFTER)
+
+
+def backoff_delay(attempt):
+    """
+    Return the delay before retrying a request, using exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of attempts made so far, starting at 1.
+
+    Returns:
+        float: A random delay between zero and 'BACKOFF_BASE' * 2 ** (attempt - 1),
+        capped at 'BACKOFF_MAX'.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for a single retailer that backs off when the retailer throttles.
+
+    The limit starts at 'max_limit'. Each throttled response halves it and pauses new
+    requests until the retry delay has passed. After every 'limit' successful requests
+    in a row the limit grows by one again, up to 'max_limit'.
+
+    Args:
+        max_limit (int): The maximum number of concurrent requests.
+
+    Attributes:
+        limit (int): The current number of concurrent requests allowed.
+        active (int): The number of requests currently holding a slot.
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.active = 0
+        self._successes = 0
+        self._resume_at = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """
+        Wait for a free slot, and for any throttling pause to end.
+
+        The pause can last up to 'MAX_RETRY_AFTER' seconds, so callers acquire the
+        limiter before any slot shared with other retailers.
+        """
+        loop = asyncio.get_running_loop()
+        async with self._condition:
+            while self.active >= self.limit or self._resume_at > loop.time():
+                pause = self._resume_at - loop.time()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._condition.wait()
+            self.active += 1
+
+    async def release(self, throttled_for=None):
+        """
+        Give a slot back, adjusting the limit to the outcome of the request.
+
+        Args:
+            throttled_for (float, optional): If the request was throttled, the number of
+                seconds to pause the retailer for. None if the request was not throttled.
+        """
+        async with self._condition:
+            self.active -= 1
+            if throttled_for is not None:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+                self._resume_at = max(
+                    self._resume_at, asyncio.get_running_loop().time() + throttled_for
+                )
+            elif self.limit < self.max_limit:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self._successes = 0
+                    self.limit += 1
+                    self._condition.notify()
+            self._condition.notify()
+
+
+class CDRClient:
+    """
+    Asynchronous client with pooled connections and bounded concurrency.
+
+    The client must be used as an async context manager so that its connection pools
+    are opened and closed on the running event loop.
+
+    Args:
+        max_in_flight (int): Maximum number of requests scheduled at once.
+        per_retailer (int): Maximum number of requests scheduled against a single
+            retailer base URI.
+        pool_size (int): Maximum number of pooled connections per origin.
+        keepalive_timeout (float): Seconds an idle pooled connection is kept open.
+        timeout (float): Seconds to wait for a connection or for data on a socket.
+        max_retries (int): Number of times a failed request is retried.
+        metrics (SyncMetrics, optional): Where requests are recorded. A new one is used
+            by default.
+
+    Attributes:
+        connection_stats (dict): For each origin, the number of connections 'opened'
+            and 'reused'. Also reported as the 'connections' of the metrics.
+        metrics (SyncMetrics): The metrics of the requests sent.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, per_retailer=PER_RETAILER_REQUESTS,
+                 pool_size=PER_HOST_REQUESTS, keepalive_timeout=KEEPALIVE_TIMEOUT,
+                 timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, metrics=None):
+        self.max_in_flight = max_in_flight
+        self.per_retailer = per_retailer
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.connection_stats = {}
+        self.metrics = metrics or SyncMetrics()
+        self.metrics.connections = self.connection_stats
+        self._sessions = {}
+        self._in_flight = None
+        self._retailer_limiters = {}
+
+    async def __aenter__(self):
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Close every connection pool and log how many connections each one reused.
+        """
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+        for origin, stats in self.connection_stats.items():
+            logger.info(
+                f"Connections to {origin}: {stats['opened']} opened, {stats['reused']} reused"
+            )
+
+    def session_for(self, url):
+        """
+        Return the pooled session for the origin of a URL, creating it if needed.
+
+        Args:
+            url (str): Any URL on the origin.
+
+        Returns:
+            aiohttp.ClientSession: The session whose connection pool serves the origin.
+        """
+        origin = origin_of(url)
+        if origin not in self._sessions:
+            stats = self.connection_stats.setdefault(origin, {"opened": 0, "reused": 0})
+
+            async def on_connection_create_end(session, context, params):
+                stats["opened"] += 1
+
+            async def on_connection_reuseconn(session, context, params):
+                stats["reused"] += 1
+
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(on_connection_create_end)
+            trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size, keepalive_timeout=self.keepalive_timeout
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=None, sock_connect=self.timeout, sock_read=self.timeout
+            )
+            self._sessions[origin] = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers={"Accept-Encoding": ACCEPT_ENCODING},
+                trace_configs=[trace_config],
+            )
+        return self._sessions[origin]
+
+    def retailer_limiter(self, base_url):
+        """
+        Return the adaptive limiter bounding concurrent requests for a retailer base URI.
+
+        Args:
+            base_url (str): The retailer base URI.
+
+        Returns:
+            AdaptiveLimiter: The limiter for the base URI.
+        """
+        if base_url not in self._retailer_limiters:
+            self._retailer_limiters[base_url] = AdaptiveLimiter(self.per_retailer)
+        return self._retailer_limiters[base_url]
+
+    async def get(self, url, base_url=None, headers=None, params=None):
+        """
+        Send a GET request and read the whole response, retrying transient failures.
+
+        Args:
+            url (str): The URL to fetch.
+            base_url (str, optional): The retailer base URI the URL belongs to. Defaults
+                to the URL itself.
+            headers (dict, optional): The headers to use for the request.
+            params (dict, optional): The query parameters to use for the request.
+
+        Returns:
+            CDRResponse: The response, including its decompressed body. If every attempt
+            returned a retryable status, the last such response is returned.
+
+        Raises:
+            aiohttp.ClientError: If the last attempt failed with a connection error.
+            asyncio.TimeoutError: If the last attempt timed out.
+        """
+        session = self.session_for(base_url or url)
+        limiter = self.retailer_limiter(base_url or url)
+        for attempt in range(1, self.max_retries + 2):
+            response, error = None, None
+            # Wait for the retailer's own limit first, so that requests queued behind a
+            # slow or throttling retailer never hold the global slots other retailers need
+            await limiter.acquire()
+            try:
+                async with self._in_flight:
+                    started = time.perf_counter()
+                    try:
+                        logger.debug("GET %s %s", url, params or "")
+                        async with session.get(url, headers=headers, params=params) as raw_response:
+                            body = await raw_response.read()
+                            response = CDRResponse(
+                                str(raw_response.url), raw_response.status, raw_response.headers,
+                                body, raw_response.charset or "utf-8",
+                            )
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                        error = exc
+                    seconds = time.perf_counter() - started
+            finally:
+                delay = retry_after(response) or backoff_delay(attempt)
+                throttled = response is not None and response.status in THROTTLE_STATUSES
+                await limiter.release(delay if throttled else None)
+            self.metrics.observe_request(
+                base_url or url, url, type(error).__name__ if response is None else response.status,
+                seconds, 0 if response is None else len(body),
+            )
+            if response is not None and response.status not in RETRY_STATUSES:
+                return response
+            if attempt > self.max_retries:
+                break
+            reason = f"status {response.status}" if response is not None else repr(error)
+            self.metrics.count(base_url or url, "retries")
+            logger.warning(f"Retrying {url} in {delay:.1f}s after {reason} (attempt {attempt})")
+            # Requeue behind the retailer's other requests, holding neither its slot nor a
+            # global one while waiting
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+
+def conditional_headers(validators):
+    """
+    Build the conditional request headers for previously saved validators.
+
+    Args:
+        validators (dict): The saved 'etag' and 'lastModified' values, if any.
+
+    Returns:
+        dict: The 'If-None-Match' and 'If-Modified-Since' headers to send.
+    """
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("lastModified"):
+        headers["If-Modified-Since"] = validators["lastModified"]
+    return headers
+
+
+def response_validators(response):
+    """
+    Extract the validators of a response for use in later conditional requests.
+
+    Args:
+        response (CDRResponse): The response.
+
+    Returns:
+        dict: The 'etag' and 'lastModified' values sent by the server, if any.
+    """
+    validators = {}
+    if response.headers.get("ETag"):
+        validators["etag"] = response.headers["ETag"]
+    if response.headers.get("Last-Modified"):
+        validators["lastModified"] = response.headers["Last-Modified"]
+    return validators
+
+
+def run_with_client(coroutine_function, *args, **kwargs):
+    """
+    Run a coroutine function with a new 'CDRClient' on a new event loop.
+
+    This is the bridge used by the blocking wrappers in the other modules.
+
+    Args:
+        coroutine_function (callable): A coroutine function taking the client as its
+            first argument.
+        *args: Further positional arguments for the coroutine function.
+        **kwargs: Keyword arguments for the coroutine function.
+
+    Returns:
+        The result of the coroutine function.
+    """
+    async def runner():
+        async with CDRClient() as client:
+            return await coroutine_function(client, *args, **kwargs)
+
+    return asyncio.run(runner())
@@ -3,8 +3,102 @@ Configuration settings for the project.
 """
 RETAILER_PDF_URL = 'https://www.aer.gov.au/documents/consumer-data-right-list-energy-retailer-base-uris-june-2023'
 
-# Number of days after which the plan should be refreshed
+# Number of days after which the provider list cached in PROVIDERS_FILE is refreshed from
+# the retailer PDF
+REFRESH_PROVIDERS = 1
+PROVIDERS_FILE = "brands/providers.json"
+
+# Pages of the retailer PDF parsed per worker process. PDFs of at most this many pages are
+# parsed in the calling process; longer ones are split across up to PDF_WORKERS processes
+# (one per CPU if None).
+PDF_PAGES_PER_WORKER = 8
+PDF_WORKERS = None
+
+# Number of days after which the plan should be refreshed. Fractions such as 1 / 24 are
+# allowed; refreshes use conditional requests, so unchanged plans are cheap to re-check.
 REFRESH_DAYS = 7
 
-# Number of parallel processes for checking plan details
-DETAIL_THREADS = 10
+# Number of providers synced concurrently
+PROVIDER_CONCURRENCY = 8
+
+# Maximum number of requests scheduled at once across all providers
+MAX_IN_FLIGHT = 1000
+
+# Maximum number of requests in flight at once against a single retailer base URI. The
+# limit adapts downwards while a retailer is throttling requests.
+PER_RETAILER_REQUESTS = 100
+
+# Number of plan details of a single brand that are scheduled at once; the rest wait for
+# one of them to finish rather than queueing on the retailer's limit all at once
+DETAIL_WORKERS = 100
+
+# Former name of 'DETAIL_WORKERS', still imported by archive/get_plan_detail.py
+DETAIL_THREADS = DETAIL_WORKERS
+
+# Size of the connection pool for a single API host, which caps its concurrent requests
+PER_HOST_REQUESTS = 8
+
+# Seconds an idle pooled connection is kept alive for reuse
+KEEPALIVE_TIMEOUT = 60
+
+# Seconds to wait for a connection or for data on a socket before the request is requeued
+REQUEST_TIMEOUT = 5
+
+# Number of times a request is retried after a connection error, timeout, 429 or 5xx status
+MAX_RETRIES = 5
+
+# Exponential backoff between retries: the first retry waits up to BACKOFF_BASE seconds,
+# doubling on every further attempt up to BACKOFF_MAX seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60
+
+# Longest 'Retry-After' delay, in seconds, that is honoured as sent by a server
+MAX_RETRY_AFTER = 300
+
+# Number of times a plan list page or plan detail that still fails after MAX_RETRIES is
+# requeued behind the other requests before it is given up on. Plan details given up on
+# are parked in the brand's dead letters and retried by its next sync (see work_queue.py).
+REQUEUE_ATTEMPTS = 1
+
+# Number of plan list pages fetched ahead of the page being written to disk
+PLAN_PAGE_WINDOW = 8
+
+# Format of the plan lists and plan details saved under brands/: 'pretty' (indented JSON),
+# 'compact' (JSON without whitespace), 'gzip' or 'zstd' (compressed compact JSON, 'zstd'
+# needs the 'zstandard' package). Files keep their '.json' names and are read in any format.
+STORAGE_FORMAT = "pretty"
+
+# Where plan lists and plan details are kept: 'json' for one file per document under
+# brands/, or 'sqlite' for the single database file STORE_PATH (see plan_store.py)
+STORE_BACKEND = "json"
+STORE_PATH = "brands/plans.db"
+
+# JSON run report written at the end of every sync, with the requests, latencies, bytes,
+# retries, errors and plan detail outcomes of each retailer (see sync_metrics.py)
+SYNC_REPORT_FILE = "brands/sync_report.json"
+
+# Seconds between the progress summaries a sync logs: plan details checked, their rate and
+# the time remaining. Individual plans are only logged with '--debug'.
+PROGRESS_INTERVAL = 10
+
+# Number of downloaded plan details saved together, in one transaction with 'sqlite'
+DETAIL_SAVE_BATCH = 100
+
+# Worker processes that parse the plan lists of several brands at once for the plan
+# records loader (plan_records.py), one per CPU if None
+PLAN_LOAD_WORKERS = None
+
+# Address and port of the plan query service (serve_plans.py), how often in seconds it
+# reloads brands changed by a sync, and how many responses it caches between reloads
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8080
+SERVE_RELOAD_SECONDS = 30
+SERVE_CACHE_SIZE = 4096
+
+# GST added to the published (GST exclusive) charges by the bill estimator (bill_estimator.py)
+GST_RATE = 0.10
+
+# Worker processes used to rank plans for a batch of customers (rank_customers.py), one
+# per CPU if None, and the number of customers sent to a worker at once
+RANK_WORKERS = None
+RANK_SHARD_SIZE = 1000
@@ -9,115 +9,293 @@ The script uses the 'x-v: 1' header for API requests and queries the API with sp
 
 Plans are saved to 'brands/{brand}/plans.json' and include a 'meta.lastDownloaded' field with the
 current datetime in UTC. Directories are created as needed. Plans are only updated if they are
-older than the interval specified by 'REFRESH_DAYS' in 'config.py'.
+older than the interval specified by 'REFRESH_DAYS' in 'config.py'. Plan details are only
+downloaded for plans that were added or whose 'lastUpdated' changed since the previous
+plan list, and deleted for plans that are no longer listed. That work is checkpointed in
+'brands/{brand}/queue.json' (see work_queue.py), so an interrupted sync resumes where it
+left off, and plan details that keep failing are parked there instead of failing the brand.
+
+Refreshes use conditional requests. The ETag and Last-Modified validators of each plan list
+page are kept in 'brands/{brand}/plans.meta.json' and those of each plan detail in its
+'meta' field, so documents that have not changed come back as '304 Not Modified' without
+a body.
 
 Usage:
-    python get_plans.py [--debug]
+    python get_plans.py [--debug] [--dry-run]
 
 
 Example:
     python get_plans.py --debug
 """
 
-import concurrent.futures  # For parallel execution of tasks
+import asyncio  # For running the fetches concurrently on one event loop
+import atexit
+import logging.handlers
+import queue
 from utilities import ensure_brand_directory, is_file_older_than
 #from get_plan_detail import download_and_save_plan_details, setup_logging as setup_detail_logging
-from utilities import load_provider_urls, download_and_extract_pdf_data
+from utilities import load_provider_urls
 import logging
 import os
-import requests
 import json
-from datetime import datetime, timezone, timedelta
-from datetime import datetime
+import time
+import contextlib
+import aiohttp
 import argparse  # For parsing command line arguments
-from concurrent.futures import ThreadPoolExecutor
-from config import DETAIL_THREADS, REFRESH_DAYS
+from collections import namedtuple
+from cdr_client import CDRClient, run_with_client, conditional_headers, response_validators
+from storage import AtomicJsonListWriter, check_storage_format, load_json, decode_json, encode_json, replace_file
+from manifest import PlanManifest, format_last_downloaded, refresh_cutoff
+from plan_index import PlanIndexBuilder
+from tariff_cache import TariffCache, encode_plan_tariff
+from config import REFRESH_DAYS, PROVIDER_CONCURRENCY, REQUEUE_ATTEMPTS, PLAN_PAGE_WINDOW, STORAGE_FORMAT
+from config import STORE_BACKEND, DETAIL_SAVE_BATCH, DETAIL_WORKERS, SYNC_REPORT_FILE, PROGRESS_INTERVAL
+from sync_metrics import SyncMetrics, write_prometheus, write_report
+from work_queue import WorkQueue
+import plan_store
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--debug", action="store_true", help="Enable debug logging")
-args = parser.parse_args()
+async def fetch_plans_page_async(client, base_url, headers, page, validators=None):
+    """
+    Fetch a single page of plans for a given provider.
 
-logging.basicConfig(  # Set up basic configuration for logging
-    level=logging.DEBUG if args.debug else logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
+    Args:
+        client (CDRClient): The client used to send the request.
+        base_url (str): The base URL of the provider's API.
+        headers (dict): The headers to use for the API request.
+        page (int): The page number to fetch.
+        validators (dict, optional): The saved validators of the page. If given, the
+            request is conditional.
 
-if args.debug:
-    logging.basicConfig(
-        level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
-    )
-else:  # Set logging level to INFO if debug is not enabled
-    logging.basicConfig(
-        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    Returns:
+        CDRResponse: The response for the page.
+    """
+    params = {
+        "effective": "CURRENT",
+        "type": "ALL",
+        "page": str(page),
+        "page-size": "1000",
+        "fuelType": "ALL",
+    }
+    if validators:
+        headers = {**headers, **conditional_headers(validators)}
+    return await client.get(
+        f"{base_url}cds-au/v1/energy/plans", base_url=base_url, headers=headers, params=params
     )
 
-logging.info("Starting electricity plans script")
+
+PlanPage = namedtuple("PlanPage", ["page", "plans", "validators", "total_pages"])
+PlanPage.__doc__ = """
+A fetched page of a provider's plan list.
+
+Attributes:
+    page (int): The page number.
+    plans (list): The plans on the page, or None if the page was not modified.
+    validators (dict): The validators of the page.
+    total_pages (int): The 'meta.totalPages' of the response, or None if the page was
+        not modified.
+"""
 
 
-def setup_detail_logging(debug):
+async def fetch_plans_page_with_retry_async(client, base_url, headers, page, validators=None):
     """
-    Configure the logging level for the detail module based on the debug flag.
+    Fetch a single page of plans, requeueing it up to 'REQUEUE_ATTEMPTS' times if it
+    still fails after the client's own retries.
 
     Args:
-        debug (bool): If True, set logging to debug level, otherwise to info level.
+        client (CDRClient): The client used to send the requests.
+        base_url (str): The base URL of the provider's API.
+        headers (dict): The headers to use for the API request.
+        page (int): The page number to fetch.
+        validators (dict, optional): The saved validators of the page. If given, the
+            request is conditional.
+
+    Returns:
+        PlanPage: The fetched page, or None if it could not be fetched.
     """
-    if debug:
-        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-    else:
-        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')  # Use INFO level for non-debug mode
-        # Note: The logging statement for skipping up-to-date plan details has been moved to the appropriate function.
+    for attempt in range(1, REQUEUE_ATTEMPTS + 2):
+        try:
+            response = await fetch_plans_page_async(client, base_url, headers, page, validators)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logging.warning(f"Failed to fetch plans for page {page} (attempt {attempt}): {error!r}")
+            continue
+        if response.status == 304:
+            logging.debug("Page %s: Not modified", page)
+            return PlanPage(page, None, validators, None)
+        if not response.ok:
+            logging.warning(
+                f"Failed to fetch plans for page {page} with status code: {response.status} "
+                f"(attempt {attempt})"
+            )
+            continue
+        data = response.json()  # Parse the JSON response
+        if "meta" not in data or "totalPages" not in data["meta"]:
+            logging.error(  # Log an error if the expected metadata is not present
+                f"Missing 'meta' or 'totalPages' in response data for page {page}"
+            )
+            return None
+        plans_data = data.get("data", {}).get("plans", [])
+        if plans_data:
+            logging.debug("Page %s: Retrieved %d plans", page, len(plans_data))
+        return PlanPage(page, plans_data, response_validators(response), data["meta"]["totalPages"])
+    logging.error(f"Failed to fetch plans for page {page} after {REQUEUE_ATTEMPTS + 1} attempts")
+    return None
 
 
-def fetch_plans(base_url, headers):
+class IncompletePlanListError(Exception):
+    """Raised when a page of a provider's plan list cannot be fetched."""
+
+
+async def iter_plan_pages_async(client, base_url, headers, validators=None):
     """
-    Fetches all plans for a given provider using their base URL.
+    Fetch a provider's plan list, yielding the plans of each page in page order.
+
+    The first page is fetched on its own to learn 'meta.totalPages'; the remaining pages
+    are then fetched concurrently, at most 'PLAN_PAGE_WINDOW' pages ahead of the page
+    being yielded, so memory use does not grow with the number of pages. Each page is
+    retried on its own if it fails.
+
+    When list validators are given, every page is requested conditionally. If all pages
+    come back unchanged, nothing is yielded. If only some pages are unchanged, those
+    pages are fetched again in full so that the complete list is yielded. The validators
+    are updated in place with those of the new responses.
+
+    While the first page is unchanged the saved page count is used, but the count of
+    every page fetched in full replaces it, so a list that grew or shrank is fetched to
+    its current end. A full first page reporting no pages yields its empty list rather
+    than nothing, so the list is not taken as unchanged.
 
     Args:
+        client (CDRClient): The client used to send the requests.
         base_url (str): The base URL of the provider's API.
         headers (dict): The headers to use for the API request.
+        validators (dict, optional): The saved list validators, as returned by
+            'load_plan_list_validators'.
 
-    Returns:
-        list: A list of plan dictionaries fetched from the provider.
+    Yields:
+        list: The plans of each page, in page order.
+
+    Raises:
+        IncompletePlanListError: If a page could not be fetched.
     """
-    page = 1
-    plans = []
+    page_validators = validators.setdefault("pages", {}) if validators is not None else {}
+    saved_total_pages = validators.get("totalPages") if validators is not None else None
+
+    async def fetch_page(page, conditional=True):
+        saved = page_validators.get(str(page)) if conditional and saved_total_pages else None
+        plan_page = await fetch_plans_page_with_retry_async(client, base_url, headers, page, saved)
+        if plan_page is None:
+            raise IncompletePlanListError(f"Failed to fetch page {page} of {base_url}")
+        return plan_page
+
+    scheduled = {}  # Pages being fetched ahead of the page being yielded
+
+    def count_pages(page):
+        nonlocal total_pages
+        if page.plans is None:  # Not modified, so it has no count
+            return
+        total_pages = max(page.total_pages or 0, 1)  # A list of no pages is an empty page
+        for number in [number for number in scheduled if number > total_pages]:
+            scheduled.pop(number).cancel()
+
     logging.debug(f"Fetching plans for provider with base URL: {base_url}")
-    while True:  # Loop until all pages have been fetched
-        params = {
-            "effective": "CURRENT",
-            "type": "ALL",
-            "page": str(page),
-            "page-size": "1000",
-            "fuelType": "ALL",
-        }
-        response = requests.get(
-            f"{base_url}cds-au/v1/energy/plans", headers=headers, params=params
-        )
-        if response.ok:
-            data = response.json()  # Parse the JSON response
-            if "meta" in data and "totalPages" in data["meta"]:
-                plans_data = data.get("data", {}).get("plans", [])
-                if plans_data:
-                    plans.extend(plans_data)
-                    logging.debug(f"Page {page}: Retrieved {len(plans_data)} plans")
-                if page >= data["meta"]["totalPages"]:
+    first_page = await fetch_page(1)
+    total_pages = saved_total_pages
+    count_pages(first_page)
+    held_pages = []  # Unmodified pages, held until it is known whether any page changed
+    modified = False
+    page_number = 0
+    try:
+        while page_number < total_pages:
+            page_number += 1
+            # From this page on, as a list found to have grown has not scheduled it yet
+            for ahead in range(max(page_number, 2), min(page_number + PLAN_PAGE_WINDOW, total_pages) + 1):
+                if ahead not in scheduled:
+                    scheduled[ahead] = asyncio.ensure_future(fetch_page(ahead))
+            page = first_page if page_number == 1 else await scheduled.pop(page_number)
+            count_pages(page)
+            if page.plans is None and not modified:
+                logging.debug("Page %s: Not modified", page.page)
+                held_pages.append(page.page)
+                continue
+            if not modified:  # The held pages are needed in full after all
+                modified = True
+                for held_page in await asyncio.gather(
+                    *(fetch_page(number, conditional=False) for number in held_pages)
+                ):
+                    count_pages(held_page)
+                    page_validators[str(held_page.page)] = held_page.validators
+                    yield held_page.plans
+                if page_number > total_pages:  # The refetched first page counts fewer pages
                     break
-            else:
-                logging.error(  # Log an error if the expected metadata is not present
-                    f"Missing 'meta' or 'totalPages' in response data for page {page}"
-                )
-                break
-        else:
-            logging.error(
-                f"Failed to fetch plans for page {page} with status code: {response.status_code}"
-            )
-            break
-        page += 1  # Increment the page number for the next API call
+            if page.plans is None:
+                page = await fetch_page(page.page, conditional=False)
+                count_pages(page)
+            page_validators[str(page.page)] = page.validators
+            yield page.plans
+    finally:
+        for task in scheduled.values():
+            task.cancel()
+    if validators is not None and modified:
+        validators["totalPages"] = total_pages
+        for number in [number for number in page_validators if int(number) > total_pages]:
+            del page_validators[number]  # Pages past the end of a list that shrank
+    if not modified:
+        logging.debug("Plan list not modified")
+
+
+async def fetch_plans_async(client, base_url, headers, validators=None):
+    """
+    Fetches all plans for a given provider using their base URL.
+
+    If any page cannot be fetched, the incomplete list is discarded and an empty list is
+    returned. See 'iter_plan_pages_async' for how pages are fetched and how validators
+    are used.
+
+    Args:
+        client (CDRClient): The client used to send the requests.
+        base_url (str): The base URL of the provider's API.
+        headers (dict): The headers to use for the API request.
+        validators (dict, optional): The saved list validators, as returned by
+            'load_plan_list_validators'.
+
+    Returns:
+        list: A list of plan dictionaries fetched from the provider, or None if the
+        list has not been modified.
+    """
+    pages = []
+    try:
+        async with contextlib.aclosing(
+            iter_plan_pages_async(client, base_url, headers, validators)
+        ) as plan_pages:
+            async for plans_data in plan_pages:
+                pages.append(plans_data)
+    except IncompletePlanListError as error:
+        logging.error(f"Discarding the incomplete plan list: {error}")
+        return []
+    if not pages:
+        return None
+    plans = [plan for plans_data in pages for plan in plans_data]
     logging.debug(f"Total plans fetched: {len(plans)}")
     return plans
 
 
+def fetch_plans(base_url, headers):
+    """
+    Fetches all plans for a given provider using their base URL.
+
+    Blocking wrapper around 'fetch_plans_async'.
+
+    Args:
+        base_url (str): The base URL of the provider's API.
+        headers (dict): The headers to use for the API request.
+
+    Returns:
+        list: A list of plan dictionaries fetched from the provider.
+    """
+    return run_with_client(fetch_plans_async, base_url, headers)
+
+
 def save_plans_to_file(provider_name, plans):
     """
     Saves a list of plans to a JSON file for a given provider.
@@ -128,24 +306,176 @@ def save_plans_to_file(provider_name, plans):
 
     The function creates a directory for the provider if it does not exist,
     and either writes the plans to a file or deletes the existing file if no plans are fetched.
+    The file is replaced atomically, see 'AtomicJsonListWriter'.
     """
     directory = ensure_brand_directory(provider_name)
     filename = f"{directory.replace(' ', '_')}/plans.json"
     if plans:  # If plans is not an empty list, write to file
-        with open(filename, "w") as file:  # Open the file for writing
-            file.write(json.dumps(plans, indent=4))
+        with open_plan_list_writer(provider_name) as writer:
+            writer.write(plans)
+            writer.commit()
+        index = PlanIndexBuilder(provider_name.replace(' ', '_').lower())
+        index.add(plans)
+        index.save(directory)
+        touch_plan_list(provider_name)
         logging.info(
-            f"Saved {len(plans)} plans for provider '{provider_name}' to '{filename}'"
+            f"Saved {len(plans)} plans for provider '{provider_name}' to '{plan_list_location(provider_name)}'"
         )
+    elif STORE_BACKEND == "sqlite":
+        plan_store.get_store().delete_plan_list(provider_name)
     elif os.path.exists(filename):  # If plans is empty and file exists, delete the file
         os.remove(filename)
         logging.info(f"Deleted existing file '{filename}' as no plans were fetched")
 
 
+def plan_list_location(provider_name):
+    """
+    Describe where a provider's plan list is saved, for the log.
+
+    Args:
+        provider_name (str): The name of the provider.
+
+    Returns:
+        str: The path of its 'plans.json', or of the plan store.
+    """
+    if STORE_BACKEND == "sqlite":
+        return plan_store.get_store().path
+    return f"brands/{provider_name.replace(' ', '_').lower()}/plans.json"
+
+
+def open_plan_list_writer(provider_name):
+    """
+    Open a writer that replaces a provider's saved plan list once committed.
+
+    Args:
+        provider_name (str): The name of the provider.
+
+    Returns:
+        AtomicJsonListWriter: A writer for its 'plans.json', or a 'plan_store'
+        'PlanListWriter' with the same interface when 'STORE_BACKEND' is 'sqlite'.
+    """
+    if STORE_BACKEND == "sqlite":
+        return plan_store.get_store().plan_list_writer(provider_name)
+    return AtomicJsonListWriter(f"{ensure_brand_directory(provider_name)}/plans.json")
+
+
+def plan_list_is_outdated(provider_name):
+    """
+    Check whether a provider's plan list is missing or older than 'REFRESH_DAYS'.
+
+    Args:
+        provider_name (str): The name of the provider.
+
+    Returns:
+        bool: True if the plan list needs to be refreshed.
+    """
+    max_age = REFRESH_DAYS * 24 * 60 * 60
+    if STORE_BACKEND == "sqlite":
+        saved_at = plan_store.get_store().plan_list_saved_at(provider_name)
+        return saved_at is None or time.time() - saved_at > max_age
+    brand_directory = f"brands/{provider_name.replace(' ', '_').lower()}"
+    if not os.path.isfile(f"{brand_directory}/plans.json"):
+        return True
+    last_downloaded = PlanManifest.load(brand_directory).plan_list.get("lastDownloaded")
+    if last_downloaded:  # The same clock as the plan details
+        return last_downloaded < refresh_cutoff(REFRESH_DAYS)
+    return is_file_older_than(f"{brand_directory}/plans.json", max_age)
+
+
+def touch_plan_list(provider_name):
+    """
+    Record that a provider's plan list was downloaded or found unmodified.
+
+    Args:
+        provider_name (str): The name of the provider.
+    """
+    if STORE_BACKEND == "sqlite":
+        plan_store.get_store().touch_plan_list(provider_name)
+        return
+    brand_directory = f"brands/{provider_name.replace(' ', '_').lower()}"
+    os.utime(f"{brand_directory}/plans.json")
+    manifest = PlanManifest.load(brand_directory)
+    manifest.touch_plan_list()
+    manifest.save()
+
+
+def load_plan_list_validators(provider_name):
+    """
+    Load the saved validators of a provider's plan list.
+
+    Args:
+        provider_name (str): The name of the provider.
+
+    Returns:
+        dict: The 'totalPages' of the list and the 'etag' and 'lastModified' of each of
+        its 'pages', or an empty dict if the list or its validators have not been saved.
+    """
+    if STORE_BACKEND == "sqlite":
+        return plan_store.get_store().load_list_validators(provider_name)
+    directory = f"brands/{provider_name.replace(' ', '_').lower()}"
+    filename = f"{directory}/plans.meta.json"
+    if not os.path.isfile(filename) or not os.path.isfile(f"{directory}/plans.json"):
+        return {}
+    with open(filename, "r") as file:
+        return json.load(file)
+
+
+def save_plan_list_validators(provider_name, validators):
+    """
+    Save the validators of a provider's plan list next to its 'plans.json'.
+
+    Args:
+        provider_name (str): The name of the provider.
+        validators (dict): The list validators to save.
+    """
+    if STORE_BACKEND == "sqlite":
+        plan_store.get_store().save_list_validators(provider_name, validators)
+        return
+    directory = ensure_brand_directory(provider_name)
+    with open(f"{directory}/plans.meta.json", "w") as file:
+        json.dump(validators, file, indent=4)
+
+
+async def fetch_plan_details_async(client, base_url, headers, plan_id, validators=None):
+    """
+    Fetch the details of a specific plan from the API.
+
+    The 'etag' and 'lastModified' validators of the response are stored in the 'meta'
+    field of the returned details, where 'save_plan_details' keeps them.
+
+    Args:
+        client (CDRClient): The client used to send the request.
+        base_url (str): The base URL for the provider's API.
+        headers (dict): The headers to use for the API request.
+        plan_id (str): The unique identifier for the plan.
+        validators (dict, optional): The saved validators of the plan details. If
+            given, the request is conditional.
+
+    Returns:
+        dict: The plan details as a dictionary, or None if they have not been modified.
+
+    Raises:
+        aiohttp.ClientResponseError: If the plan details could not be fetched.
+    """
+    if validators:
+        headers = {**headers, **conditional_headers(validators)}
+    response = await client.get(
+        f"{base_url}cds-au/v1/energy/plans/{plan_id}", base_url=base_url, headers=headers
+    )
+    if response.status == 304:
+        return None
+    response.raise_for_status()  # Never save an error body as plan details
+    plan_details = response.json()
+    plan_details['meta'] = {**(plan_details.get('meta') or {}), **response_validators(response)}
+    return plan_details
+
+
 def fetch_plan_details(base_url, headers, plan_id):  # Fetch details for a specific plan
     """
     Fetch the details of a specific plan from the API.
 
+    Blocking wrapper around 'fetch_plan_details_async'.
+
     Args:
         base_url (str): The base URL for the provider's API.
         headers (dict): The headers to use for the API request.
@@ -154,126 +484,881 @@ def fetch_plan_details(base_url, headers, plan_id):  # Fetch details for a speci
     Returns:
         dict: The plan details as a dictionary.
     """
-    response = requests.get(f"{base_url}cds-au/v1/energy/plans/{plan_id}", headers=headers)
-    return response.json()
+    return run_with_client(fetch_plan_details_async, base_url, headers, plan_id)
+
 
 def save_plan_details(brand_name, plan_id, plan_details):
     """
     Save the details of a plan to a JSON file.
 
+    The 'meta' field is replaced by the current 'lastDownloaded' time and any 'etag'
+    and 'lastModified' validators already present in it.
+
     Args:
         brand_name (str): The name of the brand to which the plan belongs.
         plan_id (str): The unique identifier for the plan.
         plan_details (dict): The plan details to save.
     """
+    save_plan_details_batch(brand_name, [(plan_id, plan_details)])
+
+
+def save_plan_details_batch(brand_name, batch, manifest=None, tariffs=None):
+    """
+    Save the details of several plans, in one transaction with the 'sqlite' backend.
+
+    See 'save_plan_details' for how the 'meta' field is saved. With the 'json' backend
+    the saved files are recorded in the brand's manifest, and unmodified details are
+    only marked as downloaded there instead of being rewritten. The tariffs of saved
+    details are compiled and cached with them (see tariff_cache.py).
+
+    Args:
+        brand_name (str): The name of the brand to which the plans belong.
+        batch (list): Pairs of plan IDs and plan details. Details of None mean that the
+            saved details were not modified, and only their 'lastDownloaded' time is
+            updated.
+        manifest (PlanManifest, optional): The brand's loaded manifest, which the caller
+            saves. If not given, the manifest is loaded and saved here.
+        tariffs (TariffCache, optional): The brand's loaded compiled tariffs, which the
+            caller saves. If not given, they are loaded and saved here.
+    """
+    last_downloaded = format_last_downloaded()
+    modified = [(plan_id, plan_details) for plan_id, plan_details in batch if plan_details is not None]
+    unmodified_ids = [plan_id for plan_id, plan_details in batch if plan_details is None]
+    for plan_id, plan_details in modified:
+        validators = {key: value for key, value in (plan_details.get('meta') or {}).items()
+                      if key in ('etag', 'lastModified')}
+        plan_details['meta'] = {'lastDownloaded': last_downloaded, **validators}
+
+    if STORE_BACKEND == "sqlite":
+        store = plan_store.get_store()
+        store.save_plan_details(brand_name, modified, tariffs={
+            plan_id: encode_plan_tariff(plan_id, plan_details) for plan_id, plan_details in modified
+        })
+        store.touch_plan_details(brand_name, unmodified_ids, last_downloaded)
+        logging.debug("Saved %d plan details for '%s' to '%s'", len(batch), brand_name, store.path)
+        return
     brand_directory = ensure_brand_directory(brand_name)
-    filename = f"{brand_directory}/{plan_id}.json"
-    last_downloaded = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
-    plan_details['meta'] = {'lastDownloaded': last_downloaded}
-    with open(filename, 'w') as file:
-        json.dump(plan_details, file, indent=4)  # Write the plan details to the file with indentation
-    logging.info(f"Plan details for plan ID '{plan_id}' were saved.")
+    brand_manifest = manifest or PlanManifest.load(brand_directory)
+    brand_tariffs = tariffs or TariffCache.load(brand_directory)
+    for plan_id in brand_manifest.touch_plans(unmodified_ids, last_downloaded):
+        # Not in the manifest, so rewrite the saved file with the new time instead
+        plan_details = load_saved_plan_details(brand_name, plan_id)
+        if plan_details is not None:
+            plan_details['meta']['lastDownloaded'] = last_downloaded
+            modified.append((plan_id, plan_details))
+    for plan_id, plan_details in modified:
+        data = encode_json(plan_details)  # Encoded in the configured 'STORAGE_FORMAT'
+        replace_file(f"{brand_directory}/{plan_id}.json", data)
+        brand_manifest.record_plan(plan_id, plan_details['meta'], data)
+        brand_tariffs.record_plan(plan_id, plan_details, brand_manifest.plans[plan_id]['hash'])
+        logging.debug("Plan details for plan ID '%s' were saved.", plan_id)
+    if manifest is None:
+        brand_manifest.save()
+    if tariffs is None:
+        brand_tariffs.save()
+
+
+def load_saved_plan_details(brand, plan_id):
+    """
+    Load the saved details of a plan.
+
+    Args:
+        brand (str): The name of the brand to which the plan belongs.
+        plan_id (str): The unique identifier for the plan.
+
+    Returns:
+        dict: The saved plan details, or None if they have not been saved.
+    """
+    if STORE_BACKEND == "sqlite":
+        return plan_store.get_store().load_plan_details(brand, plan_id)
+    brand_sanitized = brand.replace(' ', '_').lower()
+    plan_detail_file = f"brands/{brand_sanitized}/{plan_id}.json"
+    # Define the plan detail file path based on the brand and plan ID
+    if not os.path.isfile(plan_detail_file):  # Check if the plan detail file exists
+        logging.debug("Plan detail file does not exist: %s", plan_detail_file)
+        return None
+    logging.debug("Plan detail file exists: %s", plan_detail_file)
+    return load_json(plan_detail_file)
+
+
+def load_saved_plan_meta(brand, plan_ids, manifest=None):
+    """
+    Load the 'meta' of the saved details of several plans.
+
+    The details themselves are not parsed: with the 'sqlite' backend this is a single
+    indexed query, and with the 'json' backend the entries come from the brand's
+    manifest. Saved files the manifest does not list are read once and added to it.
+
+    Args:
+        brand (str): The name of the brand to which the plans belong.
+        plan_ids (list): The unique identifiers of the plans.
+        manifest (PlanManifest, optional): The brand's loaded manifest, which the caller
+            saves. If not given, the manifest is loaded and saved here.
+
+    Returns:
+        dict: A mapping of the plan IDs with saved details to their 'meta'.
+    """
+    if STORE_BACKEND == "sqlite":
+        return plan_store.get_store().load_plan_meta(brand, plan_ids)
+    brand_directory = f"brands/{brand.replace(' ', '_').lower()}"
+    brand_manifest = manifest or PlanManifest.load(brand_directory)
+    saved_files = set(os.listdir(brand_directory)) if os.path.isdir(brand_directory) else set()
+    plan_meta = {}
+    unindexed_ids = []
+    for plan_id in plan_ids:
+        if f"{plan_id}.json" not in saved_files:
+            continue
+        entry = brand_manifest.plans.get(plan_id)
+        if entry is None:
+            unindexed_ids.append(plan_id)
+        else:
+            plan_meta[plan_id] = entry
+    for plan_id in unindexed_ids:
+        filename = f"{brand_directory}/{plan_id}.json"
+        try:
+            with open(filename, "rb") as file:
+                data = file.read()
+            meta = decode_json(data).get('meta') or {}
+        except (OSError, ValueError) as error:  # Unreadable, so download it again
+            logging.warning(f"Failed to read saved plan detail for '{plan_id}': {error!r}")
+            continue
+        brand_manifest.record_plan(plan_id, meta, data)
+        plan_meta[plan_id] = meta
+    if unindexed_ids:
+        logging.info(f"Added {len(unindexed_ids)} saved plan details of '{brand}' to its manifest")
+        if manifest is None:
+            brand_manifest.save()
+    return plan_meta
+
+
+def plan_details_are_current(plan_id, plan_details):
+    """
+    Check whether saved plan details are younger than 'REFRESH_DAYS'.
+
+    Args:
+        plan_id (str): The unique identifier for the plan.
+        plan_details (dict): The saved plan details, or None if they have not been saved.
+
+    Returns:
+        bool: True if the saved plan details do not need to be refreshed.
+    """
+    return plan_meta_is_current(plan_id, None if plan_details is None else plan_details.get('meta', {}))
+
+
+def plan_meta_is_current(plan_id, meta, cutoff=None):
+    """
+    Check whether saved plan details are younger than 'REFRESH_DAYS' from their 'meta'.
+
+    Args:
+        plan_id (str): The unique identifier for the plan.
+        meta (dict): The 'meta' of the saved plan details, or None if they have not
+            been saved.
+        cutoff (str, optional): The result of 'refresh_cutoff(REFRESH_DAYS)', which
+            callers checking many plans compute once.
+
+    Returns:
+        bool: True if the saved plan details do not need to be refreshed.
+    """
+    if meta is None:
+        logging.debug("Downloading plan detail for '%s' as file does not exist.", plan_id)
+        return False
+    last_downloaded = meta.get('lastDownloaded')
+    if last_downloaded:
+        # 'lastDownloaded' values sort chronologically, so no parsing is needed
+        if last_downloaded >= (cutoff or refresh_cutoff(REFRESH_DAYS)):
+            logging.debug("Skipping plan detail for '%s' as it is up-to-date.", plan_id)
+            return True
+        logging.debug("Downloading plan detail for '%s'.", plan_id)
+    else:
+        logging.debug("Downloading plan detail for '%s' due to missing 'lastDownloaded'.", plan_id)
+    return False
+
 
-def update_plan_details(brand, plan_ids, base_url, headers):
+async def update_plan_details_async(client, brand, plan_ids, base_url, headers, force=False, work_queue=None):
     """
     Update the plan details for the given brand and plan IDs.
 
+    All outdated plan details, or all given plan details if 'force' is set, are
+    requested by up to 'DETAIL_WORKERS' concurrent workers; the client bounds how many
+    requests are actually in flight. Plan details that were saved before are requested
+    conditionally, and if they have not been modified only their 'lastDownloaded' time
+    is updated. Plan details that still fail after the client's retries are requeued
+    up to 'REQUEUE_ATTEMPTS' times, after the rest of the brand's plan details. The
+    saved 'meta' of all plans is loaded up front from the store or the brand's
+    manifest, downloaded details are saved in batches of 'DETAIL_SAVE_BATCH', and the
+    manifest and compiled tariffs are saved once at the end. Reads and writes run in
+    worker threads so they do not block the event loop. Skipped, saved, unmodified and
+    failed plan details and the time spent saving them are recorded in the client's
+    metrics, which the sync's progress summaries are made from; individual plans are
+    only logged at debug level.
+
+    With a 'work_queue', plan details are removed from it as each batch is saved and the
+    queue is checkpointed, so an interrupted sync resumes with the rest, and plan details
+    that still fail are parked in its dead letters with their last error.
+
     Args:
+        client (CDRClient): The client used to send the requests.
         brand (str): The name of the brand whose plan details are to be updated.
         plan_ids (list): A list of plan IDs.
         base_url (str): The base URL for downloading plan details.
         headers (dict): The headers to be used for the HTTP request.
+        force (bool): If True, refresh the plan details regardless of their age.
+        work_queue (WorkQueue, optional): The brand's queue of unfinished sync work.
 
     Returns:
-        None
-    """
-def update_plan_details(brand, plan_ids, base_url, headers):
-    def download_and_save(plan_id):
-        brand_sanitized = brand.replace(' ', '_').lower()
-        plan_detail_file = f"brands/{brand_sanitized}/{plan_id}.json"
-        # Define the plan detail file path based on the brand and plan ID
-        if os.path.isfile(plan_detail_file):  # Check if the plan detail file exists
-            logging.info(f"Plan detail file exists: {plan_detail_file}")
-            with open(plan_detail_file, 'r') as file:
-                plan_data = json.load(file)
-            last_downloaded_str = plan_data.get('meta', {}).get('lastDownloaded')
-            if last_downloaded_str:
-                last_downloaded = datetime.strptime(last_downloaded_str, "%Y-%m-%dT%H:%M:%S.000Z").replace(tzinfo=timezone.utc)
-                current_time = datetime.now(timezone.utc)
-                if (current_time - last_downloaded) < timedelta(days=REFRESH_DAYS):
-                    logging.info(f"Skipping plan detail for '{plan_id}' as it is up-to-date.")  # Skip if the plan details are current
-                    return
-                else:
-                    logging.info(f"Downloading plan detail for '{plan_id}'.")
-            else:
-                logging.info(f"Downloading plan detail for '{plan_id}' due to missing 'lastDownloaded'.")
-        else:
-            logging.info(f"Plan detail file does not exist: {plan_detail_file}")
-            logging.info(f"Downloading plan detail for '{plan_id}' as file does not exist.")
-        plan_details = fetch_plan_details(base_url, headers, plan_id)
-        save_plan_details(brand, plan_id, plan_details)
+        list: The plan IDs whose details could not be updated.
+    """
+    manifest = tariffs = None
+    if STORE_BACKEND != "sqlite":
+        brand_directory = f"brands/{brand.replace(' ', '_').lower()}"
+        manifest = await asyncio.to_thread(PlanManifest.load, brand_directory)
+        tariffs = await asyncio.to_thread(TariffCache.load, brand_directory)
+    saved_meta = await asyncio.to_thread(load_saved_plan_meta, brand, plan_ids, manifest)
+    cutoff = refresh_cutoff(REFRESH_DAYS)
+    metrics = client.metrics
+    metrics.planned += len(plan_ids)
+    batch = []
+    errors = {}
+
+    def checkpoint(done_ids):
+        work_queue.details_done(done_ids)
+        work_queue.checkpoint()
+
+    async def save_batch():
+        nonlocal batch
+        pending_batch, batch = batch, []
+        if pending_batch:
+            started = time.perf_counter()
+            await asyncio.to_thread(save_plan_details_batch, brand, pending_batch, manifest, tariffs)
+            metrics.add_save_time(base_url, time.perf_counter() - started)
+            metrics.count(base_url, "saved", sum(1 for _, plan_details in pending_batch if plan_details is not None))
+            if work_queue is not None:
+                await asyncio.to_thread(checkpoint, [plan_id for plan_id, _ in pending_batch])
+
+    async def download_and_save(plan_id):
+        validators = saved_meta.get(plan_id)
+        if not force and plan_meta_is_current(plan_id, validators, cutoff):
+            metrics.count(base_url, "skipped")
+            metrics.checked += 1
+            if work_queue is not None:
+                work_queue.details_done([plan_id])
+            return True
+        try:
+            plan_details = await fetch_plan_details_async(client, base_url, headers, plan_id, validators)
+        except Exception as error:  # Parked below rather than failing the brand's other plans
+            logging.warning(f"Failed to fetch plan detail for '{plan_id}': {error!r}")
+            errors[plan_id] = repr(error)
+            return False
+        if plan_details is None:
+            logging.debug("Plan detail for '%s' was not modified.", plan_id)
+            metrics.count(base_url, "notModified")
+        batch.append((plan_id, plan_details))
+        metrics.checked += 1
+        if len(batch) >= DETAIL_SAVE_BATCH:
+            await save_batch()
+        return True
+
+    async def download_all(plan_ids):
+        results = {}
+        queued_ids = iter(plan_ids)
+
+        async def worker():
+            for plan_id in queued_ids:
+                results[plan_id] = await download_and_save(plan_id)
+
+        await asyncio.gather(*(worker() for _ in range(min(DETAIL_WORKERS, len(plan_ids)))))
+        return [plan_id for plan_id in plan_ids if not results[plan_id]]
+
+    pending_ids = list(plan_ids)
+    try:
+        for attempt in range(REQUEUE_ATTEMPTS + 1):
+            if attempt:  # Requeue the failures behind the rest of the brand's plan details
+                logging.info(f"Requeueing {len(pending_ids)} failed plan details for '{brand}'")
+            pending_ids = await download_all(pending_ids)
+            if not pending_ids:
+                break
+        await save_batch()
+        if work_queue is not None:  # Also records the skipped plan details, which are not saved
+            await asyncio.to_thread(work_queue.checkpoint)
+    finally:
+        if manifest is not None:  # Record the files saved so far, even if interrupted
+            started = time.perf_counter()
+            await asyncio.to_thread(manifest.save)
+            await asyncio.to_thread(tariffs.save)
+            metrics.add_save_time(base_url, time.perf_counter() - started)
+    if pending_ids:
+        metrics.count(base_url, "failed", len(pending_ids))
+        metrics.checked += len(pending_ids)
+        logging.error(f"Failed to update {len(pending_ids)} plan details for '{brand}'")
+        if work_queue is not None:
+            for plan_id in pending_ids:
+                work_queue.park(plan_id, errors[plan_id])
+            await asyncio.to_thread(work_queue.checkpoint)
+            logging.error(f"Parked {len(pending_ids)} plan details for '{brand}' in '{work_queue.path}'")
+    return pending_ids
+
+
+def update_plan_details(brand, plan_ids, base_url, headers, force=False):
+    """
+    Update the plan details for the given brand and plan IDs.
+
+    Blocking wrapper around 'update_plan_details_async'.
+
+    Args:
+        brand (str): The name of the brand whose plan details are to be updated.
+        plan_ids (list): A list of plan IDs.
+        base_url (str): The base URL for downloading plan details.
+        headers (dict): The headers to be used for the HTTP request.
+        force (bool): If True, refresh the plan details regardless of their age.
+
+    Returns:
+        list: The plan IDs whose details could not be updated.
+    """
+    return run_with_client(update_plan_details_async, brand, plan_ids, base_url, headers, force)
+
+
+def load_plan_versions(brand):
+    """
+    Load the 'lastUpdated' time of every plan in a brand's saved plan list.
+
+    Args:
+        brand (str): The name of the brand.
+
+    Returns:
+        dict: A mapping of plan IDs to their 'lastUpdated' values, empty if no plan
+        list has been saved.
+    """
+    if STORE_BACKEND == "sqlite":
+        return plan_store.get_store().plan_versions(brand)
+    plans_file_path = f"brands/{brand.replace(' ', '_').lower()}/plans.json"
+    if not os.path.exists(plans_file_path):
+        return {}
+    return {plan["planId"]: plan.get("lastUpdated") for plan in load_json(plans_file_path)}
+
+
+def diff_plan_lists(previous_versions, current_versions):
+    """
+    Compare a freshly fetched plan list against the previous snapshot.
+
+    Args:
+        previous_versions (dict): The plan IDs and 'lastUpdated' values of the previous
+            snapshot, as returned by 'load_plan_versions'.
+        current_versions (dict): The plan IDs and 'lastUpdated' values of the freshly
+            fetched plans.
+
+    Returns:
+        tuple: The IDs of plans that were added or whose 'lastUpdated' changed, and the
+        IDs of plans that are no longer listed.
+    """
+    changed_ids = [
+        plan_id for plan_id, last_updated in current_versions.items()
+        if plan_id not in previous_versions or previous_versions[plan_id] != last_updated
+    ]
+    removed_ids = [plan_id for plan_id in previous_versions if plan_id not in current_versions]
+    return changed_ids, removed_ids
+
 
-    with ThreadPoolExecutor(max_workers=DETAIL_THREADS) as executor:  # Use a thread pool to download plan details concurrently
-        futures = [executor.submit(download_and_save, plan_id) for plan_id in plan_ids]
-        for future in concurrent.futures.as_completed(futures):
-            future.result()  # This will raise any exceptions caught by the worker threads
-            # Removed incorrect code block that was outside the loop
+def missing_plan_details(brand, plan_ids):
+    """
+    Find the plans whose details have not been saved.
+
+    Args:
+        brand (str): The name of the brand.
+        plan_ids (list): The plan IDs to check.
+
+    Returns:
+        list: The plan IDs without a saved plan detail file.
+    """
+    if STORE_BACKEND == "sqlite":
+        saved_ids = plan_store.get_store().saved_plan_ids(brand)
+        return [plan_id for plan_id in plan_ids if plan_id not in saved_ids]
+    brand_directory = f"brands/{brand.replace(' ', '_').lower()}"
+    saved_files = set(os.listdir(brand_directory)) if os.path.isdir(brand_directory) else set()
+    return [plan_id for plan_id in plan_ids if f"{plan_id}.json" not in saved_files]
+
+
+def load_work_queue(brand):
+    """
+    Load a brand's queue of unfinished sync work (see work_queue.py).
+
+    Args:
+        brand (str): The name of the brand.
+
+    Returns:
+        WorkQueue: The brand's queue, empty if its last sync finished.
+    """
+    return WorkQueue.load(f"brands/{brand.replace(' ', '_').lower()}")
+
+
+def delete_plan_details(brand, plan_ids, reason="no longer listed"):
+    """
+    Delete the saved details of plans.
+
+    Args:
+        brand (str): The name of the brand.
+        plan_ids (list): The plan IDs whose details should be deleted.
+        reason (str): Why the details are deleted, for the log.
+
+    Returns:
+        int: The number of plan details deleted.
+    """
+    brand_sanitized = brand.replace(' ', '_').lower()
+    deleted = 0
+    if STORE_BACKEND == "sqlite":
+        deleted = plan_store.get_store().delete_plan_details(brand, plan_ids)
+    else:
+        for plan_id in plan_ids:
+            plan_detail_file = f"brands/{brand_sanitized}/{plan_id}.json"
+            if os.path.isfile(plan_detail_file):
+                os.remove(plan_detail_file)
+                deleted += 1
+        if plan_ids:
+            manifest = PlanManifest.load(f"brands/{brand_sanitized}")
+            manifest.remove_plans(plan_ids)
+            manifest.save()
+            tariffs = TariffCache.load(f"brands/{brand_sanitized}")
+            tariffs.remove_plans(plan_ids)
+            tariffs.save()
+    if deleted:
+        logging.info(f"Deleted details of {deleted} plans for '{brand}' ({reason})")
+    return deleted
 
 
 def setup_logging(debug):
     """
     Sets up the logging configuration.
     Set the logging level to DEBUG if debug is True, otherwise set it to INFO.
+
+    Records are put on a queue and written to the terminal by a listener thread, so the
+    event loop and the worker threads saving plan details never wait on the terminal or
+    on each other for the handler's lock. The listener is stopped, and the queue
+    flushed, at exit.
+
+    Args:
+        debug (bool): If True, log at debug level.
+
+    Returns:
+        logging.handlers.QueueListener: The running listener.
     """
     level = logging.DEBUG if debug else logging.INFO
-    logging.basicConfig(level=level, format="%(asctime)s - %(levelname)s - %(message)s")
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))  # Only merges any traceback into the message
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    logging.basicConfig(level=level, handlers=[queue_handler])
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# Actions of a brand sync plan
+SKIP = "skip"
+REFRESH_LIST = "refresh list"
+REFRESH_DETAILS = "refresh details"
+
+BrandSyncPlan = namedtuple(
+    "BrandSyncPlan", ["brand", "brand_url", "action", "plan_ids", "list_requests"]
+)
+BrandSyncPlan.__doc__ = """
+The work planned for a single brand in a sync.
+
+Attributes:
+    brand (str): The name of the brand.
+    brand_url (str): The base URL of the brand's API.
+    action (str): 'SKIP' if the brand is up-to-date, 'REFRESH_LIST' if its plan list is
+        missing, older than 'REFRESH_DAYS' or its refresh was interrupted, or
+        'REFRESH_DETAILS' if only some plan details are queued, parked or missing, or
+        some deletes are queued.
+    plan_ids (list): The plan IDs whose details are known to need downloading. When the
+        list is refreshed, plans added or updated in it are downloaded as well.
+    list_requests (int): The number of plan list pages that will be requested.
+"""
+
+
+def plan_brand_sync(brand, brand_url):
+    """
+    Decide what a sync has to do for a brand, without sending any requests.
+
+    Work left in the brand's queue by an interrupted or partly failed sync is resumed
+    first.
+
+    Args:
+        brand (str): The name of the brand.
+        brand_url (str): The base URL of the brand's API.
+
+    Returns:
+        BrandSyncPlan: The planned action and requests for the brand.
+    """
+    work_queue = load_work_queue(brand)
+    plan_ids = list(load_plan_versions(brand))
+    queued_ids = work_queue.pending_details()
+    queued = set(queued_ids)
+    missing_ids = queued_ids + [
+        plan_id for plan_id in missing_plan_details(brand, plan_ids) if plan_id not in queued
+    ]
+    if work_queue.plan_list or plan_list_is_outdated(brand):
+        total_pages = load_plan_list_validators(brand).get("totalPages", 1) if plan_ids else 1
+        return BrandSyncPlan(brand, brand_url, REFRESH_LIST, missing_ids, total_pages)
+    if missing_ids or work_queue.deletes:
+        return BrandSyncPlan(brand, brand_url, REFRESH_DETAILS, missing_ids, 0)
+    return BrandSyncPlan(brand, brand_url, SKIP, [], 0)
+
+
+def print_sync_plans(sync_plans):
+    """
+    Print the planned action and request count of every brand, and the totals.
+
+    Plan details that are added or updated in a refreshed plan list are only known once
+    the list has been fetched, so the count for those brands is a minimum.
+
+    Args:
+        sync_plans (list): The 'BrandSyncPlan' of every brand.
+    """
+    total_requests = 0
+    for sync_plan in sync_plans:
+        requests_planned = sync_plan.list_requests + len(sync_plan.plan_ids)
+        total_requests += requests_planned
+        at_least = "at least " if sync_plan.action == REFRESH_LIST else ""
+        print(f"{sync_plan.brand}: {sync_plan.action}, {at_least}{requests_planned} requests")
+    refreshing = sum(1 for sync_plan in sync_plans if sync_plan.action != SKIP)
+    print(f"{refreshing} of {len(sync_plans)} brands to refresh, at least {total_requests} requests")
+
+
+async def stream_plan_list_async(client, brand, brand_url, headers, validators=None, before_commit=None):
+    """
+    Fetch a provider's plan list and write it to 'plans.json' page by page.
+
+    Pages are appended to a temporary file as they arrive and the file only replaces
+    'plans.json' once the whole list has been fetched, so memory use stays flat and an
+    interrupted download never leaves a truncated 'plans.json'. The brand's postcode
+    and distributor index is built from the same pages and saved with the list.
+
+    Args:
+        client (CDRClient): The client used to send the requests.
+        brand (str): The name of the provider.
+        brand_url (str): The base URL of the provider's API.
+        headers (dict): The headers to use for the API requests.
+        validators (dict, optional): The saved list validators. If given, the list is
+            requested conditionally.
+        before_commit (callable, optional): Called in a worker thread with the plan IDs
+            and 'lastUpdated' values of the complete list just before it replaces
+            'plans.json'.
+
+    Returns:
+        dict: The plan IDs and 'lastUpdated' values of the saved plans, empty if the
+        list was empty or incomplete and nothing was saved, or None if the list has not
+        been modified.
+    """
+    current_versions = {}
+    pages_written = 0
+    index = PlanIndexBuilder(brand.replace(' ', '_').lower())
+    save_seconds = 0.0
+
+    def write_page(plans_data):
+        nonlocal save_seconds
+        started = time.perf_counter()
+        writer.write(plans_data)
+        index.add(plans_data)
+        save_seconds += time.perf_counter() - started
+
+    with open_plan_list_writer(brand) as writer:
+        try:
+            async with contextlib.aclosing(
+                iter_plan_pages_async(client, brand_url, headers, validators)
+            ) as plan_pages:
+                async for plans_data in plan_pages:
+                    current_versions.update(
+                        (plan["planId"], plan.get("lastUpdated")) for plan in plans_data
+                    )
+                    await asyncio.to_thread(write_page, plans_data)
+                    pages_written += 1
+        except IncompletePlanListError as error:
+            logging.error(f"Discarding the incomplete plan list: {error}")
+            return {}
+        if not pages_written:  # Every page was unchanged
+            return None
+        if not writer.count:
+            return {}
+        if before_commit is not None:
+            await asyncio.to_thread(before_commit, current_versions)
+        started = time.perf_counter()
+        await asyncio.to_thread(writer.commit)
+    await asyncio.to_thread(index.save, ensure_brand_directory(brand))
+    await asyncio.to_thread(touch_plan_list, brand)
+    client.metrics.add_save_time(brand_url, save_seconds + time.perf_counter() - started)
+    client.metrics.count(brand_url, "plansListed", writer.count)
+    logging.info(f"Saved {writer.count} plans for provider '{brand}' to '{plan_list_location(brand)}'")
+    return current_versions
+
+
+async def refresh_plan_list_async(client, brand, brand_url, headers, validators=None, work_queue=None):
+    """
+    Fetch a provider's plan list and refresh only the plan details that changed.
+
+    The fetched list is compared with the previously saved 'plans.json'. Details are
+    downloaded for plans that were added or whose 'lastUpdated' changed, or whose
+    details are missing, and deleted for plans that are no longer listed.
+
+    That work is checkpointed in the brand's queue before the fetched list replaces
+    'plans.json', and removed from it as it is done, so a sync that is interrupted after
+    the list was saved still downloads the changed details on its next run. Work already
+    in the queue is done as well.
+
+    Args:
+        client (CDRClient): The client used to send the requests.
+        brand (str): The name of the provider.
+        brand_url (str): The base URL of the provider's API.
+        headers (dict): The headers to use for the API requests.
+        validators (dict, optional): The saved list validators. If given, the list is
+            requested conditionally and the new validators are saved.
+        work_queue (WorkQueue, optional): The brand's queue of unfinished sync work. If
+            not given, it is loaded.
+
+    Returns:
+        int: The number of plans saved for the provider.
+    """
+    if work_queue is None:
+        work_queue = await asyncio.to_thread(load_work_queue, brand)
+    previous_versions = await asyncio.to_thread(load_plan_versions, brand)
+    work_queue.start_plan_list()
+    await asyncio.to_thread(work_queue.checkpoint)
+    changed_ids = []
+
+    def queue_work(current_versions):
+        changed_ids[:], removed_ids = diff_plan_lists(previous_versions, current_versions)
+        changed = set(changed_ids)
+        missing_ids = missing_plan_details(brand, [plan_id for plan_id in current_versions if plan_id not in changed])
+        logging.info(
+            f"Plan list for provider '{brand}': {len(current_versions)} plans, "
+            f"{len(changed_ids)} added or updated, {len(removed_ids)} removed"
+        )
+        work_queue.finish_plan_list(changed_ids + missing_ids, removed_ids)
+        work_queue.checkpoint()
+
+    current_versions = await stream_plan_list_async(
+        client, brand, brand_url, headers, validators, before_commit=queue_work
+    )
+    if current_versions is None:  # Mark the unchanged list as fresh
+        logging.info(f"Plan list for provider '{brand}' was not modified")
+        await asyncio.to_thread(touch_plan_list, brand)
+        work_queue.finish_plan_list(missing_plan_details(brand, list(previous_versions)), [])
+        plan_count = 0
+    elif current_versions:
+        if validators is not None:
+            save_plan_list_validators(brand, validators)
+        plan_count = len(current_versions)
+    else:  # Nothing was saved, so there is no work to queue
+        work_queue.finish_plan_list([], [])
+        await asyncio.to_thread(work_queue.checkpoint)
+        return 0
+    await delete_queued_plan_details_async(client, brand, brand_url, work_queue)
+    changed = set(changed_ids)
+    failed_ids = await update_plan_details_async(
+        client, brand, work_queue.pending_details(), brand_url, headers, force=True, work_queue=work_queue
+    )
+    # Drop the outdated details of updated plans that failed, so that the next sync
+    # sees them as missing and downloads them again
+    await asyncio.to_thread(
+        delete_plan_details, brand, [plan_id for plan_id in failed_ids if plan_id in changed],
+        "outdated and failed to refresh",
+    )
+    return plan_count
+
+
+async def delete_queued_plan_details_async(client, brand, brand_url, work_queue):
+    """
+    Delete the details of the plans queued for deletion, and checkpoint the queue.
+
+    Args:
+        client (CDRClient): The client whose metrics record the deletions.
+        brand (str): The name of the provider.
+        brand_url (str): The base URL of the provider's API.
+        work_queue (WorkQueue): The brand's queue of unfinished sync work.
+    """
+    delete_ids = list(work_queue.deletes)
+    if delete_ids:
+        deleted = await asyncio.to_thread(delete_plan_details, brand, delete_ids)
+        client.metrics.count(brand_url, "deleted", deleted)
+        work_queue.deletes_done(delete_ids)
+    await asyncio.to_thread(work_queue.checkpoint)
+
+
+async def execute_brand_sync_async(client, sync_plan, headers):
+    """
+    Carry out the planned sync for a single brand.
+
+    Args:
+        client (CDRClient): The client used to send the requests.
+        sync_plan (BrandSyncPlan): The planned action for the brand.
+        headers (dict): The headers to use for the API requests.
+
+    Returns:
+        int: The number of plans saved for the brand.
+    """
+    brand, brand_url = sync_plan.brand, sync_plan.brand_url
+    if sync_plan.action == SKIP:
+        logging.info(f"Skipping provider '{brand}' as it is up-to-date.")
+        return 0
+    work_queue = await asyncio.to_thread(load_work_queue, brand)
+    if sync_plan.action == REFRESH_LIST:
+        logging.info(f"Processing provider: {brand}")
+        validators = load_plan_list_validators(brand)
+        return await refresh_plan_list_async(client, brand, brand_url, headers, validators, work_queue)
+    if sync_plan.action == REFRESH_DETAILS:
+        # Resume the queued work and download the plan details that are missing, for
+        # example after an interrupted sync
+        logging.info(f"Downloading {len(sync_plan.plan_ids)} queued or missing plan details for provider: {brand}")
+        await delete_queued_plan_details_async(client, brand, brand_url, work_queue)
+        work_queue.add_details(sync_plan.plan_ids)
+        await update_plan_details_async(
+            client, brand, work_queue.pending_details(), brand_url, headers, force=True, work_queue=work_queue
+        )
+    return 0
+
+
+async def sync_provider_async(client, brand, brand_url, headers):
+    """
+    Fetch and save the plans and plan details for a single provider.
+
+    The time the sync takes is recorded as the provider's 'sync_seconds' in the client's
+    metrics.
+
+    Args:
+        client (CDRClient): The client used to send the requests.
+        brand (str): The name of the provider.
+        brand_url (str): The base URL of the provider's API.
+        headers (dict): The headers to use for the API requests.
+
+    Returns:
+        int: The number of plans saved for the provider.
+    """
+    retailer_metrics = client.metrics.retailer(brand_url, brand)
+    started = time.perf_counter()
+    try:
+        sync_plan = await asyncio.to_thread(plan_brand_sync, brand, brand_url)
+        return await execute_brand_sync_async(client, sync_plan, headers)
+    finally:
+        retailer_metrics.sync_seconds += time.perf_counter() - started
+
+
+def sync_provider(brand, brand_url, headers):
+    """
+    Fetch and save the plans and plan details for a single provider.
+
+    Blocking wrapper around 'sync_provider_async'.
+
+    Args:
+        brand (str): The name of the provider.
+        brand_url (str): The base URL of the provider's API.
+        headers (dict): The headers to use for the API requests.
+
+    Returns:
+        int: The number of plans saved for the provider.
+    """
+    return run_with_client(sync_provider_async, brand, brand_url, headers)
+
+
+async def sync_providers(provider_urls, headers, metrics=None):
+    """
+    Sync all providers concurrently on one event loop.
+
+    Up to 'PROVIDER_CONCURRENCY' providers are synced at a time. A provider that fails
+    is logged and does not abort the others. A summary of the plan details checked so
+    far is logged every 'PROGRESS_INTERVAL' seconds.
+
+    Args:
+        provider_urls (dict): A mapping of provider names to their base URLs.
+        headers (dict): The headers to use for the API requests.
+        metrics (SyncMetrics, optional): Where the requests and plan details of the
+            sync are recorded.
+
+    Returns:
+        tuple: The number of providers with plans and the total number of plans saved.
+    """
+    provider_slots = asyncio.Semaphore(PROVIDER_CONCURRENCY)
+
+    async def log_progress(metrics):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            progress = metrics.progress()
+            if progress:
+                logging.info(progress)
+
+    async def sync_one(client, brand, brand_url):
+        async with provider_slots:
+            try:
+                return await sync_provider_async(client, brand, brand_url, headers)
+            except Exception:  # One failing provider should not abort the others
+                logging.exception(f"Failed to sync provider: {brand}")
+                return 0
+
+    async with CDRClient(metrics=metrics) as client:
+        progress = asyncio.create_task(log_progress(client.metrics))
+        try:
+            plan_counts = await asyncio.gather(
+                *(sync_one(client, brand, brand_url) for brand, brand_url in provider_urls.items())
+            )
+        finally:
+            progress.cancel()
+    total_providers = sum(1 for plan_count in plan_counts if plan_count)
+    return total_providers, sum(plan_counts)
 
 
 def main():
     """
     The main function that orchestrates the fetching and saving of electricity plans.
 
-    Process command-line arguments, set up logging, and iterate over provider URLs
-    to fetch and save plans. It uses the 'REFRESH_DAYS' to determine whether
-    to refresh the plans for a provider.
+    Process command-line arguments, set up logging, and sync the providers concurrently,
+    up to 'PROVIDER_CONCURRENCY' at a time. The limits in 'cdr_client' further bound the
+    requests in flight. Each provider gets a single sync plan: skip it, refresh its plan
+    list (and the plan details that changed), or only download its missing plan details.
+    It uses the 'REFRESH_DAYS' to determine whether to refresh the plans for a provider.
+    With '--dry-run' the plans are printed instead of carried out. The metrics of the
+    sync are written as a JSON run report to '--report', and in the Prometheus text
+    format to '--prometheus' if given.
     """
     parser = argparse.ArgumentParser(description="Fetch and save electricity plans.")
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Print the planned action and request count for each provider without syncing",
+    )
+    parser.add_argument(
+        "--report", default=SYNC_REPORT_FILE,
+        help=f"Write the JSON run report of the sync to this file (default: {SYNC_REPORT_FILE})",
+    )
+    parser.add_argument("--prometheus", help="Also write the sync metrics in the Prometheus text format to this file")
     args = parser.parse_args()
 
     setup_logging(args.debug)  # Configure logging based on the debug flag
-    # Set up logging for the detail module as well
-    setup_detail_logging(args.debug)
+    logging.info("Starting electricity plans script")
 
     provider_urls = load_provider_urls()
     logging.info(f"Number of providers found: {len(provider_urls)}")
     headers = {"x-v": "1"}
-    total_providers = 0
-    total_plans = 0
-    for brand, brand_url in provider_urls.items():  # Iterate over each provider URL
-        brand_sanitized = brand.replace(' ', '_').lower()
-        plans_file_path = f"brands/{brand_sanitized}/plans.json"
-        if is_file_older_than(plans_file_path, REFRESH_DAYS * 24 * 60 * 60):
-            logging.info(f"Processing provider: {brand}")
-            plans = fetch_plans(brand_url, headers)
-            if plans:
-                save_plans_to_file(brand, plans)
-                total_providers += 1
-                total_plans += len(plans)
-        # Check if individual plan details are up-to-date and update if necessary
-        if os.path.exists(plans_file_path):
-            with open(plans_file_path, 'r') as file:
-                plans = json.load(file)
-            plan_ids = [plan["planId"] for plan in plans]
-            update_plan_details(brand, plan_ids, brand_url, headers)
-        logging.info(f"Processing provider: {brand}")
-        plans = fetch_plans(brand_url, headers)
-        if plans:  # Save plans and update plan details if plans are fetched
-            save_plans_to_file(brand, plans)
-            plan_ids = [plan["planId"] for plan in plans]
-            update_plan_details(brand, plan_ids, brand_url, headers)
-            total_providers += 1
-            total_plans += len(plans)
+    check_storage_format(STORAGE_FORMAT)  # Fail before syncing rather than on the first save
+    if args.dry_run:
+        print_sync_plans([plan_brand_sync(brand, brand_url) for brand, brand_url in provider_urls.items()])
+        return
+    metrics = SyncMetrics()
+    total_providers, total_plans = asyncio.run(sync_providers(provider_urls, headers, metrics))
+    logging.info(f"Synced {total_plans} plans from {total_providers} providers")
+    totals = metrics.totals()
+    logging.info(
+        f"{totals['requests']} requests ({totals['errors']} failed, {totals['retries']} retried), "
+        f"{totals['bytes']} bytes received, {totals['saved']} plan details saved, "
+        f"{totals['notModified']} not modified, {totals['skipped']} up-to-date"
+    )
+    slowest = ", ".join(f"{brand} {seconds:.1f}s" for brand, seconds in metrics.slowest_retailers() if seconds >= 0.05)
+    if slowest:
+        logging.info(f"Slowest providers: {slowest}")
+    summary = {"providers": total_providers, "plans": total_plans}
+    write_report(metrics, args.report, **summary)
+    logging.info(f"Wrote the run report to '{args.report}'")
+    if args.prometheus:
+        write_prometheus(metrics, args.prometheus, **summary)
 
 
 if __name__ == "__main__":
@@ -7,90 +7,336 @@ The script performs the following steps:
 2. Extract retailer data from the PDF.
 3. Return a list of dictionaries containing the brand and URI of each brand.
 
+The extracted list is cached in brands/providers.json and only refreshed once it is
+older than 'REFRESH_PROVIDERS' days. A refresh requests the PDF conditionally, and a
+PDF whose hash matches the cached one is not parsed again.
+
 Usage:
     Simply run the script, and it will perform the download and extraction automatically.
     The URL from which the PDF is downloaded is controlled in config.py
 
 Example:
-    python get_providers.py
+    python get_providers.py [--force]
 """
-import io
-import requests
-from bs4 import BeautifulSoup
+import argparse
+import concurrent.futures
+import json
+import os
 import urllib.parse
-import fitz  # PyMuPDF
 import logging
-from config import RETAILER_PDF_URL
+import aiohttp
+import asyncio
+from cdr_client import run_with_client, conditional_headers, response_validators
+from config import RETAILER_PDF_URL, REFRESH_PROVIDERS, PROVIDERS_FILE, PDF_PAGES_PER_WORKER, PDF_WORKERS
+from manifest import document_hash, format_last_downloaded, refresh_cutoff
+from storage import replace_file
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-def extract_pdf_data(pdf_path):
+def extract_page_rows(page):
+    """
+    Pair the brands and URIs of the retailer table on one page by the position of their
+    words.
+
+    Every word starting with 'http' is the URI of a table row, and the brand is made of
+    the words to its left whose vertical centre lies within the URI's line. A "Change log"
+    heading ends the table.
+
+    Args:
+        page (fitz.Page): The page.
+
+    Returns:
+        tuple: A list of dictionaries containing retailer 'brand' and 'uri', in reading
+        order, and whether the page holds the change log.
+    """
+    words = page.get_text("words")  # (x0, y0, x1, y1, word, block, line, word), in content order
+    end = None
+    for word, following in zip(words, words[1:]):
+        if word[4] == "Change" and following[4].lower() == "log" and following[5:7] == word[5:7]:
+            end = word[1]
+            break
+    uris = [word for word in words if word[4].lower().startswith("http") and (end is None or word[3] <= end)]
+    rows = []
+    for uri in uris:
+        brand = [word for word in words
+                 if word[2] <= uri[0] and uri[1] <= (word[1] + word[3]) / 2 <= uri[3]]
+        brand.sort(key=lambda word: (word[1], word[0]))
+        if brand and "placeholder" not in uri[4].lower():
+            rows.append({"brand": " ".join(word[4] for word in brand), "uri": uri[4]})
+    return rows, end is not None
+
+def extract_page_range(data, start, stop):
+    """
+    Extract the retailer table rows of a range of pages, stopping at the change log.
+
+    Runs in worker processes, so it opens its own copy of the document.
+
+    Args:
+        data (bytes): The PDF.
+        start (int): The first page.
+        stop (int): The page after the last.
+
+    Returns:
+        tuple: The rows of the pages and whether the change log was reached.
+    """
+    import fitz  # PyMuPDF, only imported when a PDF is parsed as it is slow to import
+
+    rows = []
+    with fitz.open(stream=data, filetype="pdf") as pdf:
+        for page_num in range(start, stop):
+            page_rows, ended = extract_page_rows(pdf.load_page(page_num))
+            rows.extend(page_rows)
+            if ended:
+                return rows, True
+    return rows, False
+
+def extract_pdf_data(pdf, pages_per_worker=PDF_PAGES_PER_WORKER, workers=PDF_WORKERS):
     """
     Extracts retailer data from a PDF file.
 
+    Documents longer than 'pages_per_worker' are split into ranges of pages parsed in
+    worker processes. The ranges are combined in page order up to the first that
+    reaches the change log, and ranges after it that have not started are cancelled.
+
     Args:
-        pdf_path (str): The file path to the PDF from which to extract data.
-        pdf_stream (stream): A byte stream of the PDF from which to extract data.
+        pdf (bytes, str or file): The PDF, its file path or a binary stream of it.
+        pages_per_worker (int): The number of pages parsed by a worker at once.
+        workers (int, optional): The maximum number of worker processes, one per CPU by
+            default.
 
     Returns:
         list of dict: A list of dictionaries containing retailer 'brand' and 'uri'.
     """
-    logger.debug(f"Opening PDF stream")
-    logger.debug(f"Opening PDF file: {pdf_path}")
+    import fitz
+
+    if isinstance(pdf, str):
+        logger.debug(f"Opening PDF file: {pdf}")
+        with open(pdf, "rb") as file:
+            data = file.read()
+    else:
+        data = pdf if isinstance(pdf, bytes) else pdf.read()
+    with fitz.open(stream=data, filetype="pdf") as document:
+        page_count = document.page_count
+    if page_count <= pages_per_worker:
+        retailer_data, _ = extract_page_range(data, 0, page_count)
+        logger.debug(f"Extracted {len(retailer_data)} providers from {page_count} pages")
+        return retailer_data
+
+    ranges = [(start, min(start + pages_per_worker, page_count)) for start in range(0, page_count, pages_per_worker)]
+    workers = min(workers or os.cpu_count() or 1, len(ranges))
     retailer_data = []
-    with fitz.open(stream=pdf_path, filetype="pdf") as pdf:  # pdf_path is now correctly passed as an argument
-        for page_num in range(pdf.page_count):
-            page = pdf.load_page(page_num)
-            text = page.get_text("text")
-            lines = text.split('\n')
-            i = 0
-            while i < len(lines) - 1:
-                if "Change log" in lines[i]:  # Stop processing if "Change log" is found
-                    break
-                    break  # Stop processing if "Change log" is found
-                brand, uri = lines[i].strip(), lines[i + 1].strip()
-                if uri.lower().startswith('http') and 'placeholder' not in uri.lower():
-                    retailer_data.append({'brand': brand, 'uri': uri})
-                    i += 2  # Skip the next line as it's already processed
-                else:
-                    i += 1  # Move to the next line
-            logger.debug(f"Processed page: {page_num + 1}/{pdf.page_count}")
-    logger.debug("Completed PDF data extraction")  # Extraction complete
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(extract_page_range, data, start, stop) for start, stop in ranges]
+        for future in futures:
+            rows, ended = future.result()
+            retailer_data.extend(rows)
+            if ended:
+                for pending in futures:
+                    pending.cancel()
+                break
+    logger.debug(f"Extracted {len(retailer_data)} providers from {page_count} pages with {workers} workers")
     return retailer_data
 
-def download_and_extract_pdf_data():
+async def find_pdf_url_async(client):
     """
-    Downloads the first PDF found at the given URL and extracts data from it to memory.
+    Find the link to the retailer PDF on the page at 'RETAILER_PDF_URL'.
 
     Args:
-        url (str): The URL to fetch the PDF from.
+        client (CDRClient): The client used to send the requests.
 
     Returns:
-        list of dict: A list of dictionaries containing retailer 'brand' and 'uri'.
+        str: The URL of the PDF, or None if the page does not link to one.
     """
+    from bs4 import BeautifulSoup  # Only imported when the page is scraped
+
     logger.info(f"Fetching URL: {RETAILER_PDF_URL}")
-    response = requests.get(RETAILER_PDF_URL)
+    response = await client.get(RETAILER_PDF_URL)
     response.raise_for_status()
 
     soup = BeautifulSoup(response.text, 'html.parser')
-    pdf_link_tag = soup.find('h3', class_='card__title file__title').find('a', href=True, type="application/pdf", class_="stretched-link")
+    card_title = soup.find('h3', class_='card__title file__title')
+    pdf_link_tag = card_title and card_title.find('a', href=True, type="application/pdf", class_="stretched-link")
 
-    
     if not pdf_link_tag:
         logger.warning("No PDF link found on the page.")
-        return []
+        return None
+    return urllib.parse.urljoin(response.url, pdf_link_tag['href'])
+
+async def download_and_extract_pdf_data_async(client):
+    """
+    Downloads the first PDF found at the given URL and extracts data from it to memory.
 
-    pdf_url = urllib.parse.urljoin(response.url, pdf_link_tag['href'])
+    Args:
+        client (CDRClient): The client used to send the requests.
+
+    Returns:
+        list of dict: A list of dictionaries containing retailer 'brand' and 'uri'.
+    """
+    pdf_url = await find_pdf_url_async(client)
+    if not pdf_url:
+        return []
     logger.info(f"Downloading PDF from: {pdf_url}")
 
-    pdf_response = requests.get(pdf_url)
+    pdf_response = await client.get(pdf_url)
     pdf_response.raise_for_status()  # Ensure we have a successful response
 
-    # Here we pass the PDF content directly as a stream
-    return extract_pdf_data(io.BytesIO(pdf_response.content))  # Correctly passing the stream to the extract_pdf_data function
+    return extract_pdf_data(pdf_response.body)
+
+def download_and_extract_pdf_data():
+    """
+    Downloads the first PDF found at the given URL and extracts data from it to memory.
+
+    Blocking wrapper around 'download_and_extract_pdf_data_async'.
+
+    Returns:
+        list of dict: A list of dictionaries containing retailer 'brand' and 'uri'.
+    """
+    return run_with_client(download_and_extract_pdf_data_async)
+
+def load_cached_providers(path=PROVIDERS_FILE):
+    """
+    Load the cached provider list.
+
+    Args:
+        path (str): The cache file.
+
+    Returns:
+        dict: The cached 'meta' and 'data', or None if there is no readable cache.
+    """
+    try:
+        with open(path, "rb") as file:
+            cached = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        logger.warning(f"Ignoring unreadable provider cache '{path}': {error!r}")
+        return None
+    if not isinstance(cached.get("data"), list):
+        return None
+    cached.setdefault("meta", {})
+    return cached
+
+def providers_are_current(cached):
+    """
+    Args:
+        cached (dict): The cached 'meta' and 'data', or None.
+
+    Returns:
+        bool: True if the cache lists providers and is younger than 'REFRESH_PROVIDERS'.
+    """
+    if not cached or not cached["data"]:
+        return False
+    last_downloaded = cached["meta"].get("lastDownloaded")
+    return bool(last_downloaded) and last_downloaded >= refresh_cutoff(REFRESH_PROVIDERS)
+
+def save_cached_providers(cached, path=PROVIDERS_FILE):
+    """
+    Atomically replace the cached provider list.
+
+    Args:
+        cached (dict): The 'meta' and 'data' to save.
+        path (str): The cache file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    replace_file(path, json.dumps(cached, indent=4).encode())
+
+async def refresh_providers_async(client, cached=None):
+    """
+    Download the retailer PDF again if it changed since it was cached, and extract it.
+
+    The PDF is requested with the cached validators if its URL has not changed. If the
+    server answers '304 Not Modified', or sends a PDF with the cached hash, the cached
+    providers are kept without parsing the PDF.
+
+    Args:
+        client (CDRClient): The client used to send the requests.
+        cached (dict, optional): The cached 'meta' and 'data'.
+
+    Returns:
+        dict: The new 'meta' and 'data' to cache.
+    """
+    cached = cached or {"meta": {}, "data": []}
+    meta = cached["meta"]
+    pdf_url = await find_pdf_url_async(client)
+    if not pdf_url:
+        raise ValueError(f"No retailer PDF linked from {RETAILER_PDF_URL}")
+    same_url = pdf_url == meta.get("pdfUrl") and cached["data"]
+    logger.info(f"Downloading PDF from: {pdf_url}")
+    pdf_response = await client.get(pdf_url, headers=conditional_headers(meta) if same_url else None)
+    if pdf_response.status == 304 and same_url:
+        logger.info("The retailer PDF was not modified")
+        return {"meta": {**meta, "lastDownloaded": format_last_downloaded()}, "data": cached["data"]}
+    pdf_response.raise_for_status()
+
+    pdf_hash = document_hash(pdf_response.body)
+    new_meta = {"lastDownloaded": format_last_downloaded(), "pdfUrl": pdf_url, "pdfHash": pdf_hash,
+                **response_validators(pdf_response)}
+    if pdf_hash == meta.get("pdfHash") and cached["data"]:
+        logger.info("The retailer PDF is unchanged")
+        return {"meta": new_meta, "data": cached["data"]}
+    data = await asyncio.to_thread(extract_pdf_data, pdf_response.body)
+    if not data:
+        raise ValueError(f"No providers found in {pdf_url}")
+    logger.info(f"Extracted {len(data)} providers from the retailer PDF")
+    return {"meta": new_meta, "data": data}
+
+async def load_providers_async(client, force=False, path=PROVIDERS_FILE):
+    """
+    Load the provider list from its cache, refreshing the cache if it is outdated.
+
+    If a refresh fails, the outdated cache is used rather than failing the sync.
+
+    Args:
+        client (CDRClient): The client used to send the requests.
+        force (bool): If True, refresh the cache regardless of its age.
+        path (str): The cache file.
+
+    Returns:
+        list of dict: A list of dictionaries containing retailer 'brand' and 'uri'.
+    """
+    cached = load_cached_providers(path)
+    if not force and providers_are_current(cached):
+        logger.debug(f"Using the provider list cached in '{path}'")
+        return cached["data"]
+    try:
+        refreshed = await refresh_providers_async(client, cached)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as error:
+        if not cached or not cached["data"]:
+            raise
+        logger.warning(f"Failed to refresh the provider list, using the cached one: {error!r}")
+        return cached["data"]
+    save_cached_providers(refreshed, path)
+    return refreshed["data"]
+
+def load_providers(force=False, path=PROVIDERS_FILE):
+    """
+    Load the provider list from its cache, refreshing the cache if it is outdated.
+
+    Blocking wrapper around 'load_providers_async'. An up to date cache is read without
+    starting a client.
+
+    Args:
+        force (bool): If True, refresh the cache regardless of its age.
+        path (str): The cache file.
+
+    Returns:
+        list of dict: A list of dictionaries containing retailer 'brand' and 'uri'.
+    """
+    cached = load_cached_providers(path)
+    if not force and providers_are_current(cached):
+        return cached["data"]
+    return run_with_client(load_providers_async, force=force, path=path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the cached list of retailer base URIs.")
+    parser.add_argument("--force", action="store_true", help="Refresh the cache regardless of its age.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    providers = load_providers(force=args.force)
+    logger.info(f"{len(providers)} providers cached in '{PROVIDERS_FILE}'")
 
-# Perform the download and data extraction.
-retailer_data = download_and_extract_pdf_data()
-# Optionally, you can now use retailer_data as needed, for example:
-# print(retailer_data)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Per-brand manifest of the documents saved in the JSON tree.
+
+Each brand directory holds a 'manifest.json' that records, for its plan list and for
+every saved plan detail, when it was last downloaded or confirmed unchanged and its
+validators, plus the size and hash of each plan detail file:
+
+    {
+        "planList": {"lastDownloaded": "2024-06-21T00:00:00.000Z"},
+        "plans": {
+            "AGL123@EME": {"lastDownloaded": "...", "etag": "...", "lastModified": "...",
+                           "size": 5120, "hash": "..."}
+        }
+    }
+
+The sync loads it once per brand, decides what to refresh from it without opening the
+plan detail files, and saves it once with all changes. Times use the 'lastDownloaded'
+format, which sorts chronologically as a string, so freshness checks are plain string
+comparisons.
+
+The manifest is an index, not the source of truth. Plan detail files that it does not
+list, for example those saved before it existed or by an interrupted sync, are indexed
+from the files themselves, and entries whose file is gone are ignored.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone, timedelta
+from storage import replace_file
+
+MANIFEST_NAME = "manifest.json"
+
+LAST_DOWNLOADED_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+def format_last_downloaded(moment=None):
+    """
+    Format a time as a 'lastDownloaded' value.
+
+    Args:
+        moment (datetime, optional): An aware datetime, now by default.
+
+    Returns:
+        str: The time in UTC, e.g. '2024-06-21T00:00:00.000Z'.
+    """
+    return (moment or datetime.now(timezone.utc)).astimezone(timezone.utc).strftime(LAST_DOWNLOADED_FORMAT)
+
+
+def refresh_cutoff(refresh_days):
+    """
+    The oldest 'lastDownloaded' value that is still current.
+
+    Args:
+        refresh_days (float): The number of days after which documents are refreshed.
+
+    Returns:
+        str: The cutoff as a 'lastDownloaded' value. Values that sort before it are
+        outdated.
+    """
+    return format_last_downloaded(datetime.now(timezone.utc) - timedelta(days=refresh_days))
+
+
+def document_hash(data):
+    """
+    Args:
+        data (bytes): The contents of a saved document.
+
+    Returns:
+        str: The hex digest recorded in the manifest.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class PlanManifest:
+    """
+    The manifest of one brand directory.
+
+    Changes are kept in memory until 'save' is called. The manifest may be updated from
+    several worker threads at once.
+
+    Args:
+        directory (str): The brand directory.
+
+    Attributes:
+        plan_list (dict): The entry of the brand's plan list.
+        plans (dict): A mapping of plan IDs to the entries of their saved details.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.plan_list = {}
+        self.plans = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Load the manifest of a brand directory.
+
+        Args:
+            directory (str): The brand directory.
+
+        Returns:
+            PlanManifest: The manifest, empty if none was saved or it is unreadable.
+        """
+        manifest = cls(directory)
+        try:
+            with open(manifest.path, "rb") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return manifest
+        except (OSError, ValueError) as error:  # Rebuilt from the files as they are needed
+            logging.warning(f"Ignoring unreadable manifest '{manifest.path}': {error!r}")
+            return manifest
+        manifest.plan_list = data.get("planList") or {}
+        manifest.plans = data.get("plans") or {}
+        return manifest
+
+    def save(self):
+        """
+        Write the manifest if it has changed since it was loaded or last saved.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps({"planList": self.plan_list, "plans": self.plans}, separators=(",", ":"))
+            self._dirty = False
+        os.makedirs(self.directory, exist_ok=True)
+        replace_file(self.path, data.encode())
+
+    def touch_plan_list(self, last_downloaded=None):
+        """
+        Record that the plan list was downloaded or confirmed unchanged.
+
+        Args:
+            last_downloaded (str, optional): The time, now by default.
+        """
+        with self._lock:
+            self.plan_list["lastDownloaded"] = last_downloaded or format_last_downloaded()
+            self._dirty = True
+
+    def record_plan(self, plan_id, meta, data):
+        """
+        Record saved plan details.
+
+        Args:
+            plan_id (str): The unique identifier for the plan.
+            meta (dict): The 'meta' the details were saved with.
+            data (bytes): The saved file contents.
+        """
+        entry = {key: value for key, value in meta.items()
+                 if key in ("lastDownloaded", "etag", "lastModified")}
+        entry["size"] = len(data)
+        entry["hash"] = document_hash(data)
+        with self._lock:
+            self.plans[plan_id] = entry
+            self._dirty = True
+
+    def update_file(self, plan_id, data):
+        """
+        Record that a listed plan detail file was rewritten, e.g. in another format.
+
+        Args:
+            plan_id (str): The unique identifier for the plan.
+            data (bytes): The new file contents.
+        """
+        with self._lock:
+            entry = self.plans.get(plan_id)
+            if entry is not None:
+                entry["size"] = len(data)
+                entry["hash"] = document_hash(data)
+                self._dirty = True
+
+    def touch_plans(self, plan_ids, last_downloaded):
+        """
+        Record that saved plan details were confirmed unchanged.
+
+        Args:
+            plan_ids (list): The plan IDs.
+            last_downloaded (str): The time they were confirmed.
+
+        Returns:
+            list: The plan IDs that the manifest does not list.
+        """
+        unlisted = []
+        with self._lock:
+            for plan_id in plan_ids:
+                entry = self.plans.get(plan_id)
+                if entry is None:
+                    unlisted.append(plan_id)
+                else:
+                    entry["lastDownloaded"] = last_downloaded
+                    self._dirty = True
+        return unlisted
+
+    def remove_plans(self, plan_ids):
+        """
+        Forget plan details that were deleted.
+
+        Args:
+            plan_ids (list): The plan IDs.
+        """
+        with self._lock:
+            for plan_id in plan_ids:
+                if self.plans.pop(plan_id, None) is not None:
+                    self._dirty = True
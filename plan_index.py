@@ -0,0 +1,414 @@
+"""Postcode and distributor index of the synced plans.
+
+Each brand directory holds a 'plans.index.json', built by the sync while it writes the
+brand's plan list, which maps postcodes and distributors to plan IDs and keeps a short
+summary of every plan:
+
+    {
+        "plans": {"AGL123@EME": {"brand": "agl", "displayName": "...", ...}},
+        "postcodes": {"2000": ["AGL123@EME"]},
+        "anyPostcode": {"AGL456@EME": ["0872"]},
+        "distributors": {"ausgrid": ["AGL123@EME"]}
+    }
+
+Plans without 'includedPostcodes' are available at every postcode except their
+'excludedPostcodes', so they are kept apart in 'anyPostcode' with their exclusions.
+
+'PlanIndex' loads the indexes of all brands into memory, after which a lookup is a
+dictionary access per brand and never loads a plan list:
+
+    python plan_index.py lookup --postcode 2000 [--distributor Ausgrid] [--brand agl]
+    python plan_index.py build [--directory brands]
+"""
+
+import argparse
+import json
+import logging
+import os
+from storage import load_json, replace_file
+
+INDEX_NAME = "plans.index.json"
+
+# Plan list fields kept in the summary of each indexed plan
+SUMMARY_FIELDS = (
+    "planId", "brandName", "displayName", "type", "fuelType", "customerType", "effectiveFrom",
+    "effectiveTo", "lastUpdated",
+)
+
+
+def normalise_distributor(distributor):
+    """
+    Args:
+        distributor (str): A distributor name as listed by a plan or given in a query.
+
+    Returns:
+        str: The key of the distributor in the index.
+    """
+    return " ".join(distributor.split()).casefold()
+
+
+def entries_at_postcode(postcodes, any_postcode, excluded, postcode):
+    """
+    Look up a postcode in the maps of a postcode index.
+
+    Args:
+        postcodes (dict): A mapping of postcodes to the entries listed at them.
+        any_postcode (dict): The entries available at every postcode they do not
+            exclude, as an ordered set (the values are unused).
+        excluded (dict): A mapping of postcodes to the entries of 'any_postcode' that
+            exclude them.
+        postcode (str): An Australian postcode.
+
+    Returns:
+        list: The entries listed at the postcode, followed by those of 'any_postcode'
+        that do not exclude it.
+    """
+    entries = list(postcodes.get(postcode, ()))
+    excluded_entries = excluded.get(postcode)
+    if excluded_entries:
+        any_postcode = dict(any_postcode)
+        for entry in excluded_entries:
+            del any_postcode[entry]
+    entries.extend(any_postcode)
+    return entries
+
+
+class PlanIndexBuilder:
+    """
+    Build the index of one brand's plan list, one batch of plans at a time.
+
+    Args:
+        brand (str): The brand directory name recorded in the plan summaries.
+    """
+
+    def __init__(self, brand):
+        self.brand = brand
+        self.plans = {}
+        self.postcodes = {}
+        self.any_postcode = {}
+        self.distributors = {}
+
+    def add(self, plans):
+        """
+        Add plans from the brand's plan list to the index.
+
+        Args:
+            plans (iterable): Plans as returned by the plan list endpoint.
+        """
+        for plan in plans:
+            plan_id = plan["planId"]
+            geography = plan.get("geography") or {}
+            distributors = geography.get("distributors") or []
+            summary = {field: plan[field] for field in SUMMARY_FIELDS if plan.get(field) is not None}
+            summary["brand"] = self.brand
+            summary["distributors"] = distributors
+            self.plans[plan_id] = summary
+
+            excluded = set(geography.get("excludedPostcodes") or [])
+            included = geography.get("includedPostcodes")
+            if included:
+                for postcode in included:
+                    if postcode not in excluded:
+                        self.postcodes.setdefault(postcode, []).append(plan_id)
+            else:
+                self.any_postcode[plan_id] = sorted(excluded)
+            for distributor in distributors:
+                self.distributors.setdefault(normalise_distributor(distributor), []).append(plan_id)
+
+    def save(self, directory):
+        """
+        Atomically replace the index file of a brand directory.
+
+        Args:
+            directory (str): The brand directory.
+        """
+        data = {
+            "plans": self.plans,
+            "postcodes": self.postcodes,
+            "anyPostcode": self.any_postcode,
+            "distributors": self.distributors,
+        }
+        replace_file(os.path.join(directory, INDEX_NAME), json.dumps(data, separators=(",", ":")).encode())
+
+
+def build_brand_index(directory):
+    """
+    Rebuild the index of a brand directory from its saved 'plans.json'.
+
+    Args:
+        directory (str): The brand directory.
+
+    Returns:
+        int: The number of plans indexed, or None if the brand has no 'plans.json'.
+    """
+    plans_file = os.path.join(directory, "plans.json")
+    if not os.path.isfile(plans_file):
+        return None
+    builder = PlanIndexBuilder(os.path.basename(directory))
+    builder.add(load_json(plans_file))
+    builder.save(directory)
+    return len(builder.plans)
+
+
+class BrandIndex:
+    """
+    The loaded index of one brand.
+
+    Besides the postcode and distributor maps saved by the sync, the plans are grouped
+    by their 'fuelType' and 'customerType' on load, and the exclusions of the plans
+    available at any postcode are inverted into a map of postcodes to excluded plan IDs.
+
+    Args:
+        data (dict): The contents of the brand's 'plans.index.json'.
+        stamp (tuple, optional): The modification time and size of the file it was
+            loaded from.
+    """
+
+    __slots__ = ("plans", "postcodes", "any_postcode", "any_postcode_ids", "excluded_ids", "distributors",
+                 "fuel_types", "customer_types", "stamp")
+
+    def __init__(self, data, stamp=None):
+        self.plans = data["plans"]
+        self.postcodes = data["postcodes"]
+        self.any_postcode = {plan_id: frozenset(excluded) for plan_id, excluded in data["anyPostcode"].items()}
+        self.any_postcode_ids = dict.fromkeys(self.any_postcode)  # An ordered set
+        self.excluded_ids = {}
+        for plan_id, excluded in self.any_postcode.items():
+            for postcode in excluded:
+                self.excluded_ids.setdefault(postcode, []).append(plan_id)
+        self.distributors = data["distributors"]
+        self.fuel_types = {}
+        self.customer_types = {}
+        for plan_id, summary in self.plans.items():
+            self.fuel_types.setdefault(summary.get("fuelType"), []).append(plan_id)
+            self.customer_types.setdefault(summary.get("customerType"), []).append(plan_id)
+        self.stamp = stamp
+
+    def plan_ids_at_postcode(self, postcode):
+        return entries_at_postcode(self.postcodes, self.any_postcode_ids, self.excluded_ids, postcode)
+
+    def lookup(self, postcode=None, distributor=None, fuel_type=None, customer_type=None):
+        """
+        Find the brand's plans matching all of the given filters.
+
+        Args:
+            postcode (str, optional): An Australian postcode.
+            distributor (str, optional): A distributor name, matched case-insensitively.
+            fuel_type (str, optional): 'ELECTRICITY', 'GAS' or 'DUAL'.
+            customer_type (str, optional): 'RESIDENTIAL' or 'BUSINESS'.
+
+        Returns:
+            list: The IDs of the matching plans, in list order when no filter is given.
+        """
+        candidates = []
+        if postcode is not None:
+            candidates.append(self.plan_ids_at_postcode(postcode))
+        if distributor is not None:
+            candidates.append(self.distributors.get(normalise_distributor(distributor), ()))
+        if fuel_type is not None:
+            candidates.append(self.fuel_types.get(fuel_type.upper(), ()))
+        if customer_type is not None:
+            candidates.append(self.customer_types.get(customer_type.upper(), ()))
+        if not candidates:
+            return list(self.plans)
+        candidates.sort(key=len)  # Filter the shortest list by the others
+        plan_ids = candidates[0]
+        for other in candidates[1:]:
+            other = set(other)
+            plan_ids = [plan_id for plan_id in plan_ids if plan_id in other]
+        return list(plan_ids)
+
+    def postcodes_of(self, plan_ids):
+        """
+        Args:
+            plan_ids (iterable): IDs of the brand's plans.
+
+        Returns:
+            tuple: The postcodes listed by the plans, and the exclusions of those that
+            are available at any postcode, one set each.
+        """
+        plan_ids = set(plan_ids)
+        listed = {postcode for postcode, ids in self.postcodes.items() if not plan_ids.isdisjoint(ids)}
+        exclusions = [self.any_postcode[plan_id] for plan_id in plan_ids if plan_id in self.any_postcode]
+        return listed, exclusions
+
+
+class PlanIndex:
+    """
+    The indexes of all brands, held in memory for lookups.
+
+    The brands are kept apart so that 'refresh' can reload only those whose index file
+    changed. It replaces the 'brands' mapping as a whole, so lookups running in other
+    threads always see a consistent set of brands.
+
+    Attributes:
+        brands (dict): A mapping of brand directory names to their 'BrandIndex'.
+    """
+
+    def __init__(self):
+        self.brands = {}
+
+    @classmethod
+    def load(cls, directory="brands"):
+        """
+        Load the indexes of all brands under a store.
+
+        Args:
+            directory (str): The root of the store.
+
+        Returns:
+            PlanIndex: The loaded index.
+        """
+        index = cls()
+        index.refresh(directory)
+        return index
+
+    def refresh(self, directory="brands"):
+        """
+        Reload the indexes of brands whose index file changed since they were loaded.
+
+        Args:
+            directory (str): The root of the store.
+
+        Returns:
+            list: The names of the brands that were loaded, reloaded or dropped.
+        """
+        brands = dict(self.brands)
+        changed = []
+        seen = set()
+        for brand in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            index_file = os.path.join(directory, brand, INDEX_NAME)
+            try:
+                stat = os.stat(index_file)
+            except (FileNotFoundError, NotADirectoryError):  # Not a brand, e.g. providers.json
+                continue
+            seen.add(brand)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if brand in brands and brands[brand].stamp == stamp:
+                continue
+            try:
+                brands[brand] = BrandIndex(load_json(index_file), stamp)
+            except (OSError, ValueError, KeyError) as error:  # Keep serving the old index
+                logging.warning(f"Failed to load '{index_file}': {error!r}")
+                continue
+            changed.append(brand)
+        for brand in set(brands) - seen:
+            del brands[brand]
+            changed.append(brand)
+        if changed:
+            self.brands = brands
+        return changed
+
+    def snapshot(self):
+        """
+        Returns:
+            PlanIndex: An index of the brands loaded now, which later refreshes of this
+            index do not change. Queries that read the brands more than once use it to
+            see the same brands throughout.
+        """
+        snapshot = PlanIndex()
+        snapshot.brands = self.brands
+        return snapshot
+
+    @property
+    def plans(self):
+        """
+        dict: A mapping of plan IDs to the summaries of all indexed plans.
+        """
+        return {plan_id: summary for brand_index in self.brands.values()
+                for plan_id, summary in brand_index.plans.items()}
+
+    def plan(self, plan_id):
+        """
+        Args:
+            plan_id (str): The unique identifier for the plan.
+
+        Returns:
+            dict: The summary of the plan, or None if it is not indexed.
+        """
+        for brand_index in self.brands.values():
+            summary = brand_index.plans.get(plan_id)
+            if summary is not None:
+                return summary
+        return None
+
+    def plan_ids_at_postcode(self, postcode):
+        """
+        Args:
+            postcode (str): An Australian postcode.
+
+        Returns:
+            list: The IDs of the plans available at the postcode.
+        """
+        return [plan_id for brand_index in self.brands.values()
+                for plan_id in brand_index.plan_ids_at_postcode(postcode)]
+
+    def plan_ids_for_distributor(self, distributor):
+        """
+        Args:
+            distributor (str): A distributor name, matched case-insensitively.
+
+        Returns:
+            list: The IDs of the plans offered in the distributor's network.
+        """
+        key = normalise_distributor(distributor)
+        return [plan_id for brand_index in self.brands.values()
+                for plan_id in brand_index.distributors.get(key, ())]
+
+    def lookup(self, postcode=None, distributor=None, brand=None, fuel_type=None, customer_type=None):
+        """
+        Find the plans matching all of the given filters.
+
+        Args:
+            postcode (str, optional): An Australian postcode.
+            distributor (str, optional): A distributor name, matched case-insensitively.
+            brand (str, optional): A brand directory name, e.g. 'agl'.
+            fuel_type (str, optional): 'ELECTRICITY', 'GAS' or 'DUAL'.
+            customer_type (str, optional): 'RESIDENTIAL' or 'BUSINESS'.
+
+        Returns:
+            list: The summaries of the matching plans, or of all plans if no filter is
+            given.
+        """
+        brands = self.brands
+        if brand is not None:
+            key = brand.replace(' ', '_').lower()
+            brands = {key: brands[key]} if key in brands else {}
+        if postcode is not None:
+            postcode = str(postcode)
+        return [brand_index.plans[plan_id] for brand_index in brands.values()
+                for plan_id in brand_index.lookup(postcode, distributor, fuel_type, customer_type)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the plan index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Rebuild the index of every brand from its plans.json.")
+    build_parser.add_argument("--directory", default="brands", help="The root of the store (default: brands).")
+    lookup_parser = subparsers.add_parser("lookup", help="List the plans at a postcode or for a distributor.")
+    lookup_parser.add_argument("--postcode", help="Postcode to filter plans by.")
+    lookup_parser.add_argument("--distributor", help="Distributor to filter plans by.")
+    lookup_parser.add_argument("--brand", help="Brand to filter plans by.")
+    lookup_parser.add_argument("--fuel-type", help="Fuel type to filter plans by.")
+    lookup_parser.add_argument("--customer-type", help="Customer type to filter plans by.")
+    lookup_parser.add_argument("--directory", default="brands", help="The root of the store (default: brands).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == "build":
+        for brand in sorted(os.listdir(args.directory)):
+            brand_directory = os.path.join(args.directory, brand)
+            if os.path.isdir(brand_directory):
+                plan_count = build_brand_index(brand_directory)
+                if plan_count is not None:
+                    logging.info(f"Indexed {plan_count} plans in '{brand_directory}'")
+    else:
+        index = PlanIndex.load(args.directory)
+        print(json.dumps(
+            index.lookup(args.postcode, args.distributor, args.brand, args.fuel_type, args.customer_type),
+            indent=4,
+        ))
+
+
+if __name__ == "__main__":
+    main()
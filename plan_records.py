@@ -0,0 +1,507 @@
+"""Compact in-memory records of the plan lists of all brands.
+
+Consumers of the synced plan lists used to read every 'brands/{brand}/plans.json' in
+turn into one list of full plan dicts. 'PlanRecords' keeps only the fields that queries
+use instead, one slotted 'PlanRecord' per plan:
+
+- The plan list fields in 'RECORD_FIELDS', the brand directory and the distributors.
+- The included and excluded postcodes of the plan's 'geography' as sorted tuples, so
+  a postcode is checked with a binary search.
+
+Strings are interned and equal postcode tuples are shared between plans, so the records
+take a fraction of the memory of the parsed JSON. The plan lists of several brands are
+parsed in worker processes ('PLAN_LOAD_WORKERS') that send back only the record values.
+
+Each brand's records are kept with the modification time and size of the 'plans.json'
+they were loaded from, and 'refresh' reloads only the brands whose file changed. The
+record values of each brand are also saved next to its plan list, in 'plans.records.json'
+with the same modification time and size, so a new process such as the next CLI run
+reads them instead of parsing the plan list again:
+
+    {
+        "stamp": [1718928000000000000, 5242880],
+        "postcodes": [["2000", "2007", ...], ...],
+        "plans": [["AGL123@EME", "AGL", ..., ["Ausgrid"], 0, 1], ...]
+    }
+
+Each plan lists its 'RECORD_FIELDS' and distributors, then the positions in 'postcodes'
+of its included (null if it has none) and excluded postcodes.
+
+Plans sharing the same postcodes are grouped on load, and each brand maps its postcodes
+to the groups offered there, so 'at_postcode' is a dictionary access per brand, like
+the lookups of 'plan_index.py'. 'load_plan_records' also keeps the records of each store
+for the life of the process, so repeated loads only check the files. With the 'sqlite'
+store backend the plan lists are not kept as files, and 'python plan_store.py export'
+writes them out first:
+
+    records = load_plan_records()
+    [record.plan_id for record in records.at_postcode("2000")]
+
+    python plan_records.py [--directory brands] [--postcode 2000] [--workers 8]
+"""
+
+import argparse
+import bisect
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+import time
+from config import PLAN_LOAD_WORKERS
+from plan_index import entries_at_postcode
+from storage import load_json, replace_file
+
+PLANS_NAME = "plans.json"
+RECORDS_NAME = "plans.records.json"
+
+# Plan list fields kept in every record, in the order of the 'PlanRecord' slots
+RECORD_FIELDS = (
+    "planId", "brandName", "displayName", "type", "fuelType", "customerType", "effectiveFrom",
+    "effectiveTo", "lastUpdated",
+)
+
+
+class PlanRecord:
+    """
+    The fields of a listed plan that queries use.
+
+    Args:
+        values (tuple): The values of the slots, in order, as made by 'record_values'.
+    """
+
+    __slots__ = ("plan_id", "brand_name", "display_name", "type", "fuel_type", "customer_type",
+                 "effective_from", "effective_to", "last_updated", "brand", "distributors",
+                 "included_postcodes", "excluded_postcodes")
+
+    def __init__(self, values):
+        for slot, value in zip(self.__slots__, values):
+            setattr(self, slot, value)
+
+    def __repr__(self):
+        return f"PlanRecord({self.plan_id!r}, brand={self.brand!r})"
+
+    def available_at(self, postcode):
+        """
+        Args:
+            postcode (str): An Australian postcode.
+
+        Returns:
+            bool: True if the plan is offered at the postcode. Plans without included
+            postcodes are offered at every postcode they do not exclude.
+        """
+        if contains(self.excluded_postcodes, postcode):
+            return False
+        return self.included_postcodes is None or contains(self.included_postcodes, postcode)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The record with the plan list's field names, like the plan summaries
+            of 'plan_index.py', plus its 'includedPostcodes' and 'excludedPostcodes'.
+        """
+        summary = {field: getattr(self, slot) for field, slot in zip(RECORD_FIELDS, self.__slots__)
+                   if getattr(self, slot) is not None}
+        summary["brand"] = self.brand
+        summary["distributors"] = list(self.distributors)
+        if self.included_postcodes is not None:
+            summary["includedPostcodes"] = list(self.included_postcodes)
+        summary["excludedPostcodes"] = list(self.excluded_postcodes)
+        return summary
+
+
+def contains(postcodes, postcode):
+    """
+    Args:
+        postcodes (tuple): Sorted postcodes.
+        postcode (str): The postcode to find.
+
+    Returns:
+        bool: True if the postcode is in the tuple.
+    """
+    position = bisect.bisect_left(postcodes, postcode)
+    return position < len(postcodes) and postcodes[position] == postcode
+
+
+def record_values(plan, brand, postcodes=None):
+    """
+    Args:
+        plan (dict): A plan as listed in 'plans.json'.
+        brand (str): The brand directory name.
+        postcodes (dict, optional): The postcode tuples already made for other plans,
+            keyed by the listed postcodes, which is updated. Plans of the same
+            distributor usually list the same postcodes, which are then only sorted once.
+
+    Returns:
+        tuple: The values of the 'PlanRecord' slots of the plan.
+    """
+    if postcodes is None:
+        postcodes = {}
+    geography = plan.get("geography") or {}
+    key = (tuple(geography.get("includedPostcodes") or ()), tuple(geography.get("excludedPostcodes") or ()))
+    postcode_values = postcodes.get(key)
+    if postcode_values is None:
+        included, excluded = key
+        excluded = set(excluded)
+        included = tuple(sorted(set(included) - excluded)) if included else None
+        postcode_values = postcodes[key] = (included, tuple(sorted(excluded)))
+    return (*(plan.get(field) for field in RECORD_FIELDS), brand,
+            tuple(geography.get("distributors") or ()), *postcode_values)
+
+
+def load_brand_values(plans_file, brand, stamp=None):
+    """
+    Read a brand's plan list and reduce it to record values.
+
+    Runs in the worker processes, so only the values are sent back, not the parsed JSON.
+
+    Args:
+        plans_file (str): The path of the brand's 'plans.json'.
+        brand (str): The brand directory name.
+        stamp (tuple, optional): The modification time and size of the plan list. If
+            given, the values are saved with it in the brand's 'plans.records.json'.
+
+    Returns:
+        list: The 'record_values' of every listed plan.
+    """
+    postcodes = {}
+    values = [record_values(plan, brand, postcodes) for plan in load_json(plans_file)]
+    if stamp is not None:
+        try:
+            save_records_file(plans_file, stamp, values)
+        except OSError as error:  # The records still load, only not from the sidecar
+            logging.warning(f"Failed to save the plan records of '{plans_file}': {error!r}")
+    return values
+
+
+def save_records_file(plans_file, stamp, values):
+    """
+    Atomically replace the 'plans.records.json' next to a brand's plan list.
+
+    Args:
+        plans_file (str): The path of the brand's 'plans.json'.
+        stamp (tuple): The modification time and size of the plan list.
+        values (list): The 'record_values' of its plans.
+    """
+    positions = {}  # By identity: 'record_values' shares the tuples of a brand
+    postcodes = []
+
+    def position(strings):
+        if strings is None:
+            return None
+        if id(strings) not in positions:
+            positions[id(strings)] = len(postcodes)
+            postcodes.append(strings)
+        return positions[id(strings)]
+
+    fields = len(RECORD_FIELDS)
+    plans = [[*plan_values[:fields], plan_values[fields + 1], position(plan_values[fields + 2]),
+              position(plan_values[fields + 3])] for plan_values in values]
+    data = {"stamp": list(stamp), "postcodes": postcodes, "plans": plans}
+    replace_file(os.path.join(os.path.dirname(plans_file), RECORDS_NAME),
+                 json.dumps(data, separators=(",", ":")).encode())
+
+
+def load_records_file(plans_file, brand, stamp):
+    """
+    Read the record values saved next to a brand's plan list.
+
+    Args:
+        plans_file (str): The path of the brand's 'plans.json'.
+        brand (str): The brand directory name.
+        stamp (tuple): The modification time and size of the plan list.
+
+    Returns:
+        list: The 'record_values' of every listed plan, or None if none were saved for
+        this version of the plan list.
+    """
+    records_file = os.path.join(os.path.dirname(plans_file), RECORDS_NAME)
+    try:
+        with open(records_file, "rb") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:  # Parse the plan list instead
+        logging.warning(f"Ignoring unreadable plan records '{records_file}': {error!r}")
+        return None
+    if data.get("stamp") != list(stamp):
+        return None
+    fields = len(RECORD_FIELDS)
+    try:
+        postcodes = [tuple(strings) for strings in data["postcodes"]]
+        return [(*plan[:fields], brand, tuple(plan[fields]),
+                 None if plan[fields + 1] is None else postcodes[plan[fields + 1]], postcodes[plan[fields + 2]])
+                for plan in data["plans"]]
+    except (KeyError, IndexError, TypeError) as error:
+        logging.warning(f"Ignoring unreadable plan records '{records_file}': {error!r}")
+        return None
+
+
+def make_records(values, shared):
+    """
+    Build records from their values, sharing equal strings and postcode tuples.
+
+    Args:
+        values (list): 'record_values' tuples.
+        shared (dict): The postcode tuples already made, which is updated.
+
+    Returns:
+        tuple: The 'PlanRecord' of every plan.
+    """
+    intern = sys.intern
+    made = {}  # By identity: 'record_values' already shares the tuples of a brand
+
+    def share(strings):
+        tuple_id = id(strings)
+        if tuple_id not in made:
+            made[tuple_id] = shared.get(strings)
+            if made[tuple_id] is None:
+                made[tuple_id] = shared[strings] = tuple(intern(string) for string in strings)
+        return made[tuple_id]
+
+    records = []
+    for plan_values in values:
+        *fields, distributors, included, excluded = plan_values
+        fields = [intern(value) if type(value) is str else value for value in fields]
+        records.append(PlanRecord((*fields, share(distributors), included and share(included), share(excluded))))
+    return tuple(records)
+
+
+class BrandRecords:
+    """
+    The loaded records of one brand.
+
+    The plans are grouped by their postcodes, which plans of the same distributor share,
+    and the postcodes are mapped to the groups offered there like 'plan_index.BrandIndex'
+    maps them to plan IDs.
+
+    Args:
+        records (tuple): The 'PlanRecord' of every plan, in list order.
+        stamp (tuple): The modification time and size of the 'plans.json' they were
+            loaded from.
+    """
+
+    __slots__ = ("records", "stamp", "postcodes", "any_postcode", "excluded")
+
+    def __init__(self, records, stamp):
+        self.records = records
+        self.stamp = stamp
+        groups = {}  # By identity: 'make_records' shares equal postcode tuples
+        for record in records:
+            key = (id(record.included_postcodes), id(record.excluded_postcodes))
+            groups.setdefault(key, []).append(record)
+        self.postcodes = {}
+        self.any_postcode = {}  # An ordered set
+        self.excluded = {}
+        for group in groups.values():
+            group = tuple(group)
+            included = group[0].included_postcodes
+            if included is None:
+                self.any_postcode[group] = None
+                for postcode in group[0].excluded_postcodes:
+                    self.excluded.setdefault(postcode, []).append(group)
+            else:
+                for postcode in included:
+                    self.postcodes.setdefault(postcode, []).append(group)
+
+    def at_postcode(self, postcode):
+        """
+        Args:
+            postcode (str): An Australian postcode.
+
+        Returns:
+            list: The records of the brand's plans offered at the postcode.
+        """
+        return [record for group in entries_at_postcode(self.postcodes, self.any_postcode, self.excluded, postcode)
+                for record in group]
+
+
+class PlanRecords:
+    """
+    The plan records of all brands, held in memory for queries.
+
+    Like 'plan_index.PlanIndex', 'refresh' replaces the 'brands' mapping as a whole, so
+    queries running in other threads always see a consistent set of brands.
+
+    Attributes:
+        brands (dict): A mapping of brand directory names to their 'BrandRecords'.
+    """
+
+    def __init__(self):
+        self.brands = {}
+
+    @classmethod
+    def load(cls, directory="brands", workers=PLAN_LOAD_WORKERS):
+        """
+        Load the plan records of all brands under a store.
+
+        Args:
+            directory (str): The root of the store.
+            workers (int, optional): The maximum number of worker processes, one per
+                CPU by default.
+
+        Returns:
+            PlanRecords: The loaded records.
+        """
+        plan_records = cls()
+        plan_records.refresh(directory, workers)
+        return plan_records
+
+    def refresh(self, directory="brands", workers=PLAN_LOAD_WORKERS):
+        """
+        Reload the records of brands whose 'plans.json' changed since they were loaded.
+
+        The record values saved with an unchanged plan list are read directly. The
+        other brands are parsed, in worker processes when more than one has to be
+        parsed and more than one worker is allowed, and their values saved.
+
+        Args:
+            directory (str): The root of the store.
+            workers (int, optional): The maximum number of worker processes, one per
+                CPU by default.
+
+        Returns:
+            list: The names of the brands that were loaded, reloaded or dropped.
+        """
+        brands = dict(self.brands)
+        outdated = {}
+        seen = set()
+        for brand in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            plans_file = os.path.join(directory, brand, PLANS_NAME)
+            try:
+                stat = os.stat(plans_file)
+            except (FileNotFoundError, NotADirectoryError):  # Not a brand, e.g. providers.json
+                continue
+            seen.add(brand)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if brand not in brands or brands[brand].stamp != stamp:
+                outdated[brand] = (plans_file, stamp)
+
+        loaded = {}
+        for brand, (plans_file, stamp) in outdated.items():
+            values = load_records_file(plans_file, brand, stamp)
+            if values is not None:
+                loaded[brand] = values
+        unsaved = {brand: location for brand, location in outdated.items() if brand not in loaded}
+        for brand, location, values in load_values(unsaved, workers):
+            loaded[brand] = values
+
+        changed = []
+        shared = {}
+        for brand, (plans_file, stamp) in outdated.items():
+            values = loaded[brand]
+            if isinstance(values, Exception):  # Keep serving the old records
+                logging.warning(f"Failed to load '{plans_file}': {values!r}")
+                continue
+            brands[brand] = BrandRecords(make_records(values, shared), stamp)
+            changed.append(brand)
+        for brand in set(brands) - seen:
+            del brands[brand]
+            changed.append(brand)
+        if changed:
+            self.brands = brands
+        return changed
+
+    def __iter__(self):
+        for brand_records in self.brands.values():
+            yield from brand_records.records
+
+    def __len__(self):
+        return sum(len(brand_records.records) for brand_records in self.brands.values())
+
+    def at_postcode(self, postcode):
+        """
+        Args:
+            postcode (str): An Australian postcode.
+
+        Returns:
+            list: The records of the plans offered at the postcode.
+        """
+        postcode = str(postcode)
+        return [record for brand_records in self.brands.values() for record in brand_records.at_postcode(postcode)]
+
+
+def load_values(outdated, workers):
+    """
+    Read the plan lists of brands, in worker processes if there are several, and save
+    their record values.
+
+    Args:
+        outdated (dict): A mapping of brand directory names to the path and stamp of
+            their 'plans.json'.
+        workers (int, optional): The maximum number of worker processes, one per CPU if
+            None.
+
+    Yields:
+        tuple: The brand, its path and stamp, and its 'record_values' or the exception
+        raised while reading them, in the order of 'outdated'.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(outdated))
+    if workers <= 1:
+        for brand, location in outdated.items():
+            try:
+                values = load_brand_values(location[0], brand, location[1])
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                values = error
+            yield brand, location, values
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {brand: executor.submit(load_brand_values, location[0], brand, location[1])
+                   for brand, location in outdated.items()}
+        for brand, future in futures.items():
+            try:
+                values = future.result()
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                values = error
+            yield brand, outdated[brand], values
+
+
+# Records loaded by 'load_plan_records' in this process, per store directory
+_loaded = {}
+
+
+def load_plan_records(directory="brands", workers=PLAN_LOAD_WORKERS):
+    """
+    Get the plan records of all brands under a store, reusing those already loaded.
+
+    The first call for a store in a process loads it, from the 'plans.records.json' of
+    the brands whose plan list is unchanged since it was last parsed. Later calls only
+    reload the brands whose 'plans.json' changed since, which for an unchanged store is
+    one 'stat' per brand.
+
+    Args:
+        directory (str): The root of the store.
+        workers (int, optional): The maximum number of worker processes, one per CPU by
+            default.
+
+    Returns:
+        PlanRecords: The records of the store, shared by every caller.
+    """
+    key = os.path.abspath(directory)
+    plan_records = _loaded.get(key)
+    if plan_records is None:
+        plan_records = _loaded[key] = PlanRecords()
+    plan_records.refresh(directory, workers)
+    return plan_records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the plan records of every brand.")
+    parser.add_argument("--directory", default="brands", help="The root of the store (default: brands).")
+    parser.add_argument("--postcode", help="List the plans offered at this postcode.")
+    parser.add_argument("--workers", type=int, default=PLAN_LOAD_WORKERS,
+                        help="Maximum worker processes (default: one per CPU).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    started = time.perf_counter()
+    plan_records = load_plan_records(args.directory, args.workers)
+    logging.info(f"Loaded {len(plan_records)} plans of {len(plan_records.brands)} brands "
+                 f"in {time.perf_counter() - started:.2f}s")
+    if args.postcode:
+        for record in plan_records.at_postcode(args.postcode):
+            print(f"{record.brand}\t{record.plan_id}\t{record.fuel_type}\t{record.customer_type}\t{record.display_name}")
+
+
+if __name__ == "__main__":
+    main()
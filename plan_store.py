@@ -0,0 +1,639 @@
+"""SQLite store for plan lists, plan details and their fetch metadata.
+
+An alternative to the one-JSON-file-per-plan 'brands/' tree, enabled by setting
+'STORE_BACKEND' to 'sqlite' in config.py. Everything lives in the single database file
+'STORE_PATH':
+
+- 'plan_lists': one row per brand with the time its plan list was saved and the list
+  validators ('totalPages' and the 'etag' and 'lastModified' of each page).
+- 'plans': the plans of each brand's list, in list order.
+- 'plan_details': the details of each plan, with their 'lastDownloaded' time and
+  validators in their own columns, so freshness checks are index lookups that never
+  parse a plan.
+
+A plan list is staged page by page and swapped in by a single transaction, and plan
+details are upserted in bulk, one transaction per batch. Brands are keyed by their
+directory name in the JSON tree, which the exporter reproduces:
+
+    python plan_store.py export [--directory brands] [--format pretty]
+    python plan_store.py import [--directory brands]
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import STORE_PATH
+from datetime import datetime, timezone
+from manifest import PlanManifest, format_last_downloaded
+from storage import AtomicJsonListWriter, encode_json, is_store_document, load_json, replace_file
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plan_lists (
+    brand TEXT PRIMARY KEY,
+    saved_at REAL NOT NULL,
+    validators TEXT
+);
+CREATE TABLE IF NOT EXISTS plans (
+    brand TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    plan_id TEXT NOT NULL,
+    last_updated TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (brand, position)
+);
+CREATE INDEX IF NOT EXISTS plans_by_id ON plans (brand, plan_id);
+CREATE TABLE IF NOT EXISTS staged_plans (
+    brand TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    plan_id TEXT NOT NULL,
+    last_updated TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (brand, position)
+);
+CREATE TABLE IF NOT EXISTS plan_details (
+    brand TEXT NOT NULL,
+    plan_id TEXT NOT NULL,
+    last_downloaded TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (brand, plan_id)
+);
+CREATE TABLE IF NOT EXISTS plan_tariffs (
+    brand TEXT NOT NULL,
+    plan_id TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (brand, plan_id)
+);
+"""
+
+# Largest number of plan IDs bound to a single 'IN (...)' query
+QUERY_CHUNK = 500
+
+
+def brand_key(brand):
+    """
+    The key of a brand in the store, which is also its directory name in the JSON tree.
+
+    Args:
+        brand (str): The name of the brand.
+
+    Returns:
+        str: The sanitised brand name.
+    """
+    return brand.replace(' ', '_').lower()
+
+
+def encode_row_json(obj):
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def chunked(items, size=QUERY_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class PlanStore:
+    """
+    A SQLite database of plan lists and plan details.
+
+    The store is safe to use from several threads: they share one connection and take
+    turns through a lock, which SQLite requires of writers anyway.
+
+    Args:
+        path (str): The path of the database file, created if it does not exist.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    # Plan lists
+
+    def brands(self):
+        """
+        Returns:
+            list: The keys of all brands with a saved plan list or plan details.
+        """
+        rows = self._query(
+            "SELECT brand FROM plan_lists UNION SELECT DISTINCT brand FROM plan_details ORDER BY brand"
+        )
+        return [brand for brand, in rows]
+
+    def plan_list_saved_at(self, brand):
+        """
+        Args:
+            brand (str): The name of the brand.
+
+        Returns:
+            float: The time the brand's plan list was last saved or confirmed unchanged,
+            as a Unix timestamp, or None if no plan list has been saved.
+        """
+        rows = self._query("SELECT saved_at FROM plan_lists WHERE brand = ?", (brand_key(brand),))
+        return rows[0][0] if rows else None
+
+    def touch_plan_list(self, brand, saved_at=None):
+        """
+        Mark a brand's saved plan list as fresh.
+
+        Args:
+            brand (str): The name of the brand.
+            saved_at (float, optional): The time to record, now by default.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE plan_lists SET saved_at = ? WHERE brand = ?",
+                (saved_at or time.time(), brand_key(brand)),
+            )
+
+    def plan_versions(self, brand):
+        """
+        Args:
+            brand (str): The name of the brand.
+
+        Returns:
+            dict: A mapping of the plan IDs in the brand's plan list to their
+            'lastUpdated' values, empty if no plan list has been saved.
+        """
+        rows = self._query(
+            "SELECT plan_id, last_updated FROM plans WHERE brand = ? ORDER BY position",
+            (brand_key(brand),),
+        )
+        return dict(rows)
+
+    def iter_plans(self, brand):
+        """
+        Yield the plans of a brand's plan list in list order.
+
+        Args:
+            brand (str): The name of the brand.
+        """
+        for data, in self._query(
+            "SELECT data FROM plans WHERE brand = ? ORDER BY position", (brand_key(brand),)
+        ):
+            yield json.loads(data)
+
+    def load_list_validators(self, brand):
+        """
+        Args:
+            brand (str): The name of the brand.
+
+        Returns:
+            dict: The saved validators of the brand's plan list, or an empty dict.
+        """
+        rows = self._query("SELECT validators FROM plan_lists WHERE brand = ?", (brand_key(brand),))
+        return json.loads(rows[0][0]) if rows and rows[0][0] else {}
+
+    def save_list_validators(self, brand, validators):
+        """
+        Args:
+            brand (str): The name of the brand.
+            validators (dict): The validators of the brand's saved plan list.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE plan_lists SET validators = ? WHERE brand = ?",
+                (encode_row_json(validators), brand_key(brand)),
+            )
+
+    def plan_list_writer(self, brand):
+        """
+        Args:
+            brand (str): The name of the brand.
+
+        Returns:
+            PlanListWriter: A writer that replaces the brand's plan list.
+        """
+        return PlanListWriter(self, brand)
+
+    def delete_plan_list(self, brand):
+        """
+        Delete a brand's plan list and its validators.
+
+        Args:
+            brand (str): The name of the brand.
+        """
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM plans WHERE brand = ?", (brand_key(brand),))
+            connection.execute("DELETE FROM plan_lists WHERE brand = ?", (brand_key(brand),))
+
+    # Plan details
+
+    def load_plan_details(self, brand, plan_id):
+        """
+        Args:
+            brand (str): The name of the brand.
+            plan_id (str): The unique identifier for the plan.
+
+        Returns:
+            dict: The saved plan details with their 'meta', or None if they have not
+            been saved.
+        """
+        rows = self._query(
+            "SELECT data, last_downloaded, etag, last_modified FROM plan_details "
+            "WHERE brand = ? AND plan_id = ?",
+            (brand_key(brand), plan_id),
+        )
+        if not rows:
+            return None
+        data, last_downloaded, etag, last_modified = rows[0]
+        plan_details = json.loads(data)
+        plan_details['meta'] = self._meta(last_downloaded, etag, last_modified)
+        return plan_details
+
+    @staticmethod
+    def _meta(last_downloaded, etag, last_modified):
+        meta = {'lastDownloaded': last_downloaded, 'etag': etag, 'lastModified': last_modified}
+        return {key: value for key, value in meta.items() if value is not None}
+
+    def load_plan_meta(self, brand, plan_ids):
+        """
+        Load the 'meta' of saved plan details without loading the details themselves.
+
+        Args:
+            brand (str): The name of the brand.
+            plan_ids (list): The plan IDs to look up.
+
+        Returns:
+            dict: A mapping of the plan IDs with saved details to their 'meta'.
+        """
+        plan_meta = {}
+        for chunk in chunked(plan_ids):
+            rows = self._query(
+                "SELECT plan_id, last_downloaded, etag, last_modified FROM plan_details "
+                f"WHERE brand = ? AND plan_id IN ({', '.join('?' * len(chunk))})",
+                (brand_key(brand), *chunk),
+            )
+            plan_meta.update((plan_id, self._meta(*meta)) for plan_id, *meta in rows)
+        return plan_meta
+
+    def saved_plan_ids(self, brand):
+        """
+        Args:
+            brand (str): The name of the brand.
+
+        Returns:
+            set: The IDs of the plans whose details have been saved.
+        """
+        rows = self._query("SELECT plan_id FROM plan_details WHERE brand = ?", (brand_key(brand),))
+        return {plan_id for plan_id, in rows}
+
+    def save_plan_details(self, brand, plan_details_list, tariffs=None):
+        """
+        Insert or replace the details of several plans in one transaction.
+
+        Args:
+            brand (str): The name of the brand.
+            plan_details_list (list): Pairs of plan IDs and plan details. The 'meta' of
+                the details is stored in its own columns.
+            tariffs (dict, optional): A mapping of the plan IDs to their encoded compiled
+                tariffs, or None for plans without one. Cached tariffs of the saved plans
+                are replaced by these, or deleted if a plan has none.
+        """
+        rows = []
+        for plan_id, plan_details in plan_details_list:
+            meta = plan_details.get('meta') or {}
+            data = encode_row_json({key: value for key, value in plan_details.items() if key != 'meta'})
+            rows.append((brand_key(brand), plan_id, meta.get('lastDownloaded'),
+                         meta.get('etag'), meta.get('lastModified'), data))
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO plan_details "
+                "(brand, plan_id, last_downloaded, etag, last_modified, data) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._replace_tariffs(connection, brand, tariffs or {}, [plan_id for plan_id, _ in plan_details_list])
+
+    @staticmethod
+    def _replace_tariffs(connection, brand, tariffs, plan_ids):
+        connection.executemany(
+            "INSERT OR REPLACE INTO plan_tariffs (brand, plan_id, data) VALUES (?, ?, ?)",
+            [(brand_key(brand), plan_id, data) for plan_id, data in tariffs.items() if data is not None],
+        )
+        connection.executemany(
+            "DELETE FROM plan_tariffs WHERE brand = ? AND plan_id = ?",
+            [(brand_key(brand), plan_id) for plan_id in plan_ids if tariffs.get(plan_id) is None],
+        )
+
+    def save_plan_tariffs(self, brand, tariffs):
+        """
+        Replace the cached compiled tariffs of plans in one transaction.
+
+        Args:
+            brand (str): The name of the brand.
+            tariffs (dict): A mapping of plan IDs to their encoded compiled tariffs, or
+                None for plans without one.
+        """
+        with self._transaction() as connection:
+            self._replace_tariffs(connection, brand, tariffs, list(tariffs))
+
+    def load_plan_tariffs(self, brand, plan_ids):
+        """
+        Args:
+            brand (str): The name of the brand.
+            plan_ids (list): The plan IDs to look up.
+
+        Returns:
+            dict: A mapping of the plan IDs with a cached tariff to the encoded tariff.
+        """
+        tariffs = {}
+        for chunk in chunked(plan_ids):
+            tariffs.update(self._query(
+                f"SELECT plan_id, data FROM plan_tariffs WHERE brand = ? AND plan_id IN ({', '.join('?' * len(chunk))})",
+                (brand_key(brand), *chunk),
+            ))
+        return tariffs
+
+    def touch_plan_details(self, brand, plan_ids, last_downloaded):
+        """
+        Update the 'lastDownloaded' time of unmodified plan details in one transaction.
+
+        Args:
+            brand (str): The name of the brand.
+            plan_ids (list): The plan IDs whose details were not modified.
+            last_downloaded (str): The new 'lastDownloaded' time.
+        """
+        with self._transaction() as connection:
+            connection.executemany(
+                "UPDATE plan_details SET last_downloaded = ? WHERE brand = ? AND plan_id = ?",
+                [(last_downloaded, brand_key(brand), plan_id) for plan_id in plan_ids],
+            )
+
+    def delete_plan_details(self, brand, plan_ids):
+        """
+        Args:
+            brand (str): The name of the brand.
+            plan_ids (list): The plan IDs whose details should be deleted.
+
+        Returns:
+            int: The number of plan details deleted.
+        """
+        deleted = 0
+        with self._transaction() as connection:
+            for chunk in chunked(plan_ids):
+                placeholders = ', '.join('?' * len(chunk))
+                deleted += connection.execute(
+                    f"DELETE FROM plan_details WHERE brand = ? AND plan_id IN ({placeholders})",
+                    (brand_key(brand), *chunk),
+                ).rowcount
+                connection.execute(
+                    f"DELETE FROM plan_tariffs WHERE brand = ? AND plan_id IN ({placeholders})",
+                    (brand_key(brand), *chunk),
+                )
+        return deleted
+
+    def iter_plan_details(self, brand):
+        """
+        Yield the plan IDs and saved details of all plans of a brand.
+
+        Args:
+            brand (str): The name of the brand.
+        """
+        rows = self._query(
+            "SELECT plan_id, data, last_downloaded, etag, last_modified FROM plan_details "
+            "WHERE brand = ? ORDER BY plan_id",
+            (brand_key(brand),),
+        )
+        for plan_id, data, *meta in rows:
+            plan_details = json.loads(data)
+            plan_details['meta'] = self._meta(*meta)
+            yield plan_id, plan_details
+
+
+class PlanListWriter:
+    """
+    Replace a brand's plan list in the store one batch of plans at a time.
+
+    Has the same interface as 'storage.AtomicJsonListWriter'. Plans are staged as they
+    arrive, each batch in a short transaction so that other brands can write in between,
+    and 'commit' swaps the staged list in with a single transaction. A list that is not
+    committed is discarded and the saved list is left untouched.
+
+    Args:
+        store (PlanStore): The store to write to.
+        brand (str): The name of the brand.
+
+    Attributes:
+        count (int): The number of plans written so far.
+    """
+
+    def __init__(self, store, brand):
+        self.store = store
+        self.brand = brand_key(brand)
+        self.count = 0
+        self._open = False
+
+    def __enter__(self):
+        with self.store._transaction() as connection:
+            connection.execute("DELETE FROM staged_plans WHERE brand = ?", (self.brand,))
+        self._open = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._open:  # Not committed, so throw the staged plans away
+            with self.store._transaction() as connection:
+                connection.execute("DELETE FROM staged_plans WHERE brand = ?", (self.brand,))
+            self._open = False
+
+    def write(self, items):
+        """
+        Append plans to the list.
+
+        Args:
+            items (iterable): The plans to append.
+        """
+        rows = []
+        for plan in items:
+            rows.append((self.brand, self.count, plan["planId"], plan.get("lastUpdated"),
+                         encode_row_json(plan)))
+            self.count += 1
+        with self.store._transaction() as connection:
+            connection.executemany(
+                "INSERT INTO staged_plans (brand, position, plan_id, last_updated, data) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def commit(self, saved_at=None):
+        """
+        Replace the brand's saved plan list with the staged one.
+
+        Args:
+            saved_at (float, optional): The time to record as the list's save time, now
+                by default.
+        """
+        with self.store._transaction() as connection:
+            connection.execute("DELETE FROM plans WHERE brand = ?", (self.brand,))
+            connection.execute(
+                "INSERT INTO plans SELECT * FROM staged_plans WHERE brand = ?", (self.brand,)
+            )
+            connection.execute("DELETE FROM staged_plans WHERE brand = ?", (self.brand,))
+            connection.execute(
+                "INSERT INTO plan_lists (brand, saved_at) VALUES (?, ?) "
+                "ON CONFLICT (brand) DO UPDATE SET saved_at = excluded.saved_at",
+                (self.brand, saved_at or time.time()),
+            )
+        self._open = False
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Return the store at 'STORE_PATH', opening it on first use.
+
+    Returns:
+        PlanStore: The shared store.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PlanStore(STORE_PATH)
+        return _store
+
+
+def export_json_tree(store, directory="brands", storage_format=None):
+    """
+    Write the contents of the store as the JSON tree the 'json' backend uses.
+
+    Each brand gets a 'plans.json' whose modification time is the list's save time, a
+    'plans.meta.json' with the list validators, a '{planId}.json' per plan detail and a
+    'manifest.json' indexing them.
+
+    Args:
+        store (PlanStore): The store to export.
+        directory (str): The root of the JSON tree.
+        storage_format (str, optional): The format of the exported documents,
+            'STORAGE_FORMAT' by default.
+
+    Returns:
+        tuple: The number of brands and of plan details exported.
+    """
+    brand_count = detail_count = 0
+    for brand in store.brands():
+        brand_directory = os.path.join(directory, brand)
+        os.makedirs(brand_directory, exist_ok=True)
+        manifest = PlanManifest(brand_directory)
+        saved_at = store.plan_list_saved_at(brand)
+        if saved_at is not None:
+            plans_file = os.path.join(brand_directory, "plans.json")
+            with AtomicJsonListWriter(plans_file, storage_format) as writer:
+                writer.write(store.iter_plans(brand))
+                writer.commit()
+            os.utime(plans_file, (saved_at, saved_at))
+            manifest.touch_plan_list(format_last_downloaded(datetime.fromtimestamp(saved_at, timezone.utc)))
+            validators = store.load_list_validators(brand)
+            if validators:
+                with open(os.path.join(brand_directory, "plans.meta.json"), "w") as file:
+                    json.dump(validators, file, indent=4)
+        for plan_id, plan_details in store.iter_plan_details(brand):
+            data = encode_json(plan_details, storage_format)
+            replace_file(os.path.join(brand_directory, f"{plan_id}.json"), data)
+            manifest.record_plan(plan_id, plan_details['meta'], data)
+            detail_count += 1
+        manifest.save()
+        brand_count += 1
+        logging.info(f"Exported '{brand_directory}'")
+    return brand_count, detail_count
+
+
+def import_json_tree(store, directory="brands"):
+    """
+    Load a JSON tree written by the 'json' backend into the store.
+
+    Args:
+        store (PlanStore): The store to load into.
+        directory (str): The root of the JSON tree.
+
+    Returns:
+        tuple: The number of brands and of plan details imported.
+    """
+    brand_count = detail_count = 0
+    for brand in sorted(os.listdir(directory)):
+        brand_directory = os.path.join(directory, brand)
+        if not os.path.isdir(brand_directory):
+            continue
+        plans_file = os.path.join(brand_directory, "plans.json")
+        if os.path.isfile(plans_file):
+            with store.plan_list_writer(brand) as writer:
+                writer.write(load_json(plans_file))
+                writer.commit(saved_at=os.path.getmtime(plans_file))
+            meta_file = os.path.join(brand_directory, "plans.meta.json")
+            if os.path.isfile(meta_file):
+                with open(meta_file) as file:
+                    store.save_list_validators(brand, json.load(file))
+        batch = []
+        for name in sorted(os.listdir(brand_directory)):
+            if name == "plans.json" or not is_store_document(name):
+                continue
+            batch.append((name[:-len(".json")], load_json(os.path.join(brand_directory, name))))
+            if len(batch) >= QUERY_CHUNK:
+                store.save_plan_details(brand, batch)
+                detail_count += len(batch)
+                batch = []
+        if batch:
+            store.save_plan_details(brand, batch)
+            detail_count += len(batch)
+        brand_count += 1
+        logging.info(f"Imported '{brand_directory}'")
+    return brand_count, detail_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import the SQLite plan store.")
+    parser.add_argument("command", choices=["export", "import"],
+                        help="'export' writes the store as a JSON tree, 'import' loads a JSON tree.")
+    parser.add_argument("--directory", default="brands", help="The root of the JSON tree (default: brands).")
+    parser.add_argument("--format", dest="storage_format",
+                        help="The storage format of exported documents (default: STORAGE_FORMAT).")
+    parser.add_argument("--database", default=STORE_PATH, help=f"The store (default: {STORE_PATH}).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    store = PlanStore(args.database)
+    try:
+        if args.command == "export":
+            brand_count, detail_count = export_json_tree(store, args.directory, args.storage_format)
+            logging.info(f"Exported {brand_count} brands and {detail_count} plan details to '{args.directory}'")
+        else:
+            brand_count, detail_count = import_json_tree(store, args.directory)
+            logging.info(f"Imported {brand_count} brands and {detail_count} plan details into '{args.database}'")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
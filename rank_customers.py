@@ -0,0 +1,341 @@
+"""Rank plans for a batch of customers across worker processes.
+
+Reads a CSV of customers, one row each:
+
+    nmi,postcode,distributor,customer_type,annual_usage,controlled_load,export,usage_file
+
+Only 'nmi' and 'postcode' are required. A customer's usage comes from the interval
+usage CSV named by 'usage_file' (see bill_estimator.py) if given, and otherwise from the
+annual kWh in 'annual_usage', 'controlled_load' and 'export', spread over the year by a
+shape profile ('--shape', itself an interval usage CSV, or a flat profile by default).
+
+The compiled tariffs of every electricity plan are stacked once and written as '.npy'
+files that every worker maps into memory, so workers share one copy of the plan data
+through the page cache instead of each receiving it pickled. Customers are read and
+sent to the workers in shards of 'RANK_SHARD_SIZE', and within a shard the customers
+that share eligible plans are estimated together. The top plans of each customer are
+written to the output CSV as shards complete, in input order, so neither the input
+nor the output is ever held in memory as a whole.
+
+Usage:
+    python rank_customers.py --customers customers.csv --output rankings.csv [--shape shape.csv] [--top 3] [--workers 8]
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import itertools
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+from bill_estimator import UsageProfile, band_usage, bills_from_usage, estimate_bills
+from config import RANK_WORKERS, RANK_SHARD_SIZE
+from plan_index import PlanIndex
+from tariff_cache import load_brand_tariffs
+from tariffs import TariffSet
+
+OUTPUT_FIELDS = ("nmi", "rank", "planId", "brand", "brandName", "displayName", "annualBill")
+
+# Set up in each worker process by 'init_worker'
+_worker = {}
+
+
+def flat_profile(days=365):
+    """
+    Args:
+        days (int): The number of days, starting on 1 January of a common year.
+
+    Returns:
+        UsageProfile: A profile of 1 kWh of usage, controlled load and export per day,
+        spread evenly over the half-hours.
+    """
+    timestamps = np.datetime64("2023-01-01T00:00") + np.arange(days * 48) * np.timedelta64(30, "m")
+    unit = np.full(len(timestamps), 1 / 48)
+    return UsageProfile(timestamps, unit, controlled_load=unit, export=unit)
+
+
+def unit_shape(profile):
+    """
+    Scale a shape profile to 1 kWh per year of each kind of usage.
+
+    Kinds of usage the profile does not have are spread evenly instead.
+
+    Args:
+        profile (UsageProfile): The shape profile, modified in place.
+
+    Returns:
+        UsageProfile: The profile.
+    """
+    for name in ("usage", "controlled_load", "export"):
+        values = getattr(profile, name)
+        if not values.any():
+            values = np.ones_like(values)
+        setattr(profile, name, values / (values.sum() * 365.0 / profile.days))
+    return profile
+
+
+def export_tariff_set(index, directory, shared_directory):
+    """
+    Stack the compiled tariffs of every indexed electricity plan into memory-mappable
+    files.
+
+    Args:
+        index (PlanIndex): The loaded plan index.
+        directory (str): The root of the store.
+        shared_directory (str): The directory to write the arrays to.
+
+    Returns:
+        int: The number of plans written.
+    """
+    tariffs = []
+    for brand, brand_index in index.brands.items():
+        plan_ids = [plan_id for plan_id, summary in brand_index.plans.items()
+                    if summary.get("fuelType") in ("ELECTRICITY", "DUAL")]
+        brand_tariffs = load_brand_tariffs(brand, plan_ids, directory)
+        tariffs.extend(brand_tariffs[plan_id] for plan_id in plan_ids if plan_id in brand_tariffs)
+    if not tariffs:
+        return 0
+    TariffSet(tariffs).save_arrays(shared_directory)
+    return len(tariffs)
+
+
+def init_worker(shared_directory, directory, shape_path, top, conditional_discounts):
+    """
+    Map the shared tariff arrays and load the plan index in a worker process.
+
+    Args:
+        shared_directory (str): The directory written by 'export_tariff_set'.
+        directory (str): The root of the store.
+        shape_path (str): The shape profile CSV, or None for a flat profile.
+        top (int): The number of plans ranked per customer.
+        conditional_discounts (bool): Whether to apply conditional discounts.
+    """
+    tariff_set = TariffSet.load_arrays(shared_directory)
+    shape = unit_shape(UsageProfile.from_csv(shape_path) if shape_path else flat_profile())
+    _worker.update(
+        tariff_set=tariff_set,
+        position_of=dict(zip(tariff_set.plan_ids, itertools.count())),
+        index=PlanIndex.load(directory),
+        shape=shape,
+        band_usage=band_usage(tariff_set, shape),
+        top=top,
+        conditional_discounts=conditional_discounts,
+        positions={},
+    )
+
+
+def eligible_positions(postcode, distributor, customer_type):
+    """
+    Args:
+        postcode (str): The customer's postcode.
+        distributor (str): The customer's distributor, or None.
+        customer_type (str): 'RESIDENTIAL' or 'BUSINESS'.
+
+    Returns:
+        numpy.ndarray: The positions in the shared tariff set of the plans the customer
+        is eligible for, or None if there are no such plans. Cached per worker; only the
+        positions are, so the cache stays small however many postcodes are ranked.
+    """
+    key = (postcode, distributor, customer_type)
+    cached = _worker["positions"]
+    if key not in cached:
+        position_of = _worker["position_of"]
+        summaries = _worker["index"].lookup(postcode=postcode, distributor=distributor,
+                                            customer_type=customer_type)
+        positions = [position_of[summary["planId"]] for summary in summaries if summary["planId"] in position_of]
+        cached[key] = np.array(positions, dtype=np.intp) if positions else None
+    return cached[key]
+
+
+def eligible_subset(postcode, distributor, customer_type):
+    """
+    Args:
+        postcode (str): The customer's postcode.
+        distributor (str): The customer's distributor, or None.
+        customer_type (str): 'RESIDENTIAL' or 'BUSINESS'.
+
+    Returns:
+        tuple: The 'TariffSet' of the plans the customer is eligible for and the shape
+        profile's usage per band and days per tariff period for them, or None if there
+        are no such plans. The subset is copied from the shared arrays on every call, so
+        callers only keep it while they rank one group of customers.
+    """
+    positions = eligible_positions(postcode, distributor, customer_type)
+    if positions is None:
+        return None
+    kwh, period_days = _worker["band_usage"]
+    return _worker["tariff_set"].subset(positions), kwh[positions], period_days[positions]
+
+
+def parse_kwh(value):
+    """
+    Args:
+        value (str): An annual kWh column of the customer CSV.
+
+    Returns:
+        float: The kWh, zero if the column is empty.
+    """
+    return float(value) if value not in (None, "") else 0.0
+
+
+def rank_shard(customers):
+    """
+    Rank the plans of a shard of customers, in a worker process.
+
+    Args:
+        customers (list): Customer rows from the input CSV.
+
+    Returns:
+        list: The output rows.
+    """
+    top = _worker["top"]
+    shape = _worker["shape"]
+    options = {"conditional_discounts": _worker["conditional_discounts"]}
+    groups = collections.defaultdict(list)
+    for position, customer in enumerate(customers):
+        key = (customer["postcode"].strip(), (customer.get("distributor") or "").strip() or None,
+               (customer.get("customer_type") or "").strip() or "RESIDENTIAL")
+        groups[key].append(position)
+
+    ranked = [None] * len(customers)  # The top plan IDs and bills, so no subset is kept
+
+    def rank(position, subset, customer_bills):
+        best = np.argsort(customer_bills, kind="stable")[:top]
+        ranked[position] = [(subset.plan_ids[plan], customer_bills[plan]) for plan in best]
+
+    for key, positions in groups.items():
+        eligible = eligible_subset(*key)
+        if eligible is None:
+            continue
+        subset, kwh, period_days = eligible
+        annual = []
+        for position in positions:
+            customer = customers[position]
+            if customer.get("usage_file"):
+                profile = UsageProfile.from_csv(customer["usage_file"])
+                rank(position, subset, estimate_bills(subset, profile, **options)["total"])
+            else:
+                annual.append((position, [parse_kwh(customer.get(name))
+                                          for name in ("annual_usage", "controlled_load", "export")]))
+        if annual:  # Usage per band is linear in the annual usage, so scale the shape's
+            scale = np.array([kinds for _, kinds in annual])
+            bills = bills_from_usage(
+                subset, kwh * scale[:, 0, None, None], period_days, shape.days,
+                shape.by_weekday(shape.controlled_load) * scale[:, 1, None, None],
+                shape.by_weekday(shape.export) * scale[:, 2, None, None], **options,
+            )["total"]
+            for (position, _), customer_bills in zip(annual, bills):
+                rank(position, subset, customer_bills)
+
+    index = _worker["index"]
+    rows = []
+    for customer, best in zip(customers, ranked):
+        for rank_number, (plan_id, bill) in enumerate(best or (), 1):
+            summary = index.plan(plan_id) or {}
+            rows.append({
+                "nmi": customer["nmi"], "rank": rank_number, "planId": plan_id, "brand": summary.get("brand"),
+                "brandName": summary.get("brandName"), "displayName": summary.get("displayName"),
+                "annualBill": f"{bill:.2f}",
+            })
+    return rows
+
+
+def iter_shards(customers_path, shard_size):
+    """
+    Yield the rows of a customer CSV in lists of up to 'shard_size'.
+
+    Args:
+        customers_path (str): The customer CSV.
+        shard_size (int): The number of rows per list.
+    """
+    with open(customers_path, newline="") as file:
+        reader = csv.DictReader(file)
+        while True:
+            shard = list(itertools.islice(reader, shard_size))
+            if not shard:
+                return
+            yield shard
+
+
+def rank_customers(customers_path, output_path, directory="brands", shape_path=None, top=3,
+                   workers=RANK_WORKERS, shard_size=RANK_SHARD_SIZE, conditional_discounts=True):
+    """
+    Rank the plans of every customer in a CSV and write the top plans of each.
+
+    Args:
+        customers_path (str): The customer CSV.
+        output_path (str): The output CSV, replaced once all customers are ranked.
+        directory (str): The root of the store.
+        shape_path (str, optional): An interval usage CSV giving the shape of the year's
+            usage of customers with annual totals.
+        top (int): The number of plans written per customer.
+        workers (int, optional): The number of worker processes, one per CPU by default.
+        shard_size (int): The number of customers sent to a worker at once.
+        conditional_discounts (bool): Whether to apply conditional discounts.
+
+    Returns:
+        tuple: The number of customers read and of output rows written.
+    """
+    workers = workers or os.cpu_count()
+    customer_count = row_count = 0
+    with tempfile.TemporaryDirectory(prefix="tariffs-") as shared_directory:
+        plan_count = export_tariff_set(PlanIndex.load(directory), directory, shared_directory)
+        if not plan_count:
+            raise ValueError(f"No electricity plans with compiled tariffs under '{directory}'")
+        logging.info(f"Shared the tariffs of {plan_count} plans with {workers} workers")
+
+        temporary_path = f"{output_path}.tmp"
+        try:
+            with open(temporary_path, "w", newline="") as output, concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker,
+                initargs=(shared_directory, directory, shape_path, top, conditional_discounts),
+            ) as executor:
+                writer = csv.DictWriter(output, fieldnames=OUTPUT_FIELDS)
+                writer.writeheader()
+                pending = collections.deque()
+                shards = iter_shards(customers_path, shard_size)
+                for shard in itertools.chain(shards, [None]):
+                    if shard is not None:
+                        customer_count += len(shard)
+                        pending.append(executor.submit(rank_shard, shard))
+                    # Keep a couple of shards queued per worker, and write the oldest in order
+                    while pending and (shard is None or len(pending) > 2 * workers):
+                        rows = pending.popleft().result()
+                        writer.writerows(rows)
+                        row_count += len(rows)
+            os.replace(temporary_path, output_path)
+        finally:
+            if os.path.exists(temporary_path):  # Only left behind by a failed run
+                os.remove(temporary_path)
+    return customer_count, row_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank plans for a CSV of customers.")
+    parser.add_argument("--customers", required=True, help="CSV of customers to rank plans for.")
+    parser.add_argument("--output", required=True, help="CSV to write the rankings to.")
+    parser.add_argument("--shape", help="Interval usage CSV used to spread annual usage over the year.")
+    parser.add_argument("--top", type=int, default=3, help="Number of plans per customer (default: 3).")
+    parser.add_argument("--workers", type=int, default=RANK_WORKERS, help="Number of worker processes.")
+    parser.add_argument("--shard-size", type=int, default=RANK_SHARD_SIZE,
+                        help=f"Customers sent to a worker at once (default: {RANK_SHARD_SIZE}).")
+    parser.add_argument("--no-conditional-discounts", action="store_true",
+                        help="Ignore conditional discounts such as pay on time discounts.")
+    parser.add_argument("--directory", default="brands", help="The root of the store (default: brands).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    start = time.perf_counter()
+    customer_count, row_count = rank_customers(
+        args.customers, args.output, args.directory, args.shape, args.top, args.workers, args.shard_size,
+        not args.no_conditional_discounts,
+    )
+    logging.info(f"Ranked plans for {customer_count} customers in {time.perf_counter() - start:.1f}s, "
+                 f"wrote {row_count} rows to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""HTTP service answering plan filter queries from memory.
+
+Loads the plan index of every brand (see plan_index.py) once, serves queries from it
+and every 'SERVE_RELOAD_SECONDS' reloads only the brands whose index a sync has
+rewritten since. Responses are cached until the next reload, so repeated queries are
+answered without any filtering or JSON encoding.
+
+Endpoints, each accepting the filters 'postcode', 'brand', 'fuelType', 'customerType',
+'distributor', 'planId', 'brandName' and 'displayName' as query parameters:
+
+- GET /plans: the summaries of the matching plans.
+- GET /filters: the brands, brand names, distributors, postcodes and customer types of
+  the matching plans, for narrowing down further filters.
+- GET /health: the number of brands and plans loaded.
+
+Usage:
+    python serve_plans.py [--host 127.0.0.1] [--port 8080] [--directory brands]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+from aiohttp import web
+from config import SERVE_HOST, SERVE_PORT, SERVE_RELOAD_SECONDS, SERVE_CACHE_SIZE
+from plan_index import PlanIndex
+
+# Query parameters answered by the index, and the 'PlanIndex.lookup' argument of each
+INDEX_FILTERS = {
+    "postcode": "postcode",
+    "distributor": "distributor",
+    "brand": "brand",
+    "fuelType": "fuel_type",
+    "customerType": "customer_type",
+}
+
+# Query parameters matched against the plan summaries
+SUMMARY_FILTERS = ("planId", "brandName", "displayName")
+
+
+class QueryError(ValueError):
+    """Raised for a query the service cannot answer."""
+
+
+def filter_plans(index, query):
+    """
+    Find the plans matching the filters of a query.
+
+    Args:
+        index (PlanIndex): The loaded plan index.
+        query (Mapping): The query parameters.
+
+    Returns:
+        list: The summaries of the matching plans.
+
+    Raises:
+        QueryError: If the query has an unknown or repeated parameter.
+    """
+    for name in query:
+        if name not in INDEX_FILTERS and name not in SUMMARY_FILTERS:
+            raise QueryError(f"Unknown filter '{name}'")
+        if len(query.getall(name)) > 1:
+            raise QueryError(f"Filter '{name}' given more than once")
+    lookup_arguments = {argument: query.get(name) for name, argument in INDEX_FILTERS.items()}
+
+    plan_id = query.get("planId")
+    if plan_id is not None:  # Only the plan's brand needs to be searched
+        summary = index.plan(plan_id)
+        if summary is None or lookup_arguments["brand"] not in (None, summary["brand"]):
+            return []
+        lookup_arguments["brand"] = summary["brand"]
+
+    plans = index.lookup(**lookup_arguments)
+    if plan_id is not None:
+        plans = [plan for plan in plans if plan["planId"] == plan_id]
+    for name in ("brandName", "displayName"):
+        value = query.get(name)
+        if value is not None:
+            value = value.casefold()
+            plans = [plan for plan in plans if (plan.get(name) or "").casefold() == value]
+    return plans
+
+
+def filter_outputs(index, plans):
+    """
+    Collect the values of the matching plans that further filters can take.
+
+    Args:
+        index (PlanIndex): The snapshot of the plan index the plans were found in.
+        plans (list): The summaries of the matching plans.
+
+    Returns:
+        dict: The sorted 'brands', 'brandNames', 'distributors', 'postcodes' and
+        'customerTypes' of the plans.
+    """
+    brands = index.brands
+    plan_ids_by_brand = collections.defaultdict(list)
+    for plan in plans:
+        plan_ids_by_brand[plan["brand"]].append(plan["planId"])
+    postcodes = set()
+    exclusions = []
+    for brand, plan_ids in plan_ids_by_brand.items():
+        listed, brand_exclusions = brands[brand].postcodes_of(plan_ids)
+        postcodes |= listed
+        exclusions.extend(brand_exclusions)
+    if exclusions:  # Some plans are available at every postcode they do not exclude
+        known_postcodes = set()
+        for brand_index in brands.values():
+            known_postcodes.update(brand_index.postcodes)
+        postcodes |= known_postcodes - frozenset.intersection(*exclusions)
+    return {
+        "brands": sorted(plan_ids_by_brand),
+        "brandNames": sorted({plan["brandName"] for plan in plans if plan.get("brandName")}),
+        "distributors": sorted({distributor for plan in plans for distributor in plan["distributors"]}),
+        "postcodes": sorted(postcodes),
+        "customerTypes": sorted({plan["customerType"] for plan in plans if plan.get("customerType")}),
+    }
+
+
+class PlanService:
+    """
+    The loaded plan index and the cache of encoded responses.
+
+    Args:
+        directory (str): The root of the store.
+        cache_size (int): The number of responses kept in the cache.
+    """
+
+    def __init__(self, directory="brands", cache_size=SERVE_CACHE_SIZE):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.index = PlanIndex.load(directory)
+        self._cache = collections.OrderedDict()
+
+    def reload(self):
+        """
+        Reload the brands whose index changed and empty the cache if any did.
+
+        Returns:
+            list: The names of the brands that were loaded, reloaded or dropped.
+        """
+        changed = self.index.refresh(self.directory)
+        if changed:
+            self._cache = collections.OrderedDict()
+        return changed
+
+    def respond(self, endpoint, query):
+        """
+        Answer a query, from the cache if it was answered since the last reload.
+
+        Args:
+            endpoint (str): 'plans' or 'filters'.
+            query (MultiDictProxy): The query parameters.
+
+        Returns:
+            bytes: The encoded JSON response body.
+
+        Raises:
+            QueryError: If the query has an unknown or repeated parameter.
+        """
+        key = (endpoint, tuple(sorted(query.items())))
+        cache = self._cache
+        body = cache.get(key)
+        if body is not None:
+            cache.move_to_end(key)
+            return body
+        index = self.index.snapshot()  # Unchanged by a reload while the query runs
+        plans = filter_plans(index, query)
+        if endpoint == "plans":
+            response = {"data": {"plans": plans}, "meta": {"totalRecords": len(plans)}}
+        else:
+            response = {"data": filter_outputs(index, plans), "meta": {"totalRecords": len(plans)}}
+        body = json.dumps(response, separators=(",", ":")).encode()
+        cache[key] = body
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return body
+
+
+def create_app(service, reload_seconds=SERVE_RELOAD_SECONDS):
+    """
+    Create the web application serving a plan service.
+
+    Args:
+        service (PlanService): The loaded plan service.
+        reload_seconds (float): How often to check for brands changed by a sync.
+
+    Returns:
+        aiohttp.web.Application: The application.
+    """
+    def handler(endpoint):
+        async def handle(request):
+            try:
+                body = service.respond(endpoint, request.query)
+            except QueryError as error:
+                raise web.HTTPBadRequest(text=json.dumps({"error": str(error)}),
+                                         content_type="application/json")
+            return web.Response(body=body, content_type="application/json")
+        return handle
+
+    async def health(request):
+        brands = service.index.brands
+        return web.json_response({
+            "brands": len(brands),
+            "plans": sum(len(brand_index.plans) for brand_index in brands.values()),
+        })
+
+    async def reload_periodically(app):
+        async def reload_loop():
+            while True:
+                await asyncio.sleep(reload_seconds)
+                try:
+                    changed = await asyncio.to_thread(service.reload)
+                except Exception:  # Keep serving the loaded index
+                    logging.exception("Failed to reload the plan index")
+                    continue
+                if changed:
+                    logging.info(f"Reloaded the plan index of {len(changed)} brands: {', '.join(changed)}")
+
+        task = asyncio.create_task(reload_loop())
+        yield
+        task.cancel()
+
+    app = web.Application()
+    app.router.add_get("/plans", handler("plans"))
+    app.router.add_get("/filters", handler("filters"))
+    app.router.add_get("/health", health)
+    app.cleanup_ctx.append(reload_periodically)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve plan filter queries over HTTP.")
+    parser.add_argument("--host", default=SERVE_HOST, help=f"Address to listen on (default: {SERVE_HOST}).")
+    parser.add_argument("--port", type=int, default=SERVE_PORT, help=f"Port to listen on (default: {SERVE_PORT}).")
+    parser.add_argument("--directory", default="brands", help="The root of the store (default: brands).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    service = PlanService(args.directory)
+    brands = service.index.brands
+    logging.info(
+        f"Loaded {sum(len(brand_index.plans) for brand_index in brands.values())} plans "
+        f"from {len(brands)} brands"
+    )
+    web.run_app(create_app(service), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""Reading and writing the JSON documents of the brands/ store.
+
+Plan lists ('plans.json') and plan details ('{planId}.json') are written in the format
+set by 'STORAGE_FORMAT' in config.py:
+
+- 'pretty': JSON indented by 4 spaces, easy to read and diff by hand.
+- 'compact': JSON without whitespace.
+- 'gzip': compact JSON compressed with gzip.
+- 'zstd': compact JSON compressed with Zstandard. Needs the optional 'zstandard' package.
+
+File names do not depend on the format. Readers detect compressed files by their magic
+bytes, so a tree holding several formats at once, for example after 'STORAGE_FORMAT' was
+changed, stays readable. An existing tree is converted with:
+
+    python storage.py migrate --format zstd [--directory brands]
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import tempfile
+from config import STORAGE_FORMAT
+
+try:
+    import zstandard  # Optional, only needed for the 'zstd' format
+except ImportError:
+    zstandard = None
+
+STORAGE_FORMATS = ("pretty", "compact", "gzip", "zstd")
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def check_storage_format(storage_format):
+    """
+    Check that a storage format is known and usable.
+
+    Args:
+        storage_format (str): One of 'STORAGE_FORMATS'.
+
+    Raises:
+        ValueError: If the format is unknown.
+        RuntimeError: If the format needs a package that is not installed.
+    """
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(
+            f"Unknown storage format '{storage_format}', expected one of {', '.join(STORAGE_FORMATS)}"
+        )
+    if storage_format == "zstd" and zstandard is None:
+        raise RuntimeError("The 'zstd' storage format needs the 'zstandard' package")
+
+
+def detect_storage_format(data):
+    """
+    Detect the storage format of a document from its first bytes.
+
+    Args:
+        data (bytes): The document, or at least its first four bytes.
+
+    Returns:
+        str: 'gzip' or 'zstd' for compressed documents, otherwise 'json'. Pretty and
+        compact JSON are not told apart as they are read the same way.
+    """
+    if data.startswith(GZIP_MAGIC):
+        return "gzip"
+    if data.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return "json"
+
+
+def encode_json(obj, storage_format=None):
+    """
+    Serialise a JSON document in a storage format.
+
+    Args:
+        obj: The JSON serialisable document.
+        storage_format (str, optional): The format to use, 'STORAGE_FORMAT' by default.
+
+    Returns:
+        bytes: The encoded document.
+    """
+    storage_format = storage_format or STORAGE_FORMAT
+    check_storage_format(storage_format)
+    if storage_format == "pretty":
+        return json.dumps(obj, indent=4).encode()
+    data = json.dumps(obj, separators=(",", ":")).encode()
+    if storage_format == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if storage_format == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def decode_json(data):
+    """
+    Parse a JSON document saved in any storage format.
+
+    Args:
+        data (bytes): The saved document.
+
+    Returns:
+        The parsed document.
+    """
+    detected_format = detect_storage_format(data)
+    if detected_format == "gzip":
+        data = gzip.decompress(data)
+    elif detected_format == "zstd":
+        check_storage_format("zstd")
+        # Streamed frames do not record their size, which 'decompress' requires
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return json.loads(data)
+
+
+def load_json(filename):
+    """
+    Load a JSON document saved in any storage format.
+
+    Args:
+        filename (str): The path of the document.
+
+    Returns:
+        The parsed document.
+    """
+    with open(filename, "rb") as file:
+        return decode_json(file.read())
+
+
+def replace_file(filename, data, durable=False):
+    """
+    Replace a file with new contents via a temporary file and a rename.
+
+    Readers see either the old or the new file, never a partially written one.
+
+    Args:
+        filename (str): The path of the file.
+        data (bytes): The new contents.
+        durable (bool): Flush the new contents to disk before the rename, so that they
+            also survive a power loss.
+    """
+    directory, name = os.path.split(filename)
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=directory or ".", prefix=f".{name}.", suffix=".tmp", delete=False
+    ) as file:
+        file.write(data)
+        if durable:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(file.name, filename)
+
+
+def save_json(filename, obj, storage_format=None):
+    """
+    Save a JSON document in a storage format.
+
+    Args:
+        filename (str): The path of the document.
+        obj: The JSON serialisable document.
+        storage_format (str, optional): The format to use, 'STORAGE_FORMAT' by default.
+    """
+    replace_file(filename, encode_json(obj, storage_format))
+
+
+class AtomicJsonListWriter:
+    """
+    Write a JSON list to a file one batch of items at a time.
+
+    Items are appended to a temporary file in the same directory as they arrive, so
+    memory use does not grow with the size of the list. The temporary file only
+    replaces the target file when 'commit' is called, so a crash or error mid-write
+    never leaves a truncated file behind. The output is identical to 'encode_json'
+    for the whole list, so 'pretty' output matches 'json.dumps(items, indent=4)'.
+
+    Args:
+        filename (str): The path of the file to write.
+        storage_format (str, optional): The format to use, 'STORAGE_FORMAT' by default.
+
+    Attributes:
+        count (int): The number of items written so far.
+
+    Example:
+        with AtomicJsonListWriter("brands/agl/plans.json") as writer:
+            for page in pages:
+                writer.write(page)
+            writer.commit()
+    """
+
+    def __init__(self, filename, storage_format=None):
+        self.filename = filename
+        self.storage_format = storage_format or STORAGE_FORMAT
+        check_storage_format(self.storage_format)
+        self.count = 0
+        self._file = None
+        self._stream = None
+
+    def __enter__(self):
+        directory, name = os.path.split(self.filename)
+        self._file = tempfile.NamedTemporaryFile(
+            "wb", dir=directory or ".", prefix=f".{name}.", suffix=".tmp", delete=False
+        )
+        if self.storage_format == "gzip":
+            self._stream = gzip.GzipFile(
+                fileobj=self._file, mode="wb", compresslevel=GZIP_LEVEL, mtime=0
+            )
+        elif self.storage_format == "zstd":
+            self._stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(
+                self._file, closefd=False
+            )
+        else:
+            self._stream = self._file
+        self._write("[")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._file is not None:  # Not committed, so throw the partial file away
+            self._file.close()
+            os.remove(self._file.name)
+            self._file = self._stream = None
+
+    def _write(self, text):
+        self._stream.write(text.encode())
+
+    def write(self, items):
+        """
+        Append items to the list.
+
+        Args:
+            items (iterable): The JSON serialisable items to append.
+        """
+        for item in items:
+            if self.storage_format == "pretty":
+                separator = ",\n    " if self.count else "\n    "
+                self._write(separator + json.dumps(item, indent=4).replace("\n", "\n    "))
+            else:
+                separator = "," if self.count else ""
+                self._write(separator + json.dumps(item, separators=(",", ":")))
+            self.count += 1
+
+    def commit(self):
+        """
+        Finish the list and atomically replace the target file with it.
+        """
+        self._write("\n]" if self.count and self.storage_format == "pretty" else "]")
+        if self._stream is not self._file:
+            self._stream.close()  # Flushes the compressed stream, the file stays open
+        self._file.flush()
+        os.fsync(self._file.fileno())  # The data must be on disk before the rename is
+        self._file.close()
+        os.replace(self._file.name, self.filename)
+        self._file = self._stream = None
+
+
+def is_store_document(filename):
+    """
+    Check whether a file in a brand directory is a plan list or plan detail document.
+
+    Args:
+        filename (str): The name of the file.
+
+    Returns:
+        bool: False for sidecar metadata ('*.meta.json', '*.index.json', '*.records.json',
+        'manifest.json' and 'queue.json') and temporary files.
+    """
+    return (filename.endswith(".json") and not filename.endswith((".meta.json", ".index.json", ".records.json"))
+            and filename not in ("manifest.json", "queue.json") and not filename.startswith("."))
+
+
+def migrate_store(directory, storage_format):
+    """
+    Convert every plan list and plan detail document under a store to a storage format.
+
+    Each file is replaced atomically, so an interrupted migration leaves a readable tree
+    of mixed formats that can simply be migrated again. The sizes and hashes in each
+    brand's manifest, and the hashes its compiled tariffs were made from, are updated to
+    match.
+
+    Args:
+        directory (str): The root of the store, usually 'brands'.
+        storage_format (str): The format to convert to.
+
+    Returns:
+        tuple: The number of documents converted, the number already in the format, the
+        total size in bytes before and the total size in bytes after.
+    """
+    # Not at the top, as these modules import this one
+    from manifest import PlanManifest
+    from tariff_cache import TariffCache
+
+    check_storage_format(storage_format)
+    converted = unchanged = bytes_before = bytes_after = 0
+    for brand in sorted(os.listdir(directory)):
+        brand_directory = os.path.join(directory, brand)
+        if not os.path.isdir(brand_directory):
+            continue
+        manifest = PlanManifest.load(brand_directory)
+        tariffs = TariffCache.load(brand_directory)
+        for name in sorted(os.listdir(brand_directory)):
+            if not is_store_document(name):
+                continue
+            filename = os.path.join(brand_directory, name)
+            with open(filename, "rb") as file:
+                data = file.read()
+            encoded = encode_json(decode_json(data), storage_format)
+            bytes_before += len(data)
+            bytes_after += len(encoded)
+            if encoded == data:
+                unchanged += 1
+                continue
+            replace_file(filename, encoded)
+            plan_id = name[:-len(".json")]
+            old_hash = (manifest.plans.get(plan_id) or {}).get("hash")
+            manifest.update_file(plan_id, encoded)
+            if old_hash is not None:
+                tariffs.update_source(plan_id, old_hash, manifest.plans[plan_id]["hash"])
+            converted += 1
+        manifest.save()
+        tariffs.save()
+        logging.info(f"Migrated '{brand_directory}'")
+    return converted, unchanged, bytes_before, bytes_after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the brands/ plan store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Convert an existing store to another storage format."
+    )
+    migrate_parser.add_argument("--format", choices=STORAGE_FORMATS, required=True,
+                                help="The storage format to convert to.")
+    migrate_parser.add_argument("--directory", default="brands",
+                                help="The root of the store (default: brands).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == "migrate":
+        converted, unchanged, bytes_before, bytes_after = migrate_store(args.directory, args.format)
+        logging.info(
+            f"Converted {converted} documents to '{args.format}' ({unchanged} already were): "
+            f"{bytes_before} bytes -> {bytes_after} bytes"
+        )
+        if args.format != STORAGE_FORMAT:
+            logging.warning(
+                f"STORAGE_FORMAT in config.py is '{STORAGE_FORMAT}', so documents saved by the "
+                f"next sync will be written as '{STORAGE_FORMAT}'"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""Metrics of a sync, per retailer, and the run report built from them.
+
+Every 'CDRClient' carries a 'SyncMetrics' that records each request attempt it makes:
+its status or error, its latency in a histogram (including any wait for a pooled
+connection), and the size of its decompressed body, labelled by the retailer base URI
+and by the kind of request ('plans' for plan list pages, 'details' for plan details,
+'other' for anything else). Retries are counted as well. The sync
+adds what only it knows: plan details skipped as up-to-date, saved, not modified,
+failed or deleted, the time spent saving, and each retailer's total sync time. Instead
+of a log line per plan, the sync logs 'SyncMetrics.progress' every 'PROGRESS_INTERVAL'
+seconds: the plan details checked so far, the rate and the time remaining.
+
+At the end of a sync 'get_plans.py' writes 'SyncMetrics.report' as JSON to
+'SYNC_REPORT_FILE', and with '--prometheus' also writes 'SyncMetrics.prometheus_text'
+in the Prometheus text exposition format, e.g. for the node exporter's textfile
+collector.
+
+Example:
+    metrics = SyncMetrics()
+    async with CDRClient(metrics=metrics) as client:
+        ...
+    print(json.dumps(metrics.report(), indent=4))
+"""
+
+import json
+import os
+import time
+from urllib.parse import urlsplit
+
+from manifest import format_last_downloaded
+from storage import replace_file
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Counters of plan detail outcomes and other events recorded by the sync
+COUNTERS = ("retries", "skipped", "saved", "notModified", "failed", "deleted", "plansListed")
+
+
+def request_kind(url):
+    """
+    Args:
+        url (str): The URL of a request.
+
+    Returns:
+        str: 'plans' for a plan list page, 'details' for plan details, 'other' otherwise.
+    """
+    path = urlsplit(url).path.rstrip("/")
+    if path.endswith("/energy/plans"):
+        return "plans"
+    if "/energy/plans/" in path:
+        return "details"
+    return "other"
+
+
+def is_error(outcome):
+    """
+    Args:
+        outcome (str): The status code of a request attempt, or the exception it raised.
+
+    Returns:
+        bool: True if the attempt raised or got an error status.
+    """
+    return not outcome.isdigit() or int(outcome) >= 400
+
+
+class LatencyHistogram:
+    """
+    A histogram of request latencies with the fixed 'LATENCY_BUCKETS'.
+
+    Attributes:
+        counts (list): The number of observations in each bucket, and above the last.
+        count (int): The number of observations.
+        total (float): The sum of the observations, in seconds.
+    """
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        """
+        Args:
+            seconds (float): The latency to record.
+        """
+        for position, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            position = len(LATENCY_BUCKETS)
+        self.counts[position] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, fraction):
+        """
+        Args:
+            fraction (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The upper bound of the bucket holding the quantile, None if it is above
+            the last bucket or there are no observations.
+        """
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                return bound
+        return None
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The observations, the total, the approximate median and 95th
+            percentile, and the count per bucket keyed by its upper bound.
+        """
+        buckets = {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {"count": self.count, "seconds": round(self.total, 6), "p50": self.quantile(0.5),
+                "p95": self.quantile(0.95), "buckets": buckets}
+
+
+class RetailerMetrics:
+    """
+    The metrics of one retailer base URI.
+
+    Attributes:
+        brand (str): The brand synced from the base URI, if known.
+        requests (dict): For each request kind, the number of attempts per status code,
+            with the failed attempts under the name of their exception.
+        latency (dict): For each request kind, its 'LatencyHistogram'.
+        bytes (dict): For each request kind, the number of body bytes received.
+        counters (dict): The 'COUNTERS' recorded by the sync.
+        save_seconds (float): The time spent saving plan lists and plan details.
+        sync_seconds (float): The time the retailer's sync took, from start to end.
+    """
+
+    __slots__ = ("brand", "requests", "latency", "bytes", "counters", "save_seconds", "sync_seconds")
+
+    def __init__(self):
+        self.brand = None
+        self.requests = {}
+        self.latency = {}
+        self.bytes = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.save_seconds = 0.0
+        self.sync_seconds = 0.0
+
+    def observe(self, kind, outcome, seconds, size):
+        """
+        Record a request attempt.
+
+        Args:
+            kind (str): The request kind.
+            outcome (str): The status code, or the name of the exception raised.
+            seconds (float): The time the attempt took.
+            size (int): The number of body bytes received.
+        """
+        outcomes = self.requests.setdefault(kind, {})
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        histogram = self.latency.get(kind)
+        if histogram is None:
+            histogram = self.latency[kind] = LatencyHistogram()
+        histogram.observe(seconds)
+        self.bytes[kind] = self.bytes.get(kind, 0) + size
+
+    def to_dict(self, base_url):
+        """
+        Args:
+            base_url (str): The retailer base URI.
+
+        Returns:
+            dict: The metrics, for the run report.
+        """
+        return {
+            "brand": self.brand,
+            "baseUri": base_url,
+            "syncSeconds": round(self.sync_seconds, 6),
+            "requestSeconds": round(sum(histogram.total for histogram in self.latency.values()), 6),
+            "saveSeconds": round(self.save_seconds, 6),
+            "requests": self.requests,
+            "bytes": self.bytes,
+            "latency": {kind: histogram.to_dict() for kind, histogram in self.latency.items()},
+            **self.counters,
+        }
+
+
+class SyncMetrics:
+    """
+    The metrics of a sync, per retailer base URI.
+
+    All methods are called from the event loop thread, so no locking is needed.
+
+    Attributes:
+        retailers (dict): A mapping of retailer base URIs to their 'RetailerMetrics'.
+        connections (dict): The connection counts of the client, per origin, once the
+            client is closed.
+        planned (int): The plan details the sync has set out to check so far.
+        checked (int): The plan details checked so far, whatever the outcome.
+    """
+
+    def __init__(self):
+        self.started = format_last_downloaded()
+        self._start = time.perf_counter()
+        self.retailers = {}
+        self.connections = {}
+        self.planned = 0
+        self.checked = 0
+        self._last_progress = (self._start, 0)
+
+    def retailer(self, base_url, brand=None):
+        """
+        Args:
+            base_url (str): The retailer base URI.
+            brand (str, optional): The brand synced from it, recorded for the report.
+
+        Returns:
+            RetailerMetrics: The metrics of the base URI.
+        """
+        metrics = self.retailers.get(base_url)
+        if metrics is None:
+            metrics = self.retailers[base_url] = RetailerMetrics()
+        if brand is not None:
+            metrics.brand = brand
+        return metrics
+
+    def observe_request(self, base_url, url, outcome, seconds, size=0):
+        """
+        Record a request attempt.
+
+        Args:
+            base_url (str): The retailer base URI.
+            url (str): The requested URL.
+            outcome (int or str): The status code, or the name of the exception raised.
+            seconds (float): The time the attempt took.
+            size (int): The number of body bytes received.
+        """
+        self.retailer(base_url).observe(request_kind(url), str(outcome), seconds, size)
+
+    def count(self, base_url, name, value=1):
+        """
+        Add to one of the 'COUNTERS' of a retailer.
+
+        Args:
+            base_url (str): The retailer base URI.
+            name (str): The counter.
+            value (int): The amount to add.
+        """
+        self.retailer(base_url).counters[name] += value
+
+    def add_save_time(self, base_url, seconds):
+        """
+        Args:
+            base_url (str): The retailer base URI.
+            seconds (float): Time spent saving the retailer's plan lists or plan details.
+        """
+        self.retailer(base_url).save_seconds += seconds
+
+    def progress(self):
+        """
+        Summarise the plan details checked since the last call.
+
+        Returns:
+            str: The plan details checked and their outcomes so far, the rate since the
+            last call, and the estimated time remaining for the plan details planned so
+            far, or None if none were checked since the last call.
+        """
+        now = time.perf_counter()
+        last_time, last_checked = self._last_progress
+        self._last_progress = (now, self.checked)
+        if self.checked == last_checked:
+            return None
+        rate = (self.checked - last_checked) / max(now - last_time, 1e-9)
+        remaining = max(self.planned - self.checked, 0)
+        totals = self.totals()
+        return (
+            f"Plan details: {self.checked}/{self.planned} checked ({totals['saved']} saved, "
+            f"{totals['notModified']} not modified, {totals['skipped']} up-to-date, {totals['failed']} failed), "
+            f"{rate:.0f} plans/s, {remaining} remaining, about {remaining / rate:.0f}s left"
+        )
+
+    def totals(self):
+        """
+        Returns:
+            dict: The requests, failed requests (errors and error statuses), bytes
+            received and 'COUNTERS' summed over all retailers.
+        """
+        totals = {"requests": 0, "errors": 0, "bytes": 0, **dict.fromkeys(COUNTERS, 0)}
+        for metrics in self.retailers.values():
+            for outcomes in metrics.requests.values():
+                totals["requests"] += sum(outcomes.values())
+                totals["errors"] += sum(count for outcome, count in outcomes.items() if is_error(outcome))
+            totals["bytes"] += sum(metrics.bytes.values())
+            for name in COUNTERS:
+                totals[name] += metrics.counters[name]
+        return totals
+
+    def slowest_retailers(self, limit=5):
+        """
+        Args:
+            limit (int): The number of retailers.
+
+        Returns:
+            list: The names (or base URIs) and sync seconds of the retailers that took
+            longest, slowest first.
+        """
+        ranked = sorted(self.retailers.items(), key=lambda item: -item[1].sync_seconds)
+        return [(metrics.brand or base_url, metrics.sync_seconds) for base_url, metrics in ranked[:limit]]
+
+    def report(self, **summary):
+        """
+        Args:
+            **summary: Further top level fields, such as the number of plans synced.
+
+        Returns:
+            dict: The machine-readable run report.
+        """
+        return {
+            "started": self.started,
+            "finished": format_last_downloaded(),
+            "seconds": round(time.perf_counter() - self._start, 6),
+            **summary,
+            "totals": self.totals(),
+            "connections": self.connections,
+            "retailers": {
+                metrics.brand or base_url: metrics.to_dict(base_url)
+                for base_url, metrics in sorted(self.retailers.items(), key=lambda item: -item[1].sync_seconds)
+            },
+        }
+
+    def prometheus_text(self, **gauges):
+        """
+        Format the metrics in the Prometheus text exposition format.
+
+        Args:
+            **gauges: Further unlabelled gauges, e.g. plans=1234, exposed as
+                'cdr_sync_<name>'.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def sample(name, labels, value):
+            label_text = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        retailers = sorted(self.retailers.items())
+        family("cdr_sync_requests_total", "counter", "Request attempts by retailer, kind and status or error.")
+        for base_url, metrics in retailers:
+            for kind, outcomes in sorted(metrics.requests.items()):
+                for outcome, count in sorted(outcomes.items()):
+                    label = "status" if outcome.isdigit() else "error"
+                    sample("cdr_sync_requests_total",
+                           {"retailer": metrics.brand or base_url, "kind": kind, label: outcome}, count)
+        family("cdr_sync_request_duration_seconds", "histogram", "Latency of request attempts.")
+        for base_url, metrics in retailers:
+            for kind, histogram in sorted(metrics.latency.items()):
+                labels = {"retailer": metrics.brand or base_url, "kind": kind}
+                cumulative = 0
+                for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), histogram.counts):
+                    cumulative += count
+                    sample("cdr_sync_request_duration_seconds_bucket", {**labels, "le": bound}, cumulative)
+                sample("cdr_sync_request_duration_seconds_sum", labels, round(histogram.total, 6))
+                sample("cdr_sync_request_duration_seconds_count", labels, histogram.count)
+        family("cdr_sync_response_bytes_total", "counter", "Response body bytes received.")
+        for base_url, metrics in retailers:
+            for kind, size in sorted(metrics.bytes.items()):
+                sample("cdr_sync_response_bytes_total", {"retailer": metrics.brand or base_url, "kind": kind}, size)
+        family("cdr_sync_events_total", "counter", "Retries and plan detail outcomes by retailer.")
+        for base_url, metrics in retailers:
+            for name in COUNTERS:
+                sample("cdr_sync_events_total", {"retailer": metrics.brand or base_url, "event": name},
+                       metrics.counters[name])
+        family("cdr_sync_save_seconds_total", "counter", "Time spent saving plan lists and plan details.")
+        for base_url, metrics in retailers:
+            sample("cdr_sync_save_seconds_total", {"retailer": metrics.brand or base_url},
+                   round(metrics.save_seconds, 6))
+        family("cdr_sync_retailer_seconds", "gauge", "Time each retailer's sync took.")
+        for base_url, metrics in retailers:
+            sample("cdr_sync_retailer_seconds", {"retailer": metrics.brand or base_url},
+                   round(metrics.sync_seconds, 6))
+        family("cdr_sync_duration_seconds", "gauge", "Time the whole sync took.")
+        sample("cdr_sync_duration_seconds", {}, round(time.perf_counter() - self._start, 6))
+        for name, value in gauges.items():
+            family(f"cdr_sync_{name}", "gauge", f"The {name} of the sync.")
+            sample(f"cdr_sync_{name}", {}, value)
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    """
+    Args:
+        value: A label value.
+
+    Returns:
+        str: The value escaped for the Prometheus text format.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_file(path, data):
+    """
+    Atomically replace a file, creating its directory if needed.
+
+    Args:
+        path (str): The file.
+        data (bytes): The new contents.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    replace_file(path, data)
+
+
+def write_report(metrics, path, **summary):
+    """
+    Atomically write the run report of a sync as JSON.
+
+    Args:
+        metrics (SyncMetrics): The metrics of the sync.
+        path (str): The report file.
+        **summary: Further top level fields of the report.
+    """
+    write_file(path, json.dumps(metrics.report(**summary), indent=4).encode())
+
+
+def write_prometheus(metrics, path, **gauges):
+    """
+    Atomically write the metrics of a sync in the Prometheus text format.
+
+    Args:
+        metrics (SyncMetrics): The metrics of the sync.
+        path (str): The metrics file, e.g. in the node exporter's textfile directory.
+        **gauges: Further unlabelled gauges.
+    """
+    write_file(path, metrics.prometheus_text(**gauges).encode())
@@ -0,0 +1,287 @@
+"""Compiled tariffs of the saved plan details, kept up to date by the sync.
+
+Whenever the sync saves plan details it also compiles their electricity tariffs (see
+tariffs.py), so that bill estimates never have to walk the nested CDR JSON:
+
+- With the 'json' backend each brand directory holds a 'tariffs.npz' of the compiled
+  tariffs of its plans. Every tariff records the hash of the plan detail file it was
+  compiled from, as listed in the brand's manifest, and is only used while the
+  manifest still lists that hash.
+- With the 'sqlite' backend each compiled tariff is stored with its plan detail, in
+  the same transaction, and deleted with it.
+
+Tariffs compiled by another 'TARIFF_FORMAT_VERSION' are ignored. Plans whose cached
+tariff is missing or outdated are compiled from their details when they are loaded, and
+the cache of a tree can be rebuilt with:
+
+    python tariff_cache.py build [--directory brands]
+"""
+
+import argparse
+import logging
+import os
+import threading
+import numpy as np
+import plan_store
+from config import STORE_BACKEND
+from manifest import PlanManifest
+from storage import decode_json, is_store_document, load_json, replace_file
+from tariffs import TariffError, compile_tariff, decode_tariffs, encode_tariffs
+
+TARIFF_CACHE_NAME = "tariffs.npz"
+
+
+def compile_plan_tariff(plan_id, plan_details):
+    """
+    Args:
+        plan_id (str): The unique identifier for the plan.
+        plan_details (dict): The plan details.
+
+    Returns:
+        CompiledTariff: The compiled tariff, or None if the plan has no electricity
+        tariff that can be compiled.
+    """
+    try:
+        return compile_tariff(plan_details)
+    except TariffError as error:
+        logging.debug("No compiled tariff for plan '%s': %s", plan_id, error)
+        return None
+
+
+def encode_plan_tariff(plan_id, plan_details):
+    """
+    Compile the tariff of a plan for the 'sqlite' backend.
+
+    Args:
+        plan_id (str): The unique identifier for the plan.
+        plan_details (dict): The plan details.
+
+    Returns:
+        bytes: The encoded tariff, or None if it cannot be compiled.
+    """
+    tariff = compile_plan_tariff(plan_id, plan_details)
+    return None if tariff is None else encode_tariffs([tariff])
+
+
+class TariffCache:
+    """
+    The compiled tariffs of one brand directory.
+
+    Changes are kept in memory until 'save' is called, and may be made from several
+    worker threads at once.
+
+    Args:
+        directory (str): The brand directory.
+
+    Attributes:
+        tariffs (dict): A mapping of plan IDs to their 'CompiledTariff' and the hash of
+            the plan detail file it was compiled from.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, TARIFF_CACHE_NAME)
+        self.tariffs = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Load the compiled tariffs of a brand directory.
+
+        Args:
+            directory (str): The brand directory.
+
+        Returns:
+            TariffCache: The cache, empty if none was saved or it is unreadable or of
+            another format version.
+        """
+        cache = cls(directory)
+        try:
+            with open(cache.path, "rb") as file:
+                tariffs, extra = decode_tariffs(file.read())
+        except FileNotFoundError:
+            return cache
+        except (OSError, TariffError) as error:  # Recompiled as plan details are saved
+            logging.info(f"Ignoring the compiled tariffs in '{cache.path}': {error}")
+            return cache
+        cache.tariffs = {tariff.plan_id: (tariff, str(source)) for tariff, source in zip(tariffs, extra["sources"])}
+        return cache
+
+    def save(self):
+        """
+        Write the cache if it has changed since it was loaded or last saved.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = list(self.tariffs.values())
+            self._dirty = False
+        if not entries:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        data = encode_tariffs([tariff for tariff, _ in entries],
+                              sources=np.array([source for _, source in entries], dtype=str))
+        os.makedirs(self.directory, exist_ok=True)
+        replace_file(self.path, data)
+
+    def record_plan(self, plan_id, plan_details, source):
+        """
+        Compile the tariff of saved plan details.
+
+        Args:
+            plan_id (str): The unique identifier for the plan.
+            plan_details (dict): The saved plan details.
+            source (str): The manifest hash of the saved file.
+        """
+        tariff = compile_plan_tariff(plan_id, plan_details)
+        with self._lock:
+            if tariff is not None:
+                self.tariffs[plan_id] = (tariff, source)
+                self._dirty = True
+            elif self.tariffs.pop(plan_id, None) is not None:
+                self._dirty = True
+
+    def update_source(self, plan_id, old_source, new_source):
+        """
+        Record that a plan detail file was rewritten without changing its contents, e.g.
+        in another storage format.
+
+        Args:
+            plan_id (str): The unique identifier for the plan.
+            old_source (str): The manifest hash of the file before it was rewritten.
+            new_source (str): The manifest hash of the rewritten file.
+        """
+        with self._lock:
+            entry = self.tariffs.get(plan_id)
+            if entry is not None and entry[1] == old_source:
+                self.tariffs[plan_id] = (entry[0], new_source)
+                self._dirty = True
+
+    def remove_plans(self, plan_ids):
+        """
+        Forget the tariffs of plan details that were deleted.
+
+        Args:
+            plan_ids (list): The plan IDs.
+        """
+        with self._lock:
+            for plan_id in plan_ids:
+                if self.tariffs.pop(plan_id, None) is not None:
+                    self._dirty = True
+
+    def current_tariffs(self, manifest):
+        """
+        Args:
+            manifest (PlanManifest): The brand's manifest.
+
+        Returns:
+            dict: A mapping of plan IDs to the tariffs compiled from the plan detail
+            files the manifest lists.
+        """
+        return {plan_id: tariff for plan_id, (tariff, source) in self.tariffs.items()
+                if (manifest.plans.get(plan_id) or {}).get("hash") == source}
+
+
+def load_brand_tariffs(brand, plan_ids, directory="brands"):
+    """
+    Load the compiled tariffs of plans, compiling those that are not cached.
+
+    Args:
+        brand (str): The brand directory name.
+        plan_ids (list): The plan IDs.
+        directory (str): The root of the JSON tree.
+
+    Returns:
+        dict: A mapping of plan IDs to their 'CompiledTariff', without the plans that
+        have no saved details or no electricity tariff that can be compiled.
+    """
+    if STORE_BACKEND == "sqlite":
+        store = plan_store.get_store()
+        cached = {}
+        for plan_id, data in store.load_plan_tariffs(brand, plan_ids).items():
+            try:
+                cached[plan_id] = decode_tariffs(data)[0][0]
+            except TariffError:
+                pass
+    else:
+        brand_directory = os.path.join(directory, brand)
+        cached = TariffCache.load(brand_directory).current_tariffs(PlanManifest.load(brand_directory))
+
+    tariffs = {}
+    compiled = 0
+    for plan_id in plan_ids:
+        tariff = cached.get(plan_id)
+        if tariff is None:
+            if STORE_BACKEND == "sqlite":
+                plan_details = store.load_plan_details(brand, plan_id)
+            else:
+                filename = os.path.join(directory, brand, f"{plan_id}.json")
+                plan_details = load_json(filename) if os.path.isfile(filename) else None
+            if plan_details is None:
+                continue
+            tariff = compile_plan_tariff(plan_id, plan_details)
+            compiled += 1
+        if tariff is not None:
+            tariffs[plan_id] = tariff
+    if compiled:
+        logging.debug(f"Compiled {compiled} uncached tariffs of '{brand}'")
+    return tariffs
+
+
+def build_tariff_cache(brand_directory):
+    """
+    Rebuild the compiled tariffs of a brand directory of the JSON tree.
+
+    Args:
+        brand_directory (str): The brand directory.
+
+    Returns:
+        int: The number of tariffs compiled.
+    """
+    manifest = PlanManifest.load(brand_directory)
+    cache = TariffCache.load(brand_directory)
+    cache.remove_plans(list(cache.tariffs))
+    for name in sorted(os.listdir(brand_directory)):
+        if name == "plans.json" or not is_store_document(name):
+            continue
+        plan_id = name[:-len(".json")]
+        filename = os.path.join(brand_directory, name)
+        with open(filename, "rb") as file:
+            data = file.read()
+        plan_details = decode_json(data)
+        if plan_id not in manifest.plans:  # Not indexed yet, so index it now
+            manifest.record_plan(plan_id, plan_details.get("meta") or {}, data)
+        cache.record_plan(plan_id, plan_details, manifest.plans[plan_id]["hash"])
+    manifest.save()
+    cache.save()
+    return len(cache.tariffs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the compiled tariffs of the saved plan details.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Compile the tariffs of every brand.")
+    build_parser.add_argument("--directory", default="brands", help="The root of the JSON tree (default: brands).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if STORE_BACKEND == "sqlite":
+        store = plan_store.get_store()
+        for brand in store.brands():
+            tariffs = {plan_id: encode_plan_tariff(plan_id, plan_details)
+                       for plan_id, plan_details in store.iter_plan_details(brand)}
+            store.save_plan_tariffs(brand, tariffs)
+            logging.info(f"Compiled {sum(data is not None for data in tariffs.values())} tariffs of "
+                         f"'{brand}' in '{store.path}'")
+        return
+    for brand in sorted(os.listdir(args.directory)):
+        brand_directory = os.path.join(args.directory, brand)
+        if os.path.isdir(brand_directory):
+            logging.info(f"Compiled {build_tariff_cache(brand_directory)} tariffs in '{brand_directory}'")
+
+
+if __name__ == "__main__":
+    main()
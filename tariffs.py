@@ -0,0 +1,685 @@
+"""Compile the electricity tariffs of plan details into numeric arrays.
+
+The 'electricityContract' of a CDR plan detail nests tariff periods, time of use
+windows, stepped rates, controlled load, feed-in tariffs and discounts several levels
+deep. 'compile_tariff' walks it once and produces a 'CompiledTariff' of small NumPy
+arrays, and 'TariffSet' stacks many of them so that bills for all plans can be
+evaluated together (see bill_estimator.py):
+
+- Every day of the year (in a leap year, so that 29 February has a slot) maps to a
+  tariff period, and every weekday and half-hour of a tariff period maps to a usage
+  band. A band is one rate block, e.g. the peak rates of the summer tariff period.
+- Each band has up to K stepped rates with the cumulative kWh per year at which each
+  step ends; the last step never ends.
+- Each tariff period has a daily supply charge.
+- Controlled load and feed-in tariffs are rates per weekday and half-hour.
+- Discounts are fractions of the bill or of usage charges and fixed amounts per year,
+  split into guaranteed and conditional ones.
+
+Amounts are in dollars exclusive of GST, as published. Demand charges, fees and
+incentives are not compiled.
+"""
+
+import io
+import os
+import re
+import zipfile
+import numpy as np
+
+# Version of the compiled representation, bumped whenever its meaning changes
+TARIFF_FORMAT_VERSION = 1
+
+DAYS_PER_YEAR = 366
+SLOTS_PER_DAY = 48
+SLOT_MINUTES = 24 * 60 // SLOTS_PER_DAY
+DAY_NAMES = ("MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN")
+
+# Day of the year of the first day of each month, in a leap year
+LEAP_MONTH_STARTS = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+GUARANTEED = 0
+CONDITIONAL = 1
+
+# Arrays written by 'pack_tariffs'
+PACKED_ARRAYS = (
+    "version", "plan_ids", "period_counts", "band_counts", "season_of_day", "bands", "supply",
+    "step_rates", "step_limits", "controlled_rates", "controlled_supply", "feed_in_rates",
+    "discount_bill", "discount_use", "discount_fixed",
+)
+
+
+class TariffError(ValueError):
+    """Raised when the tariff of a plan cannot be compiled."""
+
+
+class CompiledTariff:
+    """
+    The tariff of one plan in numeric form.
+
+    Attributes:
+        plan_id (str): The unique identifier for the plan.
+        season_of_day (numpy.ndarray): uint8[366], the tariff period of each day of a
+            leap year.
+        bands (numpy.ndarray): uint8[T, 7, 48], the band of each tariff period,
+            weekday (Monday first) and half-hour.
+        step_rates (numpy.ndarray): float64[B, K], the unit price of each step of each
+            band, in dollars per kWh.
+        step_limits (numpy.ndarray): float64[B, K], the cumulative kWh per year at which
+            each step ends, infinite for the last.
+        supply (numpy.ndarray): float64[T], the daily supply charge of each tariff period.
+        controlled_rates (numpy.ndarray): float64[7, 48], the controlled load unit price
+            of each weekday and half-hour.
+        controlled_supply (float): The daily supply charge of the controlled load.
+        feed_in_rates (numpy.ndarray): float64[7, 48], the feed-in tariff of each weekday
+            and half-hour.
+        discount_bill (numpy.ndarray): float64[2], the guaranteed and conditional
+            fractions of the bill discounted.
+        discount_use (numpy.ndarray): float64[2], the same for fractions of usage charges.
+        discount_fixed (numpy.ndarray): float64[2], the same for dollars per year.
+    """
+
+    __slots__ = ("plan_id", "season_of_day", "bands", "step_rates", "step_limits", "supply",
+                 "controlled_rates", "controlled_supply", "feed_in_rates", "discount_bill",
+                 "discount_use", "discount_fixed")
+
+    def __init__(self, plan_id, season_of_day, bands, step_rates, step_limits, supply,
+                 controlled_rates, controlled_supply, feed_in_rates, discount_bill,
+                 discount_use, discount_fixed):
+        self.plan_id = plan_id
+        self.season_of_day = season_of_day
+        self.bands = bands
+        self.step_rates = step_rates
+        self.step_limits = step_limits
+        self.supply = supply
+        self.controlled_rates = controlled_rates
+        self.controlled_supply = controlled_supply
+        self.feed_in_rates = feed_in_rates
+        self.discount_bill = discount_bill
+        self.discount_use = discount_use
+        self.discount_fixed = discount_fixed
+
+
+def parse_amount(value, default=None):
+    """
+    Args:
+        value: A CDR amount, usually a decimal string.
+        default (float, optional): The value when the amount is missing.
+
+    Returns:
+        float: The amount.
+
+    Raises:
+        TariffError: If the amount is missing without a default, or not a number.
+    """
+    if value is None or value == "":
+        if default is None:
+            raise TariffError("Missing amount")
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise TariffError(f"Invalid amount {value!r}") from None
+
+
+def parse_minutes(value):
+    """
+    Args:
+        value (str): A time of day such as '07:00', '0700' or '07:00:00'.
+
+    Returns:
+        int: Minutes since midnight.
+    """
+    digits = re.sub(r"[^0-9]", "", value or "")[:4]
+    if len(digits) < 3:
+        raise TariffError(f"Invalid time {value!r}")
+    digits = digits.zfill(4)
+    return int(digits[:2]) * 60 + int(digits[2:])
+
+
+def parse_days(days):
+    """
+    Args:
+        days: A list of day names (e.g. ['MON', 'TUE']) or a dict of 'weekdays',
+            'saturday' and 'sunday' flags, as used by older plans. None means every day.
+
+    Returns:
+        list: The weekday numbers, Monday being 0.
+    """
+    if not days:
+        return list(range(7))
+    if isinstance(days, dict):
+        selected = []
+        if days.get("weekdays"):
+            selected.extend(range(5))
+        if days.get("saturday"):
+            selected.append(5)
+        if days.get("sunday"):
+            selected.append(6)
+        return selected
+    selected = set()
+    for day in days:
+        day = str(day).upper()
+        if day in DAY_NAMES:
+            selected.add(DAY_NAMES.index(day))
+        elif day in ("WEEKDAYS", "BUS_DAYS", "BUSINESS_DAYS"):
+            selected.update(range(5))
+        elif day in ("WEEKENDS", "WEEKEND"):
+            selected.update((5, 6))
+        # 'PUBLIC_HOLIDAYS' is not modelled: holidays are priced as their weekday
+    return sorted(selected)
+
+
+def window_mask(windows):
+    """
+    Mark the weekdays and half-hours covered by time windows.
+
+    Args:
+        windows (list): Dicts with 'days', 'startTime' and 'endTime'. A window whose end
+            is not after its start wraps past midnight.
+
+    Returns:
+        numpy.ndarray: bool[7, 48].
+    """
+    mask = np.zeros((7, SLOTS_PER_DAY), dtype=bool)
+    slot_starts = np.arange(SLOTS_PER_DAY) * SLOT_MINUTES
+    for window in windows:
+        start = parse_minutes(window.get("startTime", "00:00"))
+        end = parse_minutes(window.get("endTime", "00:00"))
+        if end > start:
+            slots = (slot_starts >= start) & (slot_starts < end)
+        else:
+            slots = (slot_starts >= start) | (slot_starts < end)
+        for day in parse_days(window.get("days")):
+            mask[day] |= slots
+    return mask
+
+
+def period_factor(period):
+    """
+    Args:
+        period (str): An ISO 8601 duration such as 'P1D', 'P1M' or 'P1Y'.
+
+    Returns:
+        float: How many such periods make a year. Stepped volumes without a period are
+        taken to be per year.
+    """
+    match = re.fullmatch(r"P(\d+)([DWMY])", period or "")
+    if not match:
+        return 1.0
+    count, unit = int(match.group(1)), match.group(2)
+    return {"D": 365.0, "W": 365.0 / 7, "M": 12.0, "Y": 1.0}[unit] / count
+
+
+def compile_steps(rate_block):
+    """
+    Compile the stepped rates of a rate block.
+
+    Args:
+        rate_block (dict): A 'singleRate' or 'timeOfUseRates' entry.
+
+    Returns:
+        tuple: The unit prices and the cumulative kWh per year at which each step ends.
+    """
+    rates = rate_block.get("rates")
+    if not rates:
+        if rate_block.get("generalUnitPrice") is None:
+            raise TariffError("Rate block without rates")
+        rates = [{"unitPrice": rate_block["generalUnitPrice"]}]
+    factor = period_factor(rate_block.get("period"))
+    unit_prices, limits = [], []
+    volume_total = 0.0
+    for position, rate in enumerate(rates):
+        unit_prices.append(parse_amount(rate.get("unitPrice")))
+        volume = rate.get("volume")
+        if position == len(rates) - 1 or volume in (None, ""):
+            limits.append(np.inf)
+            break
+        volume_total += parse_amount(volume) * factor
+        limits.append(volume_total)
+    return unit_prices, limits
+
+
+def compile_time_table(entries, rate_of):
+    """
+    Compile time-varying rates into a rate per weekday and half-hour.
+
+    Args:
+        entries (list): Rate entries, each with its time windows.
+        rate_of (callable): Returns the rate and the windows of an entry.
+
+    Returns:
+        numpy.ndarray: float64[7, 48], zero where no entry applies.
+    """
+    table = np.zeros((7, SLOTS_PER_DAY))
+    for entry in entries:
+        rate, windows = rate_of(entry)
+        table[window_mask(windows)] = rate
+    return table
+
+
+def day_range(start_date, end_date):
+    """
+    Args:
+        start_date (str): The first day as 'MM-DD'.
+        end_date (str): The last day as 'MM-DD'.
+
+    Returns:
+        numpy.ndarray: The days of a leap year covered, wrapping past 31 December.
+    """
+    def day_of_year(value):
+        month, day = (int(part) for part in value.split("-")[-2:])
+        return int(LEAP_MONTH_STARTS[month - 1]) + day - 1
+
+    try:
+        start, end = day_of_year(start_date), day_of_year(end_date)
+    except (AttributeError, ValueError, IndexError):
+        raise TariffError(f"Invalid tariff period dates {start_date!r} to {end_date!r}") from None
+    if end >= start:
+        return np.arange(start, end + 1)
+    return np.concatenate([np.arange(start, DAYS_PER_YEAR), np.arange(0, end + 1)])
+
+
+def compile_tariff(plan_details):
+    """
+    Compile the electricity tariff of a plan.
+
+    Args:
+        plan_details (dict): The plan details, as saved by the sync.
+
+    Returns:
+        CompiledTariff: The compiled tariff.
+
+    Raises:
+        TariffError: If the plan has no electricity contract or it cannot be compiled.
+    """
+    data = plan_details.get("data", plan_details)
+    plan_id = data.get("planId")
+    contract = data.get("electricityContract")
+    if not contract or not contract.get("tariffPeriod"):
+        raise TariffError(f"Plan '{plan_id}' has no electricity tariff")
+
+    season_of_day = np.zeros(DAYS_PER_YEAR, dtype=np.uint8)
+    period_bands, supply, band_steps = [], [], []
+    for period_index, period in enumerate(contract["tariffPeriod"]):
+        if period.get("startDate") and period.get("endDate"):
+            season_of_day[day_range(period["startDate"], period["endDate"])] = period_index
+        supply.append(parse_amount(period.get("dailySupplyCharges"), default=0.0))
+        block_type = period.get("rateBlockUType")
+        if block_type == "timeOfUseRates" or (block_type is None and period.get("timeOfUseRates")):
+            bands = np.full((7, SLOTS_PER_DAY), -1, dtype=np.int16)
+            fallback = None
+            for rate_block in period.get("timeOfUseRates") or []:
+                band = len(band_steps)
+                band_steps.append(compile_steps(rate_block))
+                bands[window_mask(rate_block.get("timeOfUse") or [])] = band
+                if rate_block.get("type") == "OFF_PEAK" and fallback is None:
+                    fallback = band
+            if (bands < 0).any():  # Uncovered times cost the off-peak rate, or else the dearest
+                if fallback is None:
+                    first_band = len(band_steps) - len(period.get("timeOfUseRates") or [])
+                    if first_band == len(band_steps):
+                        raise TariffError(f"Plan '{plan_id}' has a time of use period without rates")
+                    fallback = max(range(first_band, len(band_steps)), key=lambda b: band_steps[b][0][0])
+                bands[bands < 0] = fallback
+        elif block_type == "singleRate" or (block_type is None and period.get("singleRate")):
+            bands = np.full((7, SLOTS_PER_DAY), len(band_steps), dtype=np.int16)
+            band_steps.append(compile_steps(period["singleRate"]))
+        else:
+            raise TariffError(f"Plan '{plan_id}' has an unsupported tariff period '{block_type}'")
+        period_bands.append(bands)
+
+    max_steps = max(len(rates) for rates, _ in band_steps)
+    step_rates = np.zeros((len(band_steps), max_steps))
+    step_limits = np.full((len(band_steps), max_steps), np.inf)
+    for band, (rates, limits) in enumerate(band_steps):
+        step_rates[band, :len(rates)] = rates
+        step_limits[band, :len(limits)] = limits
+
+    controlled_rates, controlled_supply = compile_controlled_load(contract.get("controlledLoad") or [])
+    return CompiledTariff(
+        plan_id=plan_id,
+        season_of_day=season_of_day,
+        bands=np.asarray(period_bands, dtype=np.uint8),
+        step_rates=step_rates,
+        step_limits=step_limits,
+        supply=np.asarray(supply),
+        controlled_rates=controlled_rates,
+        controlled_supply=controlled_supply,
+        feed_in_rates=compile_feed_in(contract.get("solarFeedInTariff") or []),
+        **compile_discounts(contract.get("discounts") or []),
+    )
+
+
+def compile_controlled_load(controlled_loads):
+    """
+    Compile the first controlled load of a plan.
+
+    Args:
+        controlled_loads (list): The 'controlledLoad' entries of the contract.
+
+    Returns:
+        tuple: The rates per weekday and half-hour and the daily supply charge.
+    """
+    if not controlled_loads:
+        return np.zeros((7, SLOTS_PER_DAY)), 0.0
+    controlled_load = controlled_loads[0]
+    if controlled_load.get("rateBlockUType") == "timeOfUseRates":
+        rate_blocks = controlled_load.get("timeOfUseRates") or []
+        table = compile_time_table(
+            rate_blocks, lambda block: (compile_steps(block)[0][0], block.get("timeOfUse") or [])
+        )
+        daily = next((block.get("dailySupplyCharge") for block in rate_blocks
+                      if block.get("dailySupplyCharge")), None)
+    else:
+        rate_block = controlled_load.get("singleRate") or {}
+        table = np.full((7, SLOTS_PER_DAY), compile_steps(rate_block)[0][0])
+        daily = rate_block.get("dailySupplyCharge")
+    daily = daily or controlled_load.get("dailySupplyCharge") or controlled_load.get("dailySupplyCharges")
+    return table, parse_amount(daily, default=0.0)
+
+
+def compile_feed_in(feed_in_tariffs):
+    """
+    Compile the feed-in tariff available to new customers.
+
+    Premium government schemes are closed to new customers, so a retailer tariff is
+    preferred. Only the first step of stepped feed-in rates is used.
+
+    Args:
+        feed_in_tariffs (list): The 'solarFeedInTariff' entries of the contract.
+
+    Returns:
+        numpy.ndarray: float64[7, 48], the feed-in tariff per weekday and half-hour.
+    """
+    candidates = [tariff for tariff in feed_in_tariffs if tariff.get("scheme") != "PREMIUM"]
+    if not candidates:
+        return np.zeros((7, SLOTS_PER_DAY))
+    tariff = candidates[0]
+
+    def first_rate(entry):
+        rates = entry.get("rates")
+        return parse_amount(rates[0].get("unitPrice") if rates else entry.get("amount"), default=0.0)
+
+    if tariff.get("tariffUType") == "timeVaryingTariffs":
+        entries = tariff.get("timeVaryingTariffs") or []
+        if isinstance(entries, dict):  # Older plans have a single entry
+            entries = [entries]
+        return compile_time_table(entries, lambda entry: (first_rate(entry), entry.get("timeVariations") or []))
+    return np.full((7, SLOTS_PER_DAY), first_rate(tariff.get("singleTariff") or {}))
+
+
+def compile_discounts(discounts):
+    """
+    Args:
+        discounts (list): The 'discounts' entries of the contract.
+
+    Returns:
+        dict: The 'discount_bill', 'discount_use' and 'discount_fixed' arrays of
+        guaranteed and conditional discounts.
+    """
+    compiled = {name: np.zeros(2) for name in ("discount_bill", "discount_use", "discount_fixed")}
+    for discount in discounts:
+        kind = GUARANTEED if discount.get("type") == "GUARANTEED" else CONDITIONAL
+        method = discount.get("methodUType")
+        if method == "percentOfBill":
+            compiled["discount_bill"][kind] += parse_amount((discount.get("percentOfBill") or {}).get("rate"), 0.0)
+        elif method == "percentOfUse":
+            compiled["discount_use"][kind] += parse_amount((discount.get("percentOfUse") or {}).get("rate"), 0.0)
+        elif method == "fixedAmount":
+            compiled["discount_fixed"][kind] += parse_amount((discount.get("fixedAmount") or {}).get("amount"), 0.0)
+    return compiled
+
+
+class TariffSet:
+    """
+    The compiled tariffs of many plans, stacked into arrays with a leading plan axis.
+
+    Tariffs are padded to the largest number of tariff periods T, bands B and steps K
+    among them. Plans sharing the same days of the year per tariff period and the same
+    bands per half-hour share a calendar, which is what lets the usage of every band
+    of every plan be computed in one pass.
+
+    Args:
+        tariffs (list): The 'CompiledTariff' of each plan.
+
+    Attributes:
+        plan_ids (list): The plan IDs, in the order of the plan axis.
+        season_maps (numpy.ndarray): uint8[S, 366], the distinct tariff period maps.
+        calendar_bands (numpy.ndarray): uint8[C, T, 7, 48], the bands of each distinct
+            calendar.
+        calendar_season (numpy.ndarray): int[C], the season map of each calendar.
+        calendar_of_plan (numpy.ndarray): int[P], the calendar of each plan.
+    """
+
+    # Arrays with a leading plan axis, and those shared by the plans
+    ARRAY_FIELDS = ("step_rates", "step_limits", "supply", "controlled_rates", "controlled_supply",
+                    "feed_in_rates", "discount_bill", "discount_use", "discount_fixed", "calendar_of_plan")
+    CALENDAR_FIELDS = ("season_maps", "calendar_bands", "calendar_season")
+
+    def __init__(self, tariffs):
+        if not tariffs:
+            raise TariffError("No tariffs to stack")
+        self.plan_ids = [tariff.plan_id for tariff in tariffs]
+        periods = max(len(tariff.supply) for tariff in tariffs)
+        bands = max(tariff.step_rates.shape[0] for tariff in tariffs)
+        steps = max(tariff.step_rates.shape[1] for tariff in tariffs)
+        plans = len(tariffs)
+
+        self.step_rates = np.zeros((plans, bands, steps))
+        self.step_limits = np.full((plans, bands, steps), np.inf)
+        self.supply = np.zeros((plans, periods))
+        self.controlled_rates = np.stack([tariff.controlled_rates for tariff in tariffs])
+        self.controlled_supply = np.array([tariff.controlled_supply for tariff in tariffs])
+        self.feed_in_rates = np.stack([tariff.feed_in_rates for tariff in tariffs])
+        self.discount_bill = np.stack([tariff.discount_bill for tariff in tariffs])
+        self.discount_use = np.stack([tariff.discount_use for tariff in tariffs])
+        self.discount_fixed = np.stack([tariff.discount_fixed for tariff in tariffs])
+
+        season_keys, calendar_keys = {}, {}
+        season_maps, calendar_bands, calendar_season = [], [], []
+        self.calendar_of_plan = np.zeros(plans, dtype=np.intp)
+        for plan, tariff in enumerate(tariffs):
+            band_count, step_count = tariff.step_rates.shape
+            self.step_rates[plan, :band_count, :step_count] = tariff.step_rates
+            # Padded steps end where the last real step does, so they never apply
+            self.step_limits[plan, :band_count, :step_count] = tariff.step_limits
+            self.step_limits[plan, :band_count, step_count:] = tariff.step_limits[:, -1:]
+            self.supply[plan, :len(tariff.supply)] = tariff.supply
+
+            season_key = tariff.season_of_day.tobytes()
+            if season_key not in season_keys:
+                season_keys[season_key] = len(season_maps)
+                season_maps.append(tariff.season_of_day)
+            padded_bands = np.zeros((periods, 7, SLOTS_PER_DAY), dtype=np.uint8)
+            padded_bands[:len(tariff.bands)] = tariff.bands
+            calendar_key = (season_key, padded_bands.tobytes())
+            if calendar_key not in calendar_keys:
+                calendar_keys[calendar_key] = len(calendar_bands)
+                calendar_bands.append(padded_bands)
+                calendar_season.append(season_keys[season_key])
+            self.calendar_of_plan[plan] = calendar_keys[calendar_key]
+
+        self.season_maps = np.asarray(season_maps, dtype=np.uint8)
+        self.calendar_bands = np.asarray(calendar_bands, dtype=np.uint8)
+        self.calendar_season = np.asarray(calendar_season, dtype=np.intp)
+
+    @classmethod
+    def from_arrays(cls, plan_ids, arrays):
+        """
+        Args:
+            plan_ids (list): The plan IDs, in the order of the plan axis.
+            arrays (Mapping): The 'ARRAY_FIELDS' and 'CALENDAR_FIELDS' arrays.
+
+        Returns:
+            TariffSet: The tariff set, using the given arrays without copying them.
+        """
+        tariff_set = cls.__new__(cls)
+        tariff_set.plan_ids = list(plan_ids)
+        for name in cls.ARRAY_FIELDS + cls.CALENDAR_FIELDS:
+            setattr(tariff_set, name, arrays[name])
+        return tariff_set
+
+    def save_arrays(self, directory):
+        """
+        Write every array to its own '.npy' file, so that other processes can map them
+        into memory with 'load_arrays' instead of receiving copies.
+
+        Args:
+            directory (str): An existing directory.
+        """
+        np.save(os.path.join(directory, "plan_ids.npy"), np.array(self.plan_ids, dtype=str))
+        for name in self.ARRAY_FIELDS + self.CALENDAR_FIELDS:
+            np.save(os.path.join(directory, f"{name}.npy"), np.asarray(getattr(self, name)))
+
+    @classmethod
+    def load_arrays(cls, directory, mmap_mode="r"):
+        """
+        Args:
+            directory (str): A directory written by 'save_arrays'.
+            mmap_mode (str, optional): How to map the arrays, or None to read them.
+
+        Returns:
+            TariffSet: The tariff set.
+        """
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in cls.ARRAY_FIELDS + cls.CALENDAR_FIELDS}
+        return cls.from_arrays(np.load(os.path.join(directory, "plan_ids.npy")).tolist(), arrays)
+
+    def subset(self, plans):
+        """
+        Args:
+            plans (array-like): Positions on the plan axis.
+
+        Returns:
+            TariffSet: The tariffs of those plans, in that order, with only the
+            calendars they use.
+        """
+        plans = np.asarray(plans, dtype=np.intp)
+        arrays = {name: np.asarray(getattr(self, name)[plans]) for name in self.ARRAY_FIELDS}
+        calendars, arrays["calendar_of_plan"] = np.unique(arrays["calendar_of_plan"], return_inverse=True)
+        seasons, arrays["calendar_season"] = np.unique(self.calendar_season[calendars], return_inverse=True)
+        arrays["calendar_bands"] = np.asarray(self.calendar_bands[calendars])
+        arrays["season_maps"] = np.asarray(self.season_maps[seasons])
+        return self.from_arrays([self.plan_ids[plan] for plan in plans], arrays)
+
+    def __len__(self):
+        return len(self.plan_ids)
+
+    @property
+    def shape(self):
+        """
+        tuple: The number of plans, tariff periods, bands and steps.
+        """
+        plans, bands, steps = self.step_rates.shape
+        return plans, self.supply.shape[1], bands, steps
+
+
+def pack_tariffs(tariffs):
+    """
+    Concatenate compiled tariffs into flat arrays for saving.
+
+    Args:
+        tariffs (list): 'CompiledTariff' objects.
+
+    Returns:
+        dict: Arrays with a leading plan axis, except for 'bands' and 'supply', which
+        concatenate the tariff periods of all plans, and 'step_rates' and
+        'step_limits', which concatenate their bands.
+    """
+    steps = max(tariff.step_rates.shape[1] for tariff in tariffs)
+    band_counts = [tariff.step_rates.shape[0] for tariff in tariffs]
+    step_rates = np.zeros((sum(band_counts), steps))
+    step_limits = np.full((sum(band_counts), steps), np.inf)
+    band = 0
+    for tariff, band_count in zip(tariffs, band_counts):
+        step_count = tariff.step_rates.shape[1]
+        step_rates[band:band + band_count, :step_count] = tariff.step_rates
+        step_limits[band:band + band_count, :step_count] = tariff.step_limits
+        band += band_count
+    return {
+        "version": np.array(TARIFF_FORMAT_VERSION),
+        "plan_ids": np.array([tariff.plan_id for tariff in tariffs], dtype=str),
+        "period_counts": np.array([len(tariff.supply) for tariff in tariffs], dtype=np.int32),
+        "band_counts": np.array(band_counts, dtype=np.int32),
+        "season_of_day": np.stack([tariff.season_of_day for tariff in tariffs]),
+        "bands": np.concatenate([tariff.bands for tariff in tariffs]),
+        "supply": np.concatenate([tariff.supply for tariff in tariffs]),
+        "step_rates": step_rates,
+        "step_limits": step_limits,
+        **{name: np.stack([getattr(tariff, name) for tariff in tariffs]) for name in (
+            "controlled_rates", "controlled_supply", "feed_in_rates", "discount_bill", "discount_use",
+            "discount_fixed",
+        )},
+    }
+
+
+def unpack_tariffs(arrays):
+    """
+    Split arrays packed by 'pack_tariffs' back into compiled tariffs.
+
+    Args:
+        arrays (Mapping): The packed arrays.
+
+    Returns:
+        list: The 'CompiledTariff' objects.
+
+    Raises:
+        TariffError: If the arrays were packed by another version of this module.
+    """
+    if int(arrays["version"]) != TARIFF_FORMAT_VERSION:
+        raise TariffError(f"Tariffs were compiled by format version {int(arrays['version'])}")
+    period_ends = np.cumsum(arrays["period_counts"])
+    band_ends = np.cumsum(arrays["band_counts"])
+    bands = np.split(arrays["bands"], period_ends[:-1])
+    supply = np.split(arrays["supply"], period_ends[:-1])
+    step_rates = np.split(arrays["step_rates"], band_ends[:-1])
+    step_limits = np.split(arrays["step_limits"], band_ends[:-1])
+    per_plan = {name: arrays[name] for name in (
+        "season_of_day", "controlled_rates", "controlled_supply", "feed_in_rates", "discount_bill",
+        "discount_use", "discount_fixed",
+    )}
+    return [
+        CompiledTariff(
+            plan_id=str(plan_id), bands=bands[plan], supply=supply[plan], step_rates=step_rates[plan],
+            step_limits=step_limits[plan], controlled_supply=float(per_plan["controlled_supply"][plan]),
+            **{name: values[plan] for name, values in per_plan.items() if name != "controlled_supply"},
+        )
+        for plan, plan_id in enumerate(arrays["plan_ids"])
+    ]
+
+
+def encode_tariffs(tariffs, **extra):
+    """
+    Args:
+        tariffs (list): 'CompiledTariff' objects, at least one.
+        **extra: Further arrays saved with them, e.g. one entry per tariff.
+
+    Returns:
+        bytes: The tariffs as a compressed NumPy '.npz' archive.
+    """
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **pack_tariffs(tariffs), **extra)
+    return buffer.getvalue()
+
+
+def decode_tariffs(data):
+    """
+    Args:
+        data (bytes): An archive written by 'encode_tariffs'.
+
+    Returns:
+        tuple: The 'CompiledTariff' objects and a dict of the extra arrays.
+
+    Raises:
+        TariffError: If the archive is unreadable or of another format version.
+    """
+    try:
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+    except (OSError, ValueError, zipfile.BadZipFile) as error:
+        raise TariffError(f"Unreadable tariff archive: {error!r}") from None
+    try:
+        tariffs = unpack_tariffs(arrays)
+    except KeyError as error:
+        raise TariffError(f"Incomplete tariff archive: {error!r}") from None
+    return tariffs, {name: values for name, values in arrays.items() if name not in PACKED_ARRAYS}
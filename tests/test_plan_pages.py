@@ -0,0 +1,84 @@
+"""Tests of fetching a provider's plan list page by page (get_plans.py)."""
+
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import get_plans  # noqa: E402
+from get_plans import IncompletePlanListError, PlanPage, iter_plan_pages_async  # noqa: E402
+
+
+class FakePlanList:
+    """
+    A plan list served page by page, answering conditional requests for unchanged pages
+    with 'Not Modified'.
+
+    Args:
+        pages (dict): A mapping of page numbers to their plans and ETag.
+        total_pages (int): The 'meta.totalPages' reported by every full page.
+    """
+
+    def __init__(self, pages, total_pages):
+        self.pages = pages
+        self.total_pages = total_pages
+        self.requested = []
+
+    async def fetch(self, client, base_url, headers, page, validators=None):
+        await asyncio.sleep(0)
+        self.requested.append(page)
+        if page not in self.pages:
+            return None  # Past the end, failed like an error response
+        plans, etag = self.pages[page]
+        if validators and validators.get("ETag") == etag:
+            return PlanPage(page, None, validators, None)
+        return PlanPage(page, plans, {"ETag": etag}, self.total_pages)
+
+
+def fetch_list(plan_list, validators=None):
+    async def fetch():
+        with mock.patch.object(get_plans, "fetch_plans_page_with_retry_async", plan_list.fetch):
+            return [plans async for plans in iter_plan_pages_async(None, "https://example/", {}, validators)]
+    return asyncio.run(fetch())
+
+
+def saved_validators(etags):
+    return {"totalPages": len(etags), "pages": {str(page): {"ETag": etag} for page, etag in etags.items()}}
+
+
+class PlanPagesTest(unittest.TestCase):
+
+    def test_unchanged_list_yields_nothing(self):
+        plan_list = FakePlanList({1: (["a"], "1"), 2: (["b"], "2")}, 2)
+        self.assertEqual(fetch_list(plan_list, saved_validators({1: "1", 2: "2"})), [])
+
+    def test_grown_list_is_fetched_to_its_new_end(self):
+        plan_list = FakePlanList({1: (["a"], "1"), 2: (["b2"], "2b"), 3: (["c"], "3")}, 3)
+        validators = saved_validators({1: "1", 2: "2"})
+        self.assertEqual(fetch_list(plan_list, validators), [["a"], ["b2"], ["c"]])
+        self.assertEqual(validators["totalPages"], 3)
+        self.assertEqual(set(validators["pages"]), {"1", "2", "3"})
+
+    def test_shrunk_list_stops_at_its_new_end(self):
+        plan_list = FakePlanList({1: (["a"], "1"), 2: (["b2"], "2b")}, 2)
+        validators = saved_validators({1: "1", 2: "2", 3: "3"})
+        self.assertEqual(fetch_list(plan_list, validators), [["a"], ["b2"]])
+        self.assertEqual(validators["totalPages"], 2)
+        self.assertEqual(set(validators["pages"]), {"1", "2"})
+
+    def test_list_of_no_pages_is_empty_not_unchanged(self):
+        plan_list = FakePlanList({1: ([], "0")}, 0)
+        self.assertEqual(fetch_list(plan_list), [[]])
+        self.assertEqual(fetch_list(plan_list, saved_validators({1: "1", 2: "2"})), [[]])
+
+    def test_missing_page_fails_the_list(self):
+        plan_list = FakePlanList({1: (["a"], "1")}, 2)
+        with self.assertRaises(IncompletePlanListError):
+            fetch_list(plan_list)
+
+
+if __name__ == "__main__":
+    unittest.main()
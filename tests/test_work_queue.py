@@ -0,0 +1,62 @@
+"""Tests of the durable per-brand work queue (work_queue.py)."""
+
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import work_queue  # noqa: E402
+from work_queue import WorkQueue  # noqa: E402
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def test_concurrent_checkpoints_leave_no_queue_once_done(self):
+        replace_file = work_queue.replace_file
+
+        def slow_replace_file(filename, data, durable=False):
+            time.sleep(random.uniform(0, 0.005))  # Let the writes of the threads overlap
+            replace_file(filename, data, durable)
+
+        plan_ids = [f"PLAN{number:04d}@EME" for number in range(400)]
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(work_queue, "replace_file", slow_replace_file):
+            queue = WorkQueue(directory)
+            queue.add_details(plan_ids)
+            queue.checkpoint()
+            self.assertTrue(os.path.exists(queue.path))
+
+            def finish(batch):
+                queue.details_done(batch)
+                queue.checkpoint()
+
+            threads = [threading.Thread(target=finish, args=(plan_ids[start:start + 10],))
+                       for start in range(0, len(plan_ids), 10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertFalse(queue)
+            self.assertFalse(os.path.exists(queue.path))
+            self.assertFalse(WorkQueue.load(directory))
+
+    def test_failed_write_is_retried(self):
+        with tempfile.TemporaryDirectory() as directory:
+            queue = WorkQueue(directory)
+            queue.add_details(["PLAN0001@EME"])
+            with mock.patch.object(work_queue, "replace_file", side_effect=OSError("disk full")):
+                with self.assertRaises(OSError):
+                    queue.checkpoint()
+            queue.checkpoint()
+            self.assertEqual(list(WorkQueue.load(directory).details), ["PLAN0001@EME"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+"""Durable per-brand queue of the work a sync still has to do.
+
+Each brand directory holds a 'queue.json' while a sync of the brand is unfinished:
+
+    {
+        "planList": true,
+        "details": ["AGL123@EME", ...],
+        "deletes": ["AGL456@EME", ...],
+        "deadLetter": {
+            "AGL789@EME": {"error": "...", "attempts": 2, "failedAt": "2024-06-21T00:00:00.000Z"}
+        }
+    }
+
+- 'planList' is set before the plan list is fetched, and cleared in the same checkpoint
+  that queues the work found by comparing the fetched list with the saved one, which is
+  written before the new list replaces the old. A sync that dies at any point in
+  between fetches the list again, and one that dies after it still knows which plan
+  details changed, even though the saved list no longer shows it.
+- 'details' are the plan details to download, removed as each batch of them is saved.
+- 'deletes' are the plan details of plans no longer listed, removed once deleted.
+- 'deadLetter' parks the plan details that still failed after 'REQUEUE_ATTEMPTS', with
+  their last error, rather than failing the brand. They are retried once by every later
+  sync of the brand until they succeed.
+
+Checkpoints replace the file atomically and flush it to disk, and the file is removed
+once the queue is empty. The next sync of a brand resumes its queue before anything else.
+To list the queued and parked work of every brand, or clear the dead letters:
+
+    python work_queue.py {list,clear-dead-letters} [--directory brands]
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+from manifest import format_last_downloaded
+from storage import replace_file
+
+QUEUE_NAME = "queue.json"
+
+
+class WorkQueue:
+    """
+    The unfinished sync work of one brand directory.
+
+    Changes are kept in memory until 'checkpoint' is called, and may be made from
+    several worker threads at once.
+
+    Args:
+        directory (str): The brand directory.
+
+    Attributes:
+        plan_list (bool): True if the plan list is being refreshed and the work it
+            implies is not queued yet.
+        details (dict): The plan IDs whose details are to be downloaded, in order (the
+            values are unused).
+        deletes (dict): The plan IDs whose details are to be deleted, in order.
+        dead_letter (dict): A mapping of plan IDs that failed to their last 'error', the
+            number of 'attempts' and when they last failed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, QUEUE_NAME)
+        self.plan_list = False
+        self.details = {}
+        self.deletes = {}
+        self.dead_letter = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # Held while writing, so checkpoints land in order
+        self._dirty = False
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Load the queue of a brand directory.
+
+        Args:
+            directory (str): The brand directory.
+
+        Returns:
+            WorkQueue: The queue, empty if none was saved or it is unreadable.
+        """
+        work_queue = cls(directory)
+        try:
+            with open(work_queue.path, "rb") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return work_queue
+        except (OSError, ValueError) as error:  # The sync re-derives the work from the files
+            logging.warning(f"Ignoring unreadable work queue '{work_queue.path}': {error!r}")
+            return work_queue
+        work_queue.plan_list = bool(data.get("planList"))
+        work_queue.details = dict.fromkeys(data.get("details") or [])
+        work_queue.deletes = dict.fromkeys(data.get("deletes") or [])
+        work_queue.dead_letter = data.get("deadLetter") or {}
+        return work_queue
+
+    def __bool__(self):
+        return bool(self.plan_list or self.details or self.deletes or self.dead_letter)
+
+    def checkpoint(self):
+        """
+        Durably write the queue if it has changed, or remove it once it is empty.
+
+        Checkpoints from several threads write one at a time, each taking its snapshot
+        once the previous one is written, so an older snapshot never replaces a newer
+        one. Changes made meanwhile only wait for '_lock', not for the write.
+        """
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                if not self:
+                    data = None
+                else:
+                    data = json.dumps({"planList": self.plan_list, "details": list(self.details),
+                                       "deletes": list(self.deletes), "deadLetter": self.dead_letter}, indent=4)
+            try:
+                if data is None:
+                    if os.path.exists(self.path):
+                        os.remove(self.path)
+                else:
+                    os.makedirs(self.directory, exist_ok=True)
+                    replace_file(self.path, data.encode(), durable=True)
+            except BaseException:  # Write it again on the next checkpoint
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def start_plan_list(self):
+        """
+        Record that the plan list is about to be fetched.
+        """
+        with self._lock:
+            self.plan_list = True
+            self._dirty = True
+
+    def finish_plan_list(self, detail_ids, delete_ids):
+        """
+        Queue the work found by comparing a fetched plan list with the saved one.
+
+        Args:
+            detail_ids (list): The plan IDs whose details are to be downloaded.
+            delete_ids (list): The plan IDs whose details are to be deleted.
+        """
+        with self._lock:
+            self.plan_list = False
+            self.details.update(dict.fromkeys(detail_ids))
+            self.deletes.update(dict.fromkeys(delete_ids))
+            for plan_id in delete_ids:
+                self.details.pop(plan_id, None)
+                self.dead_letter.pop(plan_id, None)
+            self._dirty = True
+
+    def add_details(self, plan_ids):
+        """
+        Args:
+            plan_ids (list): Further plan IDs whose details are to be downloaded.
+        """
+        with self._lock:
+            new_ids = [plan_id for plan_id in plan_ids if plan_id not in self.details]
+            if new_ids:
+                self.details.update(dict.fromkeys(new_ids))
+                self._dirty = True
+
+    def pending_details(self):
+        """
+        Returns:
+            list: The queued plan IDs followed by the parked ones, which are retried.
+        """
+        with self._lock:
+            return list(self.details) + [plan_id for plan_id in self.dead_letter if plan_id not in self.details]
+
+    def details_done(self, plan_ids):
+        """
+        Record that plan details were saved, or found to be unchanged.
+
+        Args:
+            plan_ids (list): The plan IDs.
+        """
+        with self._lock:
+            for plan_id in plan_ids:
+                if plan_id in self.details or plan_id in self.dead_letter:
+                    self.details.pop(plan_id, None)
+                    self.dead_letter.pop(plan_id, None)
+                    self._dirty = True
+
+    def deletes_done(self, plan_ids):
+        """
+        Args:
+            plan_ids (list): The plan IDs whose details were deleted.
+        """
+        with self._lock:
+            for plan_id in plan_ids:
+                if plan_id in self.deletes:
+                    del self.deletes[plan_id]
+                    self._dirty = True
+
+    def park(self, plan_id, error):
+        """
+        Move plan details that keep failing to the dead letters.
+
+        Args:
+            plan_id (str): The plan ID.
+            error (str): The last error.
+        """
+        with self._lock:
+            self.details.pop(plan_id, None)
+            entry = self.dead_letter.get(plan_id) or {"attempts": 0}
+            self.dead_letter[plan_id] = {"error": error, "attempts": entry["attempts"] + 1,
+                                         "failedAt": format_last_downloaded()}
+            self._dirty = True
+
+    def clear_dead_letters(self):
+        """
+        Drop the parked plan details, which later syncs then no longer retry.
+
+        Returns:
+            int: The number of dead letters dropped.
+        """
+        with self._lock:
+            cleared = len(self.dead_letter)
+            if cleared:
+                self.dead_letter = {}
+                self._dirty = True
+            return cleared
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or clear the unfinished sync work of every brand.")
+    parser.add_argument("command", choices=("list", "clear-dead-letters"))
+    parser.add_argument("--directory", default="brands", help="The root of the store (default: brands).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    for brand in sorted(os.listdir(args.directory)) if os.path.isdir(args.directory) else []:
+        brand_directory = os.path.join(args.directory, brand)
+        if not os.path.isfile(os.path.join(brand_directory, QUEUE_NAME)):
+            continue
+        work_queue = WorkQueue.load(brand_directory)
+        if args.command == "clear-dead-letters":
+            cleared = work_queue.clear_dead_letters()
+            if cleared:
+                work_queue.checkpoint()
+                logging.info(f"Cleared {cleared} dead letters of '{brand}'")
+            continue
+        print(f"{brand}: {'plan list, ' if work_queue.plan_list else ''}{len(work_queue.details)} plan details, "
+              f"{len(work_queue.deletes)} deletes, {len(work_queue.dead_letter)} dead letters")
+        for plan_id, entry in work_queue.dead_letter.items():
+            print(f"    {plan_id}: {entry['attempts']} attempts, last at {entry['failedAt']}: {entry['error']}")
+
+
+if __name__ == "__main__":
+    main()